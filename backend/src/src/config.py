@@ -5,6 +5,7 @@ Environment variables have to be defined in template.yaml
 as environment variables for Lambda functions.
 """
 
+from pathlib import Path
 import datetime as dt
 import pytz
 
@@ -27,8 +28,18 @@ EMERGENCY_BREAK = 100
 
 # check which are already prepared
 VERSION_PREFIX = "v7"
+
+# zstd dictionary of compressed tiles of VERSION_PREFIX (trained by prep),
+# tiles of versions without one are plain pickles
+TILES_DICT_FILE = Path(__file__).parent / "dicts" / f"{VERSION_PREFIX}.zdict"
 TIME_RANGES = ("2020-2024", "2024")
 
+# years with per-year partials, any range of them can be merged
+YEARS = (2020, 2021, 2022, 2023, 2024)
+
+# concurrent downloads of objs per request
+FETCH_THREADS = 16
+
 MONTHS = {
     "Jan": 1,
     "Feb": 2,
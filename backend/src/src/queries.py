@@ -1,10 +1,13 @@
 """GraphQL Query resolvers"""
 
 from itertools import product
+from concurrent.futures import ThreadPoolExecutor
 from ariadne import QueryType
 from src.__version__ import CI_PIPELINE_ID, BUILD_DATE
 from src.config import (
     TIME_RANGES,
+    YEARS,
+    FETCH_THREADS,
     MONTHS,
     MONTH_NAMES,
     DIRECTIONS,
@@ -17,7 +20,8 @@ from src.config import (
     CURRENT_IDXS,
 )
 import src.s3 as s3
-from src.utils import get_lngs_map, get_lats_map
+from src.utils import get_lngs_map, get_lats_map, merge_moments
+from src.utils import sample_tiles, share_std_err
 
 query = QueryType()
 
@@ -29,6 +33,7 @@ def resolve_meta(*_, **unused):
         "ciPipelineId": CI_PIPELINE_ID,
         "buildDate": BUILD_DATE,
         "timeRanges": TIME_RANGES,
+        "years": YEARS,
         "months": MONTH_NAMES,
         "directions": DIRECTIONS,
         "windVelocities": WINDS,
@@ -37,56 +42,166 @@ def resolve_meta(*_, **unused):
     }
 
 
+def _fetch_objs(
+    labels: list, month: int, lats_lngs: list[tuple[int, int]], by_year: bool
+) -> list[list[dict]]:
+    """Fetch objs of all labels (time ranges or years) for each lat-lng concurrently"""
+
+    def fetch(job: tuple) -> dict:
+        (lat, lng), label = job
+        if by_year:
+            return s3.get_year_obj(year=label, month=month, lat=lat, lng=lng)
+        return s3.get_obj(years=label, month=month, lat=lat, lng=lng)
+
+    jobs = list(product(lats_lngs, labels))
+    with ThreadPoolExecutor(max_workers=FETCH_THREADS) as executor:
+        objs = list(executor.map(fetch, jobs))
+    n = len(labels)
+    return [objs[i : i + n] for i in range(0, len(objs), n)]
+
+
+def _add_merged(records: list, datas: list[dict], key: str, names: list[str]):
+    """Merge per-year partials of key and add them to records (like in prep)"""
+    partials = [d[key] for d in datas if key in d]
+    if len(partials) == 0:
+        return
+    merged = merge_moments(partials, names=names)
+    if key == "rains":
+        merged["dailyMean"] *= 3  # sums were only of every 3rd hour
+    else:
+        for name in names:
+            merged[f"{name}Mean"] -= 273.15  # K to C
+    records.append(merged)
+
+
+def _years(inputs: dict) -> list[int] | None:
+    """Get years from fromYear/toYear, None if a time range was requested"""
+    from_year = inputs.get("fromYear")
+    to_year = inputs.get("toYear")
+    if from_year is None and to_year is None:
+        return None
+    from_year = to_year if from_year is None else from_year
+    to_year = from_year if to_year is None else to_year
+    if from_year > to_year or from_year not in YEARS or to_year not in YEARS:
+        raise ValueError(f"fromYear <= toYear must be in: {YEARS}")
+    return list(range(from_year, to_year + 1))
+
+
+def _scale_sample(
+    totals: dict[str, dict],
+    tiles_counts: list[dict],
+    lats_lngs: list[tuple[int, int]],
+    lats_map: dict[int, list[float]],
+    lngs_map: dict[int, list[float]],
+) -> dict:
+    """
+    Scale counts of sampled tiles up to all positions of the area (in place)
+    and estimate how far shares of counts might be off
+    """
+    ntiles = len(lats_map) * len(lngs_map)
+    npos = sum(len(d) for d in lats_map.values()) * sum(
+        len(d) for d in lngs_map.values()
+    )
+    npos_sampled = sum(len(lats_map[d]) * len(lngs_map[v]) for d, v in lats_lngs)
+    scale = npos / npos_sampled
+    for counts in totals.values():
+        for key, count in counts.items():
+            counts[key] = round(count * scale)
+    std_errs = [
+        share_std_err([d[k] for d in tiles_counts], ntiles=ntiles) for k in totals
+    ]
+    return {
+        "tiles": ntiles,
+        "sampledTiles": len(lats_lngs),
+        "scale": scale,
+        "shareStdErr": max(std_errs),
+    }
+
+
 @query.field("weather")
 def resolve_weather(*_, **kwargs):
     inputs = kwargs["input"]
-    time_range = inputs["timeRange"]
+    time_range = inputs.get("timeRange")
     month = inputs["month"]
     from_lat = inputs["fromLat"]
     to_lat = inputs["toLat"]
     from_lng = inputs["fromLng"]
     to_lng = inputs["toLng"]
 
-    if time_range not in TIME_RANGES:
+    years = _years(inputs)
+    if years is None and time_range not in TIME_RANGES:
         raise ValueError(f"timeRange must be one of: {TIME_RANGES}")
+    if years is not None and time_range is not None:
+        raise ValueError("Either timeRange or fromYear/toYear")
     if month not in MONTH_NAMES:
         raise ValueError(f"Month must be one of {MONTH_NAMES}")
+    labels = [time_range] if years is None else years
 
     # TODO: new variables:
     # wind, rain, current, temp, seatemp, wave
 
     lats_map = get_lats_map(floor=from_lat, ceil=to_lat)
     lngs_map = get_lngs_map(floor=from_lng, ceil=to_lng)
-    if len(lats_map) * len(lngs_map) > EMERGENCY_BREAK:
-        raise ValueError(
-            f"Stop: tried to download {len(lats_map) * len(lngs_map):,} objs"
+    lats, lngs = list(lats_map), list(lngs_map)
+    n_objs = len(lats) * len(lngs) * len(labels)
+    if n_objs > EMERGENCY_BREAK:
+        if not inputs.get("approximate", False):
+            raise ValueError(f"Stop: tried to download {n_objs:,} objs")
+        lats, lngs = sample_tiles(
+            lats=lats, lngs=lngs, n=EMERGENCY_BREAK // len(labels)
         )
 
-    winds = {(d, v): 0 for d, v in product(DIR_IDXS, WIND_IDXS)}
-    currents = {(d, v): 0 for d, v in product(DIR_IDXS, CURRENT_IDXS)}
-    waves = {str(d["idx"]): 0 for d in WAVES}
+    lats_lngs = list(product(lats, lngs))
+    tile_objs = _fetch_objs(
+        labels=labels,
+        month=MONTHS[month],
+        lats_lngs=lats_lngs,
+        by_year=years is not None,
+    )
+
+    totals = {
+        "winds": {(d, v): 0 for d, v in product(DIR_IDXS, WIND_IDXS)},
+        "currents": {(d, v): 0 for d, v in product(DIR_IDXS, CURRENT_IDXS)},
+        "waves": {str(d["idx"]): 0 for d in WAVES},
+    }
+    tiles_counts: list[dict] = []
     rains = []
     temps = []
     seatemps = []
-    for lat, lng in product(lats_map, lngs_map):
-        obj = s3.get_obj(years=time_range, month=MONTHS[month], lat=lat, lng=lng)
+    for (lat, lng), objs in zip(lats_lngs, tile_objs):
+        tile_counts: dict = {k: {} for k in totals}
         for pos in product(lngs_map[lng], lats_map[lat]):
-            data = obj[pos]
-            if "temps" in data:
-                temps.append(data["temps"])
-            if "rains" in data:
-                rains.append(data["rains"])
-            if "winds" in data:
-                for key, count in data["winds"].items():
-                    winds[key] += count
-            if "currents" in data:
-                for key, count in data["currents"].items():
-                    currents[key] += count
-            if "seatemps" in data:
-                seatemps.append(data["seatemps"])
-            if "waves" in data:
-                for key, count in data["waves"].items():
-                    waves[key] += count
+            datas = [d[pos] for d in objs]
+            if years is None:
+                data = datas[0]
+                if "temps" in data:
+                    temps.append(data["temps"])
+                if "rains" in data:
+                    rains.append(data["rains"])
+                if "seatemps" in data:
+                    seatemps.append(data["seatemps"])
+            else:
+                _add_merged(temps, datas, "temps", names=["high", "low"])
+                _add_merged(rains, datas, "rains", names=["daily"])
+                _add_merged(seatemps, datas, "seatemps", names=["high", "low"])
+            for data, (kind, counts) in product(datas, tile_counts.items()):
+                for key, count in data.get(kind, {}).items():
+                    counts[key] = counts.get(key, 0) + count
+        for kind, counts in tile_counts.items():
+            for key, count in counts.items():
+                totals[kind][key] += count
+        tiles_counts.append(tile_counts)
+
+    sampling = None
+    if len(lats_lngs) < len(lats_map) * len(lngs_map):
+        sampling = _scale_sample(
+            totals=totals,
+            tiles_counts=tiles_counts,
+            lats_lngs=lats_lngs,
+            lats_map=lats_map,
+            lngs_map=lngs_map,
+        )
+    winds, currents, waves = totals["winds"], totals["currents"], totals["waves"]
 
     return {
         "windRecords": [
@@ -99,6 +214,7 @@ def resolve_weather(*_, **kwargs):
         "tempRecords": temps,
         "seatempRecords": seatemps,
         "waveRecords": [{"height": k, "count": d} for k, d in waves.items()],
+        "sampling": sampling,
     }
 
 
@@ -1,15 +1,57 @@
 """
-S3 client/resource requests
+S3 client requests
+
+Tiles are pickled records, compressed with the zstd dictionary
+of their version if prep trained one (see TILES_DICT_FILE).
+Compressed ones start with the zstd magic number.
 """
 
+from functools import lru_cache
 import pickle
+import threading
 import boto3
 from src.config import CONTENT_BUCKET_NAME, AWS_REGION, VERSION_PREFIX
+from src.config import TILES_DICT_FILE
+
+try:
+    import zstandard
+except ImportError:  # only plain pickled tiles can be read
+    zstandard = None  # type: ignore
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# unlike resources clients can be shared between threads
+client = boto3.client("s3", region_name=AWS_REGION)
+
+# decompressors cannot be shared between threads
+_local = threading.local()
 
-resource = boto3.resource("s3", region_name=AWS_REGION)
+
+@lru_cache(maxsize=1)
+def _dictionary() -> bytes:
+    if zstandard is None:
+        raise RuntimeError("Tiles are compressed, but zstandard is not installed")
+    if not TILES_DICT_FILE.is_file():
+        raise RuntimeError(f"Tiles are compressed, but there is no {TILES_DICT_FILE}")
+    return TILES_DICT_FILE.read_bytes()
+
+
+def decode(body: bytes) -> dict:
+    """Unpickle tile, decompressed first if it is compressed"""
+    if body[:4] == ZSTD_MAGIC:
+        if not hasattr(_local, "dctx"):
+            dict_data = zstandard.ZstdCompressionDict(_dictionary())
+            _local.dctx = zstandard.ZstdDecompressor(dict_data=dict_data)
+        body = _local.dctx.decompress(body)
+    return pickle.loads(body)
 
 
 def get_obj(years: str, month: int, lat: int, lng: int) -> dict:
     key = f"{VERSION_PREFIX}/{years}/{month}/{lat}/{lng}/data.pkl"
-    bkt_obj = resource.Bucket(CONTENT_BUCKET_NAME).Object(key).get()  # type: ignore
-    return pickle.loads(bkt_obj["Body"].read())
+    res = client.get_object(Bucket=CONTENT_BUCKET_NAME, Key=key)
+    return decode(res["Body"].read())
+
+
+def get_year_obj(year: int, month: int, lat: int, lng: int) -> dict:
+    """Get obj with mergeable partials of a single year"""
+    return get_obj(years=f"partial/{year}", month=month, lat=lat, lng=lng)
@@ -2,6 +2,8 @@
 functions that didnt find a better place yet
 """
 
+import math
+
 # in s3 there is one obj for each full minutes lat-lng
 # which has data for a quarter mile grid
 OBJ_COORD_PARTS = [0.0, 0.25, 0.5, 0.75]
@@ -91,3 +93,61 @@ def get_lats_map(floor: float, ceil: float) -> dict[int, list[float]]:
     end = full[-1]
     out[end] = [end + d for d in OBJ_COORD_PARTS if end + d <= ceil]
     return {k: d for k, d in out.items() if -70 <= k < 70}
+
+
+def merge_moments(records: list[dict], names: list[str]) -> dict[str, float]:
+    """
+    Merge per-year records with count, sum and sum of squares
+    (_e.g._ highCount, highSum, highSumsq for name high) by adding them up.
+    Get mean and (population) std for each name (_e.g._ highMean, highStd).
+    """
+    out = {}
+    for name in names:
+        count = sum(d[f"{name}Count"] for d in records)
+        mean = sum(d[f"{name}Sum"] for d in records) / count
+        var = sum(d[f"{name}Sumsq"] for d in records) / count - mean**2
+        out[f"{name}Mean"] = mean
+        out[f"{name}Std"] = math.sqrt(max(var, 0.0))
+    return out
+
+
+def spread(keys: list[int], n: int) -> list[int]:
+    """Pick n keys evenly spread over keys (center of n equal strata)"""
+    if n >= len(keys):
+        return list(keys)
+    return [keys[int((i + 0.5) * len(keys) / n)] for i in range(n)]
+
+
+def sample_tiles(lats: list[int], lngs: list[int], n: int) -> tuple[list, list]:
+    """
+    Get lats and lngs of a grid of at most n tiles evenly spread over
+    all tiles of lats x lngs (in order, lngs can wrap around 180°).
+    Rows and columns are split in proportion to the number of lats and lngs.
+    """
+    n = max(n, 1)
+    nlats = round(math.sqrt(n * len(lats) / len(lngs)))
+    nlats = max(1, min(nlats, len(lats), n))
+    nlngs = max(1, min(n // nlats, len(lngs)))
+    return spread(lats, n=nlats), spread(lngs, n=nlngs)
+
+
+def share_std_err(tiles: list[dict], ntiles: int) -> float:
+    """
+    Estimate the standard error of the share of each key of counts
+    summed over a sample of tiles (ratio estimator of a cluster sample,
+    with finite population correction for ntiles tiles in total).
+    Returns the largest one (0 to 1), 0 if there are less than 2 tiles.
+    """
+    n = len(tiles)
+    totals = [sum(d.values()) for d in tiles]
+    if n < 2 or sum(totals) == 0:
+        return 0.0
+    mean_total = sum(totals) / n
+    fpc = max(1 - n / ntiles, 0.0)
+    out = 0.0
+    for key in set(k for d in tiles for k in d):
+        share = sum(d.get(key, 0) for d in tiles) / sum(totals)
+        resid = sum((d.get(key, 0) - share * t) ** 2 for d, t in zip(tiles, totals))
+        var = fpc * resid / (n * (n - 1) * mean_total**2)
+        out = max(out, math.sqrt(var))
+    return out
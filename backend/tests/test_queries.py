@@ -0,0 +1,89 @@
+from unittest.mock import patch
+import pytest
+from src.queries import resolve_weather
+
+POS = (1.0, 2.0)
+
+
+def _year_obj(year: int, **_) -> dict:
+    n = year - 2019
+    data = {
+        "temps": {
+            "highCount": n,
+            "highSum": n * 293.15,
+            "highSumsq": n * 293.15**2,
+            "lowCount": n,
+            "lowSum": n * 283.15,
+            "lowSumsq": n * 283.15**2,
+        },
+        "winds": {("1", "1"): n},
+    }
+    return {POS: data}
+
+
+def _weather(**inputs) -> dict:
+    inputs = {
+        "month": "Jan",
+        "fromLat": POS[1],
+        "toLat": POS[1],
+        "fromLng": POS[0],
+        "toLng": POS[0],
+        **inputs,
+    }
+    return resolve_weather(input=inputs)
+
+
+def test_weather_merges_years():
+    with patch("src.s3.get_year_obj", side_effect=_year_obj) as get_year_obj:
+        res = _weather(fromYear=2021, toYear=2023)
+
+    assert sorted(d.kwargs["year"] for d in get_year_obj.call_args_list) == [
+        2021,
+        2022,
+        2023,
+    ]
+    temps = res["tempRecords"]
+    assert len(temps) == 1
+    assert temps[0]["highMean"] == pytest.approx(20.0)
+    assert temps[0]["lowMean"] == pytest.approx(10.0)
+    assert temps[0]["highStd"] == pytest.approx(0.0, abs=1e-3)
+    winds = {(d["dir"], d["vel"]): d["count"] for d in res["windRecords"]}
+    assert winds[("1", "1")] == 2 + 3 + 4
+
+
+@pytest.mark.parametrize(
+    "inputs",
+    [
+        {"fromYear": 2023, "toYear": 2021},
+        {"fromYear": 1999},
+        {"timeRange": "2024", "fromYear": 2024},
+        {"timeRange": "1999"},
+    ],
+)
+def test_weather_rejects_wrong_years(inputs):
+    with pytest.raises(ValueError):
+        _weather(**inputs)
+
+
+def _tile_obj(lat: int, lng: int, **_) -> dict:
+    parts = [0.0, 0.25, 0.5, 0.75]
+    return {
+        (lng + d, lat + v): {"winds": {("1", "1"): 1}} for d in parts for v in parts
+    }
+
+
+def test_weather_approximates_large_area():
+    area = {"fromLat": 0, "toLat": 19.75, "fromLng": 0, "toLng": 19.75}
+    with pytest.raises(ValueError):
+        _weather(timeRange="2024", **area)
+
+    with patch("src.s3.get_obj", side_effect=_tile_obj) as get_obj:
+        res = _weather(timeRange="2024", approximate=True, **area)
+
+    assert get_obj.call_count == 100
+    assert res["sampling"]["tiles"] == 400
+    assert res["sampling"]["sampledTiles"] == 100
+    assert res["sampling"]["scale"] == pytest.approx(4.0)
+    assert res["sampling"]["shareStdErr"] == pytest.approx(0.0)
+    winds = {(d["dir"], d["vel"]): d["count"] for d in res["windRecords"]}
+    assert winds[("1", "1")] == 80 * 80
@@ -0,0 +1,52 @@
+import io
+import pickle
+import random
+import threading
+import pytest
+import zstandard
+import src.s3 as s3
+
+
+def _record(seed: int) -> dict:
+    rng = random.Random(seed)
+    return {
+        (d / 4, v / 4): {"winds": {(str(i), "1"): rng.randint(0, 9) for i in range(16)}}
+        for d in range(4)
+        for v in range(4)
+    }
+
+
+@pytest.fixture
+def dict_file(tmp_path, monkeypatch):
+    samples = [pickle.dumps(_record(d)) for d in range(200)]
+    file = tmp_path / "v.zdict"
+    file.write_bytes(zstandard.train_dictionary(8192, samples).as_bytes())
+    monkeypatch.setattr(s3, "TILES_DICT_FILE", file)
+    monkeypatch.setattr(s3, "_local", threading.local())
+    s3._dictionary.cache_clear()
+    yield file
+    s3._dictionary.cache_clear()
+
+
+def test_get_obj_reads_compressed_and_plain_tiles(dict_file, monkeypatch):
+    dict_data = zstandard.ZstdCompressionDict(dict_file.read_bytes())
+    cctx = zstandard.ZstdCompressor(level=10, dict_data=dict_data)
+    record = _record(999)
+    bodies = [cctx.compress(pickle.dumps(record)), pickle.dumps(record)]
+    monkeypatch.setattr(
+        s3.client,
+        "get_object",
+        lambda **_: {"Body": io.BytesIO(bodies.pop(0))},
+    )
+    assert s3.get_obj(years="2024", month=1, lat=0, lng=0) == record
+    assert s3.get_obj(years="2024", month=1, lat=0, lng=0) == record
+
+
+def test_decode_needs_dictionary(tmp_path, monkeypatch):
+    monkeypatch.setattr(s3, "TILES_DICT_FILE", tmp_path / "missing.zdict")
+    monkeypatch.setattr(s3, "_local", threading.local())
+    s3._dictionary.cache_clear()
+    body = zstandard.ZstdCompressor().compress(pickle.dumps({}))
+    with pytest.raises(RuntimeError):
+        s3.decode(body)
+    s3._dictionary.cache_clear()
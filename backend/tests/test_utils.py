@@ -5,6 +5,9 @@ from src.utils import (
     full_minutes,
     get_lngs_map,
     get_lats_map,
+    merge_moments,
+    sample_tiles,
+    share_std_err,
 )
 
 
@@ -124,3 +127,42 @@ def test_correct_lats_map(n, m, exp):
     assert set(res.keys()) == set(exp.keys())
     for key in res:
         assert res[key] == exp[key]
+
+
+def test_merge_moments_like_all_samples():
+    years = [[1.0, 2.0, 4.0], [3.0, 5.0], [7.0]]
+    records = [
+        {
+            "highCount": len(d),
+            "highSum": sum(d),
+            "highSumsq": sum(x**2 for x in d),
+        }
+        for d in years
+    ]
+    res = merge_moments(records, names=["high"])
+    samples = [x for d in years for x in d]
+    mean = sum(samples) / len(samples)
+    std = (sum((x - mean) ** 2 for x in samples) / len(samples)) ** 0.5
+    assert res == pytest.approx({"highMean": mean, "highStd": std})
+
+
+def test_sample_tiles_evenly_spread():
+    lats = list(range(-10, 10))
+    lngs = list(range(170, 180)) + list(range(-180, -150))  # wraps around
+    res_lats, res_lngs = sample_tiles(lats=lats, lngs=lngs, n=50)
+    assert len(res_lats) * len(res_lngs) <= 50
+    assert (len(res_lats), len(res_lngs)) == (5, 10)
+    assert res_lats == [-8, -4, 0, 4, 8]
+    assert res_lngs[0] == 172 and res_lngs[-1] == -152
+    assert sample_tiles(lats=lats, lngs=lngs, n=1000) == (lats, lngs)
+    assert sample_tiles(lats=[1], lngs=lngs, n=3) == ([1], [176, -170, -157])
+
+
+def test_share_std_err():
+    same = [{"a": 2, "b": 6}, {"a": 1, "b": 3}, {"a": 3, "b": 9}]
+    assert share_std_err(same, ntiles=100) == pytest.approx(0.0)
+    assert share_std_err(same[:1], ntiles=100) == 0.0
+    mixed = [{"a": 4}, {"b": 4}, {"a": 2, "b": 2}]
+    assert share_std_err(mixed, ntiles=100) == pytest.approx(0.2843, abs=1e-4)
+    # all tiles were sampled
+    assert share_std_err(mixed, ntiles=3) == pytest.approx(0.0)
@@ -0,0 +1,89 @@
+"""
+Benchmark direction x velocity counting on synthetic u/v data.
+
+    python -m benchmarks.bench_aggregate --help
+
+Compares the per-combination loop that was used before
+with the single bincount in aggregate._count_joint.
+"""
+
+import time
+from argparse import ArgumentParser
+from itertools import product
+import numpy as np
+from src.aggregate import _bin, _bin_dirs, _count_joint
+from src.config import DIRECTIONS, WIND_VELS
+from src.util import direction, velocity
+
+
+def _synthetic_uv(cells: int, steps: int, seed=42) -> tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    u = rng.normal(scale=6.0, size=(cells, steps))
+    v = rng.normal(scale=6.0, size=(cells, steps))
+    return u, v
+
+
+def _count_loop(u: np.ndarray, v: np.ndarray) -> np.ndarray:
+    dir_idxs = [d["i"] for d in DIRECTIONS[:-1]]
+    vel_idxs = [d["i"] for d in WIND_VELS]
+    dir_vel_idxs = list(product(dir_idxs, vel_idxs))
+    D = _bin(direction(u=u, v=v, is_wind=True), by=DIRECTIONS)
+    D[D == 17] = 1
+    V = _bin(velocity(u=u, v=v), by=WIND_VELS)
+    C = np.zeros((u.shape[0], len(dir_vel_idxs)), dtype=int)
+    for ci, (dr, vl) in enumerate(dir_vel_idxs):
+        C[:, ci] += np.sum((D == dr) & (V == vl), axis=1)
+    return C
+
+
+def _count_fused(u: np.ndarray, v: np.ndarray) -> np.ndarray:
+    D = _bin_dirs(direction(u=u, v=v, is_wind=True))
+    V = _bin(velocity(u=u, v=v), by=WIND_VELS)
+    return _count_joint(D, V, nvels=len(WIND_VELS))
+
+
+def _timeit(fun, *args, repeat: int) -> tuple[float, np.ndarray]:
+    best = float("inf")
+    res = np.empty(0)
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        res = fun(*args)
+        best = min(best, time.perf_counter() - t0)
+    return best, res
+
+
+def main(kwargs: dict):
+    u, v = _synthetic_uv(cells=kwargs["cells"], steps=kwargs["steps"])
+    t_loop, C_loop = _timeit(_count_loop, u, v, repeat=kwargs["repeat"])
+    t_fused, C_fused = _timeit(_count_fused, u, v, repeat=kwargs["repeat"])
+    assert np.array_equal(C_loop, C_fused), "fused counts differ from loop counts"
+
+    n = u.size
+    print(f"{kwargs['cells']:,} cells x {kwargs['steps']:,} timesteps")
+    print(f"loop:  {t_loop:.3f}s ({n / t_loop:,.0f} samples/s)")
+    print(f"fused: {t_fused:.3f}s ({n / t_fused:,.0f} samples/s)")
+    print(f"speedup: {t_loop / t_fused:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--cells",
+        default=20_000,
+        type=int,
+        help="Number of grid cells (default %(default)s)",
+    )
+    parser.add_argument(
+        "--steps",
+        default=248,
+        type=int,
+        help="Number of timesteps per cell (default %(default)s, 31 days x 8)",
+    )
+    parser.add_argument(
+        "--repeat",
+        default=3,
+        type=int,
+        help="Take the best of this many runs (default %(default)s)",
+    )
+    args = parser.parse_args()
+    main(vars(args))
@@ -0,0 +1,329 @@
+"""
+Benchmark pipeline stages on synthetic data.
+
+    python -m benchmarks.bench_pipeline --help
+
+Generates inputs with benchmarks.synthetic for about --cells grid cells,
+then times extraction (ERA5 GRIB, ORAS5 NetCDF), decoding GRIB straight
+into a partial (store stream), snapping ORAS5 points to the grid, each
+aggregation (wind also with 4 processes sharing memory) and the upload of
+tiles to a local directory instead of S3. Reports cells (tiles for upload)
+per second and peak memory of each job. Results can be saved and later runs
+compared against them, failing if a job got slower or uses more memory.
+"""
+
+import json
+import math
+import sys
+import tempfile
+from argparse import ArgumentParser
+from functools import partial
+from pathlib import Path
+from typing import Callable
+import numpy as np
+import pandas as pd
+from src import aggregate
+from src import era5
+from src import oras5
+from src import s3
+from src import upload
+from src.profiling import measure
+from tests import rawfiles
+from benchmarks import synthetic
+
+_YEARS = [2020, 2021]
+_MONTH = 1
+
+
+class _LocalStore:
+    """Objects as files in a directory, replacing S3 reads and writes"""
+
+    def __init__(self, rootdir: Path):
+        self.rootdir = rootdir
+
+    def put_bytes(self, key: str, body: bytes):
+        file = self.rootdir / key
+        file.parent.mkdir(parents=True, exist_ok=True)
+        file.write_bytes(body)
+
+    def get_bytes(self, key: str) -> bytes | None:
+        file = self.rootdir / key
+        return file.read_bytes() if file.is_file() else None
+
+
+def _generate(datadir: Path, cells: int, days: int):
+    lon_range, lat_range = synthetic.region(cells=cells)
+    for year in _YEARS:
+        for variable in rawfiles.VALUES:
+            synthetic.extracted(
+                datadir=datadir,
+                variable=variable,
+                year=year,
+                month=_MONTH,
+                lon_range=lon_range,
+                lat_range=lat_range,
+                days=days,
+            )
+    rawfiles.raw_grib(
+        datadir=datadir,
+        variable="2m_temperature",
+        year=_YEARS[0],
+        month=_MONTH,
+        lon_range=lon_range,
+        lat_range=lat_range,
+        days=days,
+    )
+    rawfiles.raw_oras5(
+        datadir=datadir,
+        variable="rotated_zonal_velocity",
+        year=_YEARS[0],
+        months=[_MONTH],
+        lon_range=lon_range,
+        lat_range=lat_range,
+    )
+
+
+def _digitize(points: pd.DataFrame, lon_range: tuple, lat_range: tuple) -> int:
+    df = points.copy()
+    oras5._digitize(df=df, var="lon", interval=lon_range, res=0.25)
+    oras5._digitize(df=df, var="lat", interval=lat_range, res=0.25)
+    return len(df)
+
+
+def _regrid(points: pd.DataFrame, lon_range: tuple, lat_range: tuple) -> int:
+    oras5._regrid(
+        lons=points["lon"].to_numpy(),
+        lats=points["lat"].to_numpy(),
+        values=points[["l0", "l1"]].to_numpy(),
+        lon_range=lon_range,
+        lat_range=lat_range,
+        res=0.25,
+    )
+    return len(points)
+
+
+def _aggregate(fun: Callable, name: str, datadir: Path) -> int:
+    # partials are computed again
+    for year in _YEARS:
+        aggregate._partial_file(datadir, name=name, year=year, month=_MONTH).unlink(
+            missing_ok=True
+        )
+    return fun(month=_MONTH, years=_YEARS, label="bench", datadir=datadir)
+
+
+def _upload(datadir: Path, storedir: Path, lon_range: tuple, lat_range: tuple) -> int:
+    # everything is uploaded again
+    for file in storedir.rglob("*"):
+        if file.is_file():
+            file.unlink()
+    for file in datadir.glob("upload_*.log"):
+        file.unlink()
+    return upload.all_data(
+        month=_MONTH,
+        label="bench",
+        nprocs=2,
+        nthreads=8,
+        version="bench",
+        datadir=datadir,
+        lon_range=lon_range,
+        lat_range=lat_range,
+    )
+
+
+def _jobs(datadir: Path, storedir: Path, cells: int) -> dict[str, Callable]:
+    lon_range, lat_range = synthetic.region(cells=cells)
+    rng = np.random.default_rng(42)
+    npoints = 4 * cells
+    points = pd.DataFrame(
+        {
+            "lon": rng.uniform(*lon_range, size=npoints),
+            "lat": rng.uniform(*lat_range, size=npoints),
+            "l0": rng.normal(size=npoints),
+            "l1": rng.normal(size=npoints),
+        }
+    )
+    tiles_lon_range = (math.floor(lon_range[0]), math.ceil(lon_range[1]) - 1)
+    tiles_lat_range = (math.floor(lat_range[0]), math.ceil(lat_range[1]) - 1)
+    ranges = {"lon_range": lon_range, "lat_range": lat_range}
+    outputdir = datadir / "extract"
+    outputdir.mkdir(exist_ok=True)
+
+    jobs: dict[str, Callable] = {
+        "extract/era5": partial(
+            era5._extract_and_write_values,
+            month=_MONTH,
+            variable="2m_temperature",
+            inputdir=datadir,
+            outputdir=outputdir,
+            year=_YEARS[0],
+        ),
+        "extract/oras5": partial(
+            oras5._extract_and_write_year,
+            variable="rotated_zonal_velocity",
+            year=_YEARS[0],
+            months=[_MONTH],
+            inputdir=datadir,
+            outputdir=outputdir,
+            store="parquet",
+            chunksize=1000,
+            resolution=0.25,
+            **ranges,
+        ),
+        "stream/temp": partial(
+            aggregate.write_streamed_partial,
+            name="temp",
+            month=_MONTH,
+            year=_YEARS[0],
+            inputdir=datadir,
+            datadir=outputdir,
+        ),
+        "oras5/digitize": partial(_digitize, points=points, **ranges),
+        "oras5/regrid": partial(_regrid, points=points, **ranges),
+    }
+    funmap = {
+        "temp": aggregate.temps,
+        "rain": aggregate.rains,
+        "seatemp": aggregate.seatemps,
+        "wave": aggregate.waves,
+        "wind": aggregate.winds,
+        "current": aggregate.currents,
+    }
+    for name, fun in funmap.items():
+        jobs[f"aggregate/{name}"] = partial(
+            _aggregate, fun=fun, name=name, datadir=datadir
+        )
+    jobs["aggregate/wind-shm"] = partial(
+        _aggregate,
+        fun=partial(aggregate.winds, nproc=4),
+        name="wind",
+        datadir=datadir,
+    )
+    jobs["upload/all_data"] = partial(
+        _upload,
+        datadir=datadir,
+        storedir=storedir,
+        lon_range=tiles_lon_range,
+        lat_range=tiles_lat_range,
+    )
+    return jobs
+
+
+def _run(jobs: dict[str, Callable], repeat: int) -> dict[str, dict]:
+    """Best of repeat runs of each job"""
+    results = {}
+    for name, fun in jobs.items():
+        best: dict = {}
+        for _ in range(repeat):
+            res = measure(fun)
+            if len(best) == 0 or res["wall_s"] < best["wall_s"]:
+                best = res
+        results[name] = {
+            "rows": best["rows"],
+            "wall_s": best["wall_s"],
+            "rows_per_s": round(best["rows"] / max(best["wall_s"], 1e-6)),
+            "peak_rss_bytes": best["peak_rss_bytes"],
+        }
+    return results
+
+
+def _compare(results: dict[str, dict], baseline: dict[str, dict], tolerance: float):
+    """Names of jobs which got slower or use more memory than baseline"""
+    regressed = []
+    for name, res in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        slower = res["rows_per_s"] < base["rows_per_s"] * (1 - tolerance)
+        larger = res["peak_rss_bytes"] > base["peak_rss_bytes"] * (1 + tolerance)
+        if slower or larger:
+            regressed.append(name)
+    return regressed
+
+
+def main(kwargs: dict):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        datadir, storedir = Path(tmpdir) / "data", Path(tmpdir) / "store"
+        datadir.mkdir()
+        storedir.mkdir()
+        print(f"Generating {kwargs['cells']:,} cells x {kwargs['days']} days...")
+        _generate(datadir=datadir, cells=kwargs["cells"], days=kwargs["days"])
+
+        store = _LocalStore(rootdir=storedir)
+        s3.put_bytes = store.put_bytes
+        s3.get_bytes = store.get_bytes
+        jobs = _jobs(datadir=datadir, storedir=storedir, cells=kwargs["cells"])
+        if kwargs["jobs"] is not None:
+            jobs = {k: d for k, d in jobs.items() if k.split("/")[0] in kwargs["jobs"]}
+        results = _run(jobs=jobs, repeat=kwargs["repeat"])
+
+    print(f"\n{'job':<20} {'wall s':>8} {'rows':>10} {'rows/s':>12} {'peak MB':>9}")
+    for name, res in results.items():
+        print(
+            f"{name:<20} {res['wall_s']:>8.3f} {res['rows']:>10,}"
+            f" {res['rows_per_s']:>12,} {res['peak_rss_bytes'] / 1e6:>9,.0f}"
+        )
+    print("rows are cells, points for oras5/*, tiles for upload")
+
+    if kwargs["save"] is not None:
+        with open(kwargs["save"], "w", encoding="utf-8") as fh:
+            json.dump(results, fh, indent=1)
+        print(f"Results saved to {kwargs['save']}")
+
+    if kwargs["compare"] is not None:
+        with open(kwargs["compare"], encoding="utf-8") as fh:
+            baseline = json.load(fh)
+        regressed = _compare(
+            results=results, baseline=baseline, tolerance=kwargs["tolerance"]
+        )
+        if len(regressed) > 0:
+            print(f"\nRegressions compared to {kwargs['compare']}: {regressed}")
+            sys.exit(1)
+        print(f"\nNo regressions compared to {kwargs['compare']}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--cells",
+        default=20_000,
+        type=int,
+        help="Number of grid cells (default %(default)s)",
+    )
+    parser.add_argument(
+        "--days",
+        default=31,
+        type=int,
+        help="Number of days with 8 timesteps each (default %(default)s)",
+    )
+    parser.add_argument(
+        "--repeat",
+        default=3,
+        type=int,
+        help="Take the best of this many runs (default %(default)s)",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=str,
+        nargs="+",
+        choices=["extract", "stream", "oras5", "aggregate", "upload"],
+        help="Only run these jobs (default all)",
+    )
+    parser.add_argument(
+        "--save",
+        type=str,
+        help="Save results as JSON to this file",
+    )
+    parser.add_argument(
+        "--compare",
+        type=str,
+        help="Compare results to ones saved before, exit with 1 on regressions",
+    )
+    parser.add_argument(
+        "--tolerance",
+        default=0.2,
+        type=float,
+        help="Relative drop in rows/s or increase in peak memory"
+        " counted as regression (default %(default)s)",
+    )
+    args = parser.parse_args()
+    main(vars(args))
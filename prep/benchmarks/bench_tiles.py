@@ -0,0 +1,195 @@
+"""
+Benchmark encodings of tile records on synthetic data.
+
+    python -m benchmarks.bench_tiles --help
+
+Aggregates synthetic values of about --cells grid cells, builds the records
+of all tiles and encodes them as plain pickles, zstd without dictionary and
+zstd with a dictionary trained on a sample of tiles (see src/tilecodec.py).
+Reports mean size, encode and decode time per tile, tiles per MB of cache,
+and the latency of a query of --query-tiles tiles fetched like the backend
+does (16 threads), where each GET takes --rtt-ms plus size at --mbps.
+Synthetic values are random, real tiles compress better.
+"""
+
+import math
+import random
+import statistics
+import tempfile
+import threading
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import product
+from pathlib import Path
+from typing import Callable
+from src import aggregate
+from src import tilecodec
+from src import upload
+from src.config import VARMAP
+from tests import rawfiles
+from benchmarks import synthetic
+
+_YEARS = [2020, 2021]
+_MONTH = 1
+_LABEL = "bench"
+_FETCH_THREADS = 16  # like FETCH_THREADS of the backend
+
+
+def _records(datadir: Path, cells: int, days: int) -> list[dict]:
+    lon_range, lat_range = synthetic.region(cells=cells)
+    for year, variable in product(_YEARS, rawfiles.VALUES):
+        synthetic.extracted(
+            datadir=datadir,
+            variable=variable,
+            year=year,
+            month=_MONTH,
+            lon_range=lon_range,
+            lat_range=lat_range,
+            days=days,
+        )
+    funmap = {
+        "wind": aggregate.winds,
+        "temp": aggregate.temps,
+        "seatemp": aggregate.seatemps,
+        "wave": aggregate.waves,
+        "rain": aggregate.rains,
+        "current": aggregate.currents,
+    }
+    for name in VARMAP:
+        funmap[name](month=_MONTH, years=_YEARS, label=_LABEL, datadir=datadir)
+    tables = upload._load_tables(datadir=datadir, label=_LABEL, month=_MONTH)
+    tiles = product(
+        range(math.floor(lon_range[0]), math.ceil(lon_range[1])),
+        range(math.floor(lat_range[0]), math.ceil(lat_range[1])),
+    )
+    return list(upload._build_records(tables, tiles=list(tiles)))
+
+
+def _decoder(new_dctx: Callable) -> Callable:
+    """Decode with one decompressor per thread like the backend"""
+    local = threading.local()
+
+    def decode(body: bytes) -> dict:
+        if not hasattr(local, "dctx"):
+            local.dctx = new_dctx()
+        return tilecodec.decode(body, dctx=local.dctx)
+
+    return decode
+
+
+def _get(body: bytes, decode: Callable, rtt_s: float, bytes_per_s: float) -> dict:
+    time.sleep(rtt_s + len(body) / bytes_per_s)
+    return decode(body)
+
+
+def _query_s(bodies: list[bytes], decode: Callable, ntiles: int, **kwargs) -> float:
+    """Wall time of fetching and decoding ntiles random tiles concurrently"""
+    sample = random.Random(42).choices(bodies, k=ntiles)
+    get = partial(_get, decode=decode, **kwargs)
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=_FETCH_THREADS) as executor:
+        list(executor.map(get, sample))
+    return time.perf_counter() - t0
+
+
+def _bench(records: list[dict], encode: Callable, decode: Callable, kwargs: dict):
+    t0 = time.perf_counter()
+    bodies = [encode(d) for d in records]
+    encode_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for body in bodies:
+        decode(body)
+    decode_s = time.perf_counter() - t0
+    query_s = _query_s(
+        bodies=bodies,
+        decode=decode,
+        ntiles=kwargs["query_tiles"],
+        rtt_s=kwargs["rtt_ms"] / 1000,
+        bytes_per_s=kwargs["mbps"] * 1e6 / 8,
+    )
+    size = statistics.mean(len(d) for d in bodies)
+    return {
+        "bytes": size,
+        "encode_ms": encode_s / len(bodies) * 1000,
+        "decode_ms": decode_s / len(bodies) * 1000,
+        "tiles_per_mb": 1e6 / size,
+        "query_ms": query_s * 1000,
+    }
+
+
+def main(kwargs: dict):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        print(f"Aggregating {kwargs['cells']:,} cells x {kwargs['days']} days...")
+        records = _records(
+            datadir=Path(tmpdir), cells=kwargs["cells"], days=kwargs["days"]
+        )
+
+    # dictionary is trained on other tiles than the ones measured
+    random.Random(0).shuffle(records)
+    ntrain = len(records) // 4
+    train, records = records[:ntrain], records[ntrain:]
+    dictionary = tilecodec.train([tilecodec.encode(d) for d in train])
+    print(f"Dictionary of {len(dictionary):,} bytes trained on {ntrain:,} tiles")
+
+    zstd = tilecodec.zstandard
+    encodings: dict[str, tuple[Callable[[dict], bytes], Callable[[bytes], dict]]] = {
+        "pickle": (tilecodec.encode, tilecodec.decode),
+        "zstd": (
+            partial(tilecodec.encode, cctx=zstd.ZstdCompressor(level=tilecodec.LEVEL)),
+            _decoder(zstd.ZstdDecompressor),
+        ),
+        "zstd+dict": (
+            partial(tilecodec.encode, cctx=tilecodec.compressor(dictionary)),
+            _decoder(partial(tilecodec.decompressor, dictionary)),
+        ),
+    }
+    print(
+        f"\n{'encoding':<10} {'bytes':>9} {'encode ms':>10} {'decode ms':>10}"
+        f" {'tiles/MB':>9} {'query ms':>9}"
+    )
+    for name, (encode, decode) in encodings.items():
+        res = _bench(records=records, encode=encode, decode=decode, kwargs=kwargs)
+        print(
+            f"{name:<10} {res['bytes']:>9,.0f} {res['encode_ms']:>10.3f}"
+            f" {res['decode_ms']:>10.3f} {res['tiles_per_mb']:>9,.0f}"
+            f" {res['query_ms']:>9,.0f}"
+        )
+    print(f"{len(records):,} tiles measured")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--cells",
+        default=20_000,
+        type=int,
+        help="Number of grid cells (default %(default)s)",
+    )
+    parser.add_argument(
+        "--days",
+        default=31,
+        type=int,
+        help="Number of days with 8 timesteps each (default %(default)s)",
+    )
+    parser.add_argument(
+        "--query-tiles",
+        default=100,
+        type=int,
+        help="Tiles fetched by a query (default %(default)s)",
+    )
+    parser.add_argument(
+        "--rtt-ms",
+        default=20.0,
+        type=float,
+        help="Latency of a GET in ms (default %(default)s)",
+    )
+    parser.add_argument(
+        "--mbps",
+        default=100.0,
+        type=float,
+        help="Bandwidth of a GET in Mbit/s (default %(default)s)",
+    )
+    args = parser.parse_args()
+    main(vars(args))
@@ -0,0 +1,149 @@
+"""
+Synthetic inputs for benchmarks at configurable grid sizes.
+
+    python -m benchmarks.synthetic --help
+
+Writes raw GRIB (ERA5) and tar.gz of NetCDF (ORAS5) files (see tests/rawfiles.py),
+extracted parquet files in the layout written by extract,
+and aggregated tables (by running aggregate on the extracted files)
+into a data directory, which can then be used with main.py too.
+Values are random but in realistic ranges per variable.
+"""
+
+from pathlib import Path
+from argparse import ArgumentParser
+import math
+import numpy as np
+import pandas as pd
+from src import aggregate
+from src import grid
+from src import pq
+from src.config import VARMAP, CHUNKSIZE, LAT_BAND
+from tests import rawfiles
+
+
+def region(cells: int) -> tuple[tuple[float, float], tuple[float, float]]:
+    """
+    Lon and lat range (in degrees, inclusive) of a block of about
+    this many grid cells, at most the whole grid
+    """
+    nlats = min(math.ceil(math.sqrt(cells)), grid.NLATS)
+    nlons = min(math.ceil(cells / nlats), grid.NLONS)
+    lon0 = max(grid.LON_Q[0], -(nlons // 2)) * grid.RES
+    lat0 = max(grid.LAT_Q[0], -(nlats // 2)) * grid.RES
+    return (
+        (lon0, lon0 + (nlons - 1) * grid.RES),
+        (lat0, lat0 + (nlats - 1) * grid.RES),
+    )
+
+
+def extracted(
+    datadir: Path,
+    variable: str,
+    year: int,
+    month: int,
+    lon_range: tuple[float, float],
+    lat_range: tuple[float, float],
+    days=31,
+    seed=42,
+):
+    """Write extracted values like extract (one column per day and timestep)"""
+    lons, lats = np.meshgrid(rawfiles.axis(lon_range), rawfiles.axis(lat_range))
+    cells = grid.cell_ids(lons=lons.flatten(), lats=lats.flatten())
+    rng = rawfiles.seeded_rng(seed, variable, year, month)
+    values = rawfiles.random_values(
+        variable, shape=(len(cells), days * len(rawfiles.TIMES)), rng=rng
+    )
+    columns = [f"{d}-{i}" for i, d in enumerate(np.repeat(range(1, days + 1), 8))]
+    df = pd.DataFrame(values, index=pd.Index(cells, name=pq.INDEX), columns=columns)
+    file = datadir / f"extracted_{variable}_{year}-{month}.pq"
+    bands = grid.lat_bands(LAT_BAND)
+    pq.write_table(df=df, file=file, row_group_size=CHUNKSIZE, bands=bands)
+
+
+def main(kwargs: dict):
+    datadir = Path(kwargs["outputdir"])
+    datadir.mkdir(parents=True, exist_ok=True)
+    lon_range, lat_range = region(cells=kwargs["cells"])
+    years, month = kwargs["years"], kwargs["month"]
+    print(f"Writing {len(years)} years of lon {lon_range} lat {lat_range}...")
+    for year in years:
+        for variable in rawfiles.VALUES:
+            extracted(
+                datadir=datadir,
+                variable=variable,
+                year=year,
+                month=month,
+                lon_range=lon_range,
+                lat_range=lat_range,
+                days=kwargs["days"],
+            )
+            if variable in rawfiles.ORAS5_NAMES:
+                rawfiles.raw_oras5(
+                    datadir=datadir,
+                    variable=variable,
+                    year=year,
+                    months=[month],
+                    lon_range=lon_range,
+                    lat_range=lat_range,
+                )
+            else:
+                rawfiles.raw_grib(
+                    datadir=datadir,
+                    variable=variable,
+                    year=year,
+                    month=month,
+                    lon_range=lon_range,
+                    lat_range=lat_range,
+                    days=kwargs["days"],
+                )
+
+    funmap = {
+        "wind": aggregate.winds,
+        "temp": aggregate.temps,
+        "seatemp": aggregate.seatemps,
+        "wave": aggregate.waves,
+        "rain": aggregate.rains,
+        "current": aggregate.currents,
+    }
+    label = f"{min(years)}-{max(years)}"
+    for name in VARMAP:
+        funmap[name](month=month, years=years, label=label, datadir=datadir)
+    print(f"Written to {datadir}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--outputdir",
+        default="data/synthetic",
+        type=str,
+        help="Write files to this directory (default %(default)s)",
+    )
+    parser.add_argument(
+        "--cells",
+        default=20_000,
+        type=int,
+        help="Number of grid cells, at most the whole grid (default %(default)s)",
+    )
+    parser.add_argument(
+        "--days",
+        default=31,
+        type=int,
+        help="Number of days of month (default %(default)s)",
+    )
+    parser.add_argument(
+        "--years",
+        default=[2020, 2021],
+        type=int,
+        nargs="+",
+        help="Years (default %(default)s)",
+    )
+    parser.add_argument(
+        "--month",
+        default=1,
+        type=int,
+        help="Month (default %(default)s)",
+    )
+    args = parser.parse_args()
+    main(vars(args))
@@ -6,65 +6,173 @@ CLI entrypoint.
 """
 
 import datetime as dt
+from pathlib import Path
 from argparse import ArgumentParser
 from src import oras5
 from src import era5
 from src import aggregate
 from src import upload
-from src.config import Config, VARMAP
+from src import build
+from src import download
+from src import workqueue
+from src import tilecodec
+from src.profiling import Profiler
+from src.config import Config, VARMAP, CHUNKSIZE, STORES
 
 
-def _download_cmd(cnfg: Config, _: dict):
-    oras5.download(cnfg=cnfg)
-    era5.download(cnfg=cnfg)
+def _build(cnfg: Config, targets: list[build.Target], nproc: int):
+    """Build stale targets (and profile them), raise if any failed"""
+    profiler = None
+    if cnfg.profile is not None:
+        profiler = Profiler(file=cnfg.profile, nstacks=cnfg.profile_stacks)
+    failed = build.run(
+        targets=targets,
+        builddir=cnfg.outputdir / build.BUILDDIR,
+        nproc=nproc,
+        force=cnfg.force,
+        hashing=cnfg.hashing,
+        profiler=profiler,
+    )
+    if profiler is not None:
+        profiler.write()
+    if len(failed) > 0:
+        raise RuntimeError(f"{len(failed):,} targets failed: {' '.join(failed)}")
+
+
+def _download_cmd(cnfg: Config, kwargs: dict):
+    parts = oras5.download_parts(cnfg=cnfg) + era5.download_parts(cnfg=cnfg)
+    failed = download.run(
+        parts=parts, outputdir=cnfg.outputdir, nthreads=kwargs["requests"]
+    )
+    if len(failed) > 0:
+        names = " ".join(d.name for d in failed)
+        raise RuntimeError(f"{len(failed):,} downloads failed: {names}")
 
 
 def _extract_cmd(cnfg: Config, _: dict):
-    oras5.extract(cnfg=cnfg)
-    era5.extract(cnfg=cnfg)
+    targets = oras5.targets(cnfg=cnfg) + era5.targets(cnfg=cnfg)
+    _build(cnfg=cnfg, targets=targets, nproc=cnfg.nproc)
 
 
 def _aggregate_cmd(cnfg: Config, _: dict):
-    funmap = {
-        "wind": aggregate.winds,
-        "temp": aggregate.temps,
-        "seatemp": aggregate.seatemps,
-        "wave": aggregate.waves,
-        "rain": aggregate.rains,
-        "current": aggregate.currents,
-    }
-    for label, years in cnfg.time_ranges.items():
-        print(f"Aggregating {label}...")
-        for variable in cnfg.variables:
-            for month in cnfg.months:
-                funmap[variable](
-                    month=month, years=years, label=label, datadir=cnfg.datadir
-                )
+    _build(cnfg=cnfg, targets=aggregate.targets(cnfg=cnfg), nproc=cnfg.nproc)
+
+
+def _upload_labels(cnfg: Config, kwargs: dict) -> tuple[list[str], str]:
+    """Labels and file prefix of timeranges or per-year partials"""
+    if kwargs["partials"]:
+        return [str(d) for d in cnfg.years], "partial"
+    return list(cnfg.time_ranges), "aggregated"
+
+
+def _dictionary(cnfg: Config, version: str) -> Path | None:
+    """Trained dictionary of version, None if tiles are not compressed"""
+    file = tilecodec.dictionary_file(dictdir=cnfg.outputdir / "dicts", version=version)
+    return file if file.is_file() else None
+
+
+def _upload_targets(
+    cnfg: Config, kwargs: dict, resume: bool, only_keys: list[str] | None = None
+) -> list[build.Target]:
+    labels, prefix = _upload_labels(cnfg=cnfg, kwargs=kwargs)
+    return upload.targets(
+        version=kwargs["version"],
+        labels=labels,
+        months=cnfg.months,
+        datadir=cnfg.outputdir,
+        prefix=prefix,
+        nprocs=cnfg.nproc,
+        nthreads=cnfg.nproc * 5,
+        lat_range=cnfg.lat_range,
+        lon_range=cnfg.lon_range,
+        only_keys=only_keys,
+        resume=resume,
+        dictionary=_dictionary(cnfg=cnfg, version=kwargs["version"]),
+    )
 
 
 def _upload_cmd(cnfg: Config, kwargs: dict):
-    for timerange in cnfg.time_ranges:
-        for month in cnfg.months:
-            upload.all_data(
-                nthreads=cnfg.nproc * 5,
-                month=month,
-                version=kwargs["version"],
-                label=timerange,
-                datadir=cnfg.datadir,
-                lat_range=cnfg.lat_range,
-                lon_range=cnfg.lon_range,
-                only_keys=kwargs["keys"],
-            )
+    keys = kwargs["keys"]
+    targets = _upload_targets(
+        cnfg=cnfg,
+        kwargs=kwargs,
+        # journals keep the keys uploaded before
+        resume=kwargs["resume"] or keys is not None,
+        only_keys=keys,
+    )
+    if keys is not None:
+        # only some keys, targets are not complete afterwards
+        for target in targets:
+            target.fun()
+        return
+
+    # uploads use processes and threads themselves
+    _build(cnfg=cnfg, targets=targets, nproc=1)
+
+
+def _dictionary_cmd(cnfg: Config, kwargs: dict):
+    timeranges = [(d, "aggregated") for d in cnfg.time_ranges]
+    partials = [(str(d), "partial") for d in cnfg.years]
+    file = upload.train_dictionary(
+        version=kwargs["version"],
+        sources=timeranges + partials,
+        months=cnfg.months,
+        datadir=cnfg.outputdir,
+        lon_range=cnfg.lon_range,
+        lat_range=cnfg.lat_range,
+        ntiles=kwargs["tiles"],
+    )
+    print(f"Copy {file} to backend/src/src/dicts/ and deploy it with the data")
 
 
 def _check_cmd(cnfg: Config, kwargs: dict):
+    labels, prefix = _upload_labels(cnfg=cnfg, kwargs=kwargs)
     upload.check(
         version=kwargs["version"],
-        labels=list(cnfg.time_ranges),
+        labels=labels,
         months=cnfg.months,
         lon_range=cnfg.lon_range,
         lat_range=cnfg.lat_range,
+        prefix=prefix,
+    )
+
+
+def _queue(cnfg: Config, kwargs: dict) -> workqueue.WorkQueue:
+    file = kwargs["queue"] or cnfg.outputdir / "queue.sqlite"
+    return workqueue.WorkQueue(file=Path(file), lease_s=kwargs["lease"])
+
+
+def _enqueue_cmd(cnfg: Config, kwargs: dict):
+    targets = []
+    if "extract" in kwargs["steps"]:
+        targets.extend(oras5.targets(cnfg=cnfg) + era5.targets(cnfg=cnfg))
+    if "aggregate" in kwargs["steps"]:
+        targets.extend(aggregate.targets(cnfg=cnfg))
+    if "upload" in kwargs["steps"]:
+        if kwargs["version"] is None:
+            raise ValueError("Uploads need --version")
+        # a retried upload continues after the tiles already uploaded
+        targets.extend(_upload_targets(cnfg=cnfg, kwargs=kwargs, resume=True))
+    queue = _queue(cnfg=cnfg, kwargs=kwargs)
+    queue.put(targets=targets, max_attempts=kwargs["max_attempts"])
+    print(f"{len(targets):,} jobs queued in {queue.file}: {queue.counts()}")
+
+
+def _worker_cmd(cnfg: Config, kwargs: dict):
+    queue = _queue(cnfg=cnfg, kwargs=kwargs)
+    njobs = workqueue.work(
+        queue=queue,
+        builddir=cnfg.outputdir / build.BUILDDIR,
+        force=cnfg.force,
+        hashing=cnfg.hashing,
+        max_jobs=kwargs["max_jobs"],
     )
+    print(f"{njobs:,} jobs run, queue: {queue.counts()}")
+    failed = queue.failed()
+    if len(failed) > 0:
+        for name, error in failed:
+            print(f"{name} failed: {error}")
+        raise RuntimeError(f"{len(failed):,} jobs failed")
 
 
 def main(kwargs: dict):
@@ -79,14 +187,17 @@ def main(kwargs: dict):
         "download": _download_cmd,
         "extract": _extract_cmd,
         "aggregate": _aggregate_cmd,
+        "dictionary": _dictionary_cmd,
         "upload": _upload_cmd,
         "check": _check_cmd,
+        "enqueue": _enqueue_cmd,
+        "worker": _worker_cmd,
     }
     cmdmap[cmd](cnfg, kwargs)
     print("done")
 
 
-if __name__ == "__main__":
+def _parser() -> ArgumentParser:
     this_year = dt.date.today().year
     parser = ArgumentParser()
     parser.add_argument(
@@ -134,15 +245,82 @@ if __name__ == "__main__":
         type=int,
         help="Workers during multiprocessing (default %(default)s)",
     )
+    parser.add_argument(
+        "--partial-nproc",
+        default=1,
+        type=int,
+        help="Processes sharing memory to count each wind and current partial,"
+        " each counts a slice of cells (default %(default)s)",
+    )
+    parser.add_argument(
+        "--chunksize",
+        default=CHUNKSIZE,
+        type=int,
+        help="Cells per chunk when writing and reading files in chunks"
+        " (default %(default)s)",
+    )
+    parser.add_argument(
+        "--store",
+        default=STORES[0],
+        choices=STORES,
+        help="Store extracted values in these files (default %(default)s)."
+        " Aggregation reads a cube if there is one."
+        " With stream nothing is extracted, aggregation decodes raw files.",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Rebuild all targets of a command, even those"
+        " which are up to date (default %(default)s)",
+    )
+    parser.add_argument(
+        "--hash",
+        action="store_true",
+        help="Fingerprint inputs of targets by content hash"
+        " instead of mtime and size (default %(default)s)",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        help="Measure wall and CPU time, peak RSS, I/O and rows of each built target"
+        " and write them to this file (CSV if it ends with .csv, else JSON)",
+    )
+    parser.add_argument(
+        "--profile-stacks",
+        default=0,
+        type=int,
+        help="With --profile sample stacks of jobs and write them for this many"
+        " of the slowest jobs as collapsed stacks (default %(default)s)",
+    )
     parser.add_argument(
         "--test",
         action="store_true",
         help="Reduces some variables to a minimum for testing (default %(default)s)",
     )
     subparsers = parser.add_subparsers(dest="cmd")
-    subparsers.add_parser("download", help="Download raw data.")
+    download_parser = subparsers.add_parser("download", help="Download raw data.")
+    download_parser.add_argument(
+        "--requests",
+        default=4,
+        type=int,
+        help="CDS requests (of a month each) running at once,"
+        " completed ones are skipped when run again (default %(default)s)",
+    )
     subparsers.add_parser("extract", help="Extract values from raw data.")
     subparsers.add_parser("aggregate", help="Aggregate values and calculate metrics.")
+    dictionary_parser = subparsers.add_parser(
+        "dictionary",
+        help="Train zstd dictionary compressing tiles of a version"
+        " (see src/tilecodec.py)",
+    )
+    dictionary_parser.add_argument("version", type=str, help="API version prefix")
+    dictionary_parser.add_argument(
+        "--tiles",
+        default=2000,
+        type=int,
+        help="Random tiles sampled of each timerange, year and month"
+        " (default %(default)s)",
+    )
     upload_parser = subparsers.add_parser("upload", help="Upload to S3")
     upload_parser.add_argument("version", type=str, help="API version prefix")
     upload_parser.add_argument(
@@ -151,7 +329,73 @@ if __name__ == "__main__":
         nargs="+",
         help="Optionally only upload data for these S3 specific keys.",
     )
+    upload_parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Skip keys completed by a previous (interrupted) upload"
+        " according to its journal in outputdir (default %(default)s)",
+    )
+    upload_parser.add_argument(
+        "--partials",
+        action="store_true",
+        help="Upload per-year partials of --years instead of timeranges,"
+        " so that the API can merge any range of years (default %(default)s)",
+    )
     check_parser = subparsers.add_parser("check", help="Check uploaded files")
     check_parser.add_argument("version", type=str, help="API version prefix")
-    args = parser.parse_args()
-    main(vars(args))
+    check_parser.add_argument(
+        "--partials",
+        action="store_true",
+        help="Check per-year partials of --years instead of timeranges"
+        " (default %(default)s)",
+    )
+    enqueue_parser = subparsers.add_parser(
+        "enqueue", help="Queue jobs of steps for workers (see src/workqueue.py)"
+    )
+    enqueue_parser.add_argument(
+        "steps",
+        type=str,
+        nargs="+",
+        choices=["extract", "aggregate", "upload"],
+        help="Queue targets of these steps, each waits for the ones of its inputs",
+    )
+    enqueue_parser.add_argument(
+        "--version", type=str, help="API version prefix for upload"
+    )
+    enqueue_parser.add_argument(
+        "--partials",
+        action="store_true",
+        help="Upload per-year partials of --years instead of timeranges"
+        " (default %(default)s)",
+    )
+    enqueue_parser.add_argument(
+        "--max-attempts",
+        default=3,
+        type=int,
+        help="Attempts of a job before it fails (default %(default)s)",
+    )
+    worker_parser = subparsers.add_parser(
+        "worker", help="Run queued jobs until the queue is drained"
+    )
+    worker_parser.add_argument(
+        "--max-jobs", type=int, help="Stop after this many jobs (default all)"
+    )
+    for queue_parser in (enqueue_parser, worker_parser):
+        queue_parser.add_argument(
+            "--queue",
+            type=str,
+            help="SQLite file of the queue, on a filesystem shared by all nodes"
+            " with working POSIX locks, not NFS (default outputdir/queue.sqlite)",
+        )
+        queue_parser.add_argument(
+            "--lease",
+            default=60.0,
+            type=float,
+            help="Seconds a job is leased, workers renew it while working,"
+            " jobs of dead workers are retried afterwards (default %(default)s)",
+        )
+    return parser
+
+
+if __name__ == "__main__":
+    main(vars(_parser().parse_args()))
@@ -1,32 +1,159 @@
-from itertools import product
+from typing import Callable, Iterable, Iterator
+from abc import ABC, abstractmethod
+from contextlib import nullcontext
+from functools import partial
+from itertools import chain, product
 from pathlib import Path
 import numpy as np
 import pandas as pd
 from . import pq
+from . import cube
+from . import era5
+from . import oras5
+from . import grid
+from . import shm
+from .build import Target
 from .util import direction, velocity
-from .config import WAVES, DIRECTIONS, WIND_VELS, CURRENT_VELS
+from .config import WAVES, DIRECTIONS, WIND_VELS, CURRENT_VELS, CHUNKSIZE, LAT_BAND
+from .config import Config, VARMAP
+
+LatRange = tuple[int, int] | None
+
+
+def _band_rows(cells: np.ndarray, lat_range: tuple[int, int]) -> slice | np.ndarray:
+    """Rows of cells in latitude band, a slice if they are contiguous"""
+    _, lat_q = grid.grid_indexes(cells)
+    rows = np.flatnonzero((lat_q >= lat_range[0]) & (lat_q < lat_range[1]))
+    if len(rows) > 0 and rows[-1] - rows[0] + 1 == len(rows):
+        return slice(rows[0], rows[-1] + 1)
+    return rows
+
+
+def _lat_ranges(index: pd.Index, files: list[Path], lat_band: float) -> list[LatRange]:
+    """
+    Latitude bands which contain any cell of index. If any parquet file
+    is not written in bands (e.g. by an older version), reading band by band
+    would read the same row groups again and again, then everything is read
+    at once instead (None).
+    """
+    bands = grid.lat_bands(lat_band)
+    if any(d.suffix == ".pq" and not pq.in_bands(d, bands=bands) for d in files):
+        return [None]
+    _, lat_q = grid.grid_indexes(index.to_numpy())
+    present = set(np.unique(lat_q).tolist())
+    return [d for d in bands if any(i in present for i in range(*d))] or [None]
+
+
+def _read_index(
+    datadir: Path, variable: str, year: int, month: int, lat_range: LatRange = None
+) -> pd.Index:
+    """Read cells of extracted values (optionally only of a latitude band)"""
+    if cube.exists(datadir=datadir, variable=variable, year=year):
+        cells = cube.read_cells(datadir=datadir, variable=variable, year=year)
+        if lat_range is not None:
+            cells = cells[_band_rows(cells, lat_range=lat_range)]
+        return pd.Index(cells, name=pq.INDEX)
+    index = pq.read_index(datadir / f"extracted_{variable}_{year}-{month}.pq")
+    if lat_range is not None:
+        index = index[_band_rows(index.to_numpy(), lat_range=lat_range)]
+    return index
+
+
+def _read_month(
+    datadir: Path, variable: str, year: int, month: int, lat_range: LatRange = None
+) -> pd.DataFrame:
+    """
+    Read extracted values of a month (memory-mapped if there is a cube),
+    optionally only of a latitude band (lat grid index range)
+    """
+    if cube.exists(datadir=datadir, variable=variable, year=year):
+        cells, columns, values = cube.read_month(
+            datadir=datadir, variable=variable, year=year, month=month
+        )
+        if lat_range is not None:
+            rows = _band_rows(cells, lat_range=lat_range)
+            cells, values = cells[rows], values[rows]
+        index = pd.Index(cells, name=pq.INDEX)
+        return pd.DataFrame(values, index=index, columns=columns, copy=False)
+    file = datadir / f"extracted_{variable}_{year}-{month}.pq"
+    return pq.read_table(file, lat_range=lat_range)
+
+
+def _iter_month(
+    datadir: Path,
+    variable: str,
+    year: int,
+    month: int,
+    chunksize: int,
+    lat_range: LatRange = None,
+) -> Iterator[pd.DataFrame]:
+    """Read extracted values of a month in chunks of cells"""
+    if cube.exists(datadir=datadir, variable=variable, year=year):
+        df = _read_month(
+            datadir=datadir,
+            variable=variable,
+            year=year,
+            month=month,
+            lat_range=lat_range,
+        )
+        for start in range(0, len(df), chunksize):
+            yield df.iloc[start : start + chunksize]
+    else:
+        file = datadir / f"extracted_{variable}_{year}-{month}.pq"
+        yield from pq.iter_tables(file, chunksize=chunksize, lat_range=lat_range)
+
+
+def _iter_uv(
+    datadir: Path,
+    uvar: str,
+    vvar: str,
+    year: int,
+    month: int,
+    chunksize: int,
+    lat_range: LatRange = None,
+) -> Iterator[tuple[pd.Index, np.ndarray, np.ndarray]]:
+    """Read u/v values once, chunk by chunk of cells"""
+    dfs_u, dfs_v = (
+        _iter_month(
+            datadir=datadir,
+            variable=d,
+            year=year,
+            month=month,
+            chunksize=chunksize,
+            lat_range=lat_range,
+        )
+        for d in (uvar, vvar)
+    )
+    for df_u, df_v in zip(dfs_u, dfs_v, strict=True):
+        assert all(df_u.columns == df_v.columns)
+        assert np.array_equal(df_u.index, df_v.index)
+        yield df_u.index, df_u.to_numpy(), df_v.to_numpy()
+
 
+class _Moments:
+    """
+    Running count, mean and M2 per cell (Welford's algorithm)
 
-def _get_dirs(ufile: Path, vfile: Path, is_wind=True) -> pd.DataFrame:
-    df_u = pq.read_table(ufile)
-    df_v = pq.read_table(vfile)
-    assert all(df_u.columns == df_v.columns)
-    assert df_u.index.equals(df_v.index)
-    dirs = {}
-    for k in df_u.columns:
-        dirs[k] = direction(u=df_u[k].to_numpy(), v=df_v[k].to_numpy(), is_wind=is_wind)
-    return pd.DataFrame(dirs, index=df_u.index.copy())
+    Memory stays at a few cell-sized arrays no matter how many
+    samples are added. Mean and (population) std match np.mean
+    and np.std over all added samples up to floating point error.
+    """
 
+    def __init__(self, n: int):
+        self.count = np.zeros(n, dtype=int)
+        self.mean = np.zeros(n)
+        self.m2 = np.zeros(n)
 
-def _get_velos(ufile: Path, vfile: Path) -> pd.DataFrame:
-    df_u = pq.read_table(ufile)
-    df_v = pq.read_table(vfile)
-    assert all(df_u.columns == df_v.columns)
-    assert df_u.index.equals(df_v.index)
-    velos = {}
-    for k in df_u.columns:
-        velos[k] = velocity(u=df_u[k].to_numpy(), v=df_v[k].to_numpy())
-    return pd.DataFrame(velos, index=df_u.index.copy())
+    def update(self, x: np.ndarray):
+        """Add one sample for each cell"""
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+
+    @property
+    def std(self) -> np.ndarray:
+        return np.sqrt(self.m2 / self.count)
 
 
 def _bin(arr: np.ndarray, by: list[dict], nanval=-1) -> np.ndarray:
@@ -35,189 +162,785 @@ def _bin(arr: np.ndarray, by: list[dict], nanval=-1) -> np.ndarray:
     return binned
 
 
-def temps(month: int, years: list[int], label: str, datadir: Path):
-    invar = "2m_temperature"
-    df = pq.read_table(datadir / f"extracted_{invar}_{years[0]}-{month}.pq")
-    index = df.index.copy()
+def _bin_dirs(arr: np.ndarray, nanval=-1) -> np.ndarray:
+    """
+    Bin azimuths into the 16 compass sectors of 22.5° (1 is N).
+    Same as binning by DIRECTIONS with 17 folded back onto 1.
+    """
+    nans = np.isnan(arr)
+    binned = (np.mod(np.where(nans, 0.0, arr) + 11.25, 360) // 22.5).astype(int) + 1
+    binned[nans] = nanval
+    return binned
 
-    maxs = []
-    mins = []
-    for year in years:
-        print(f"Year {invar} {year}-{month}...")
-        df = pq.read_table(datadir / f"extracted_{invar}_{year}-{month}.pq")
-        assert df.index.equals(index)
-
-        days = set(d.split("-")[0] for d in df.columns)
-        for day in days:
-            cols = [d for d in df.columns if d.split("-")[0] == day]
-            mins.append(df[cols].min(axis=1).to_numpy())
-            maxs.append(df[cols].max(axis=1).to_numpy())
-
-    mins_arr = np.stack(mins, axis=1)
-    maxs_arr = np.stack(maxs, axis=1)
-    df = pd.DataFrame(
-        {
-            "high_mean": np.mean(maxs_arr, axis=1) - 273.15,
-            "high_std": np.std(maxs_arr, axis=1),
-            "low_mean": np.mean(mins_arr, axis=1) - 273.15,
-            "low_std": np.std(mins_arr, axis=1),
-        },
-        index=df.index,
-    )
-    pq.write_table(df=df, file=datadir / f"aggregated_temp_{label}_{month}.pq")
 
+def _count_bins(B: np.ndarray, nbins: int) -> np.ndarray:
+    """
+    Count bins 1..nbins for each cell (row) of B with a single bincount.
+    Bins below 1 (e.g. NaNs) are not counted.
+    """
+    ncells = B.shape[0]
+    valid = B > 0
+    cells = np.broadcast_to(np.arange(ncells)[:, None], B.shape)[valid]
+    counts = np.bincount(cells * nbins + B[valid] - 1, minlength=ncells * nbins)
+    return counts.reshape(ncells, nbins).astype(np.uint32)
 
-def rains(month: int, years: list[int], label: str, datadir: Path):
-    invar = "total_precipitation"
-    df = pq.read_table(datadir / f"extracted_{invar}_{years[0]}-{month}.pq")
-    index = df.index.copy()
 
-    sums = []
-    for year in years:
-        print(f"Year {invar} {year}-{month}...")
-        df = pq.read_table(datadir / f"extracted_{invar}_{year}-{month}.pq")
-        assert df.index.equals(index)
+def _joint_bins(D: np.ndarray, V: np.ndarray, nvels: int) -> np.ndarray:
+    """Bins of direction x velocity combinations ordered like their product"""
+    return np.where((D > 0) & (V > 0), (D - 1) * nvels + V, -1)
 
-        days = set(d.split("-")[0] for d in df.columns)
-        for day in days:
-            cols = [d for d in df.columns if d.split("-")[0] == day]
-            sums.append(df[cols].sum(axis=1).to_numpy() * 1000)  # m to mm
 
-    # the sums were only of every 3rd hour
-    sums_arr = np.stack(sums, axis=1)
-    df = pd.DataFrame(
-        {
-            "daily_mean": np.mean(sums_arr, axis=1) * 3,
-            "daily_std": np.std(sums_arr, axis=1),
-        },
-        index=df.index,
-    )
-    pq.write_table(df=df, file=datadir / f"aggregated_rain_{label}_{month}.pq")
+def _count_joint(D: np.ndarray, V: np.ndarray, nvels: int) -> np.ndarray:
+    """
+    Count direction x velocity combinations for each cell (row).
+    Columns are ordered like product(directions, velocities).
+    """
+    ndirs = len(DIRECTIONS) - 1  # last one (17) is helper
+    return _count_bins(_joint_bins(D, V, nvels=nvels), nbins=ndirs * nvels)
+
+
+class _Accumulator(ABC):
+    """Running partial of a month of a year, added day by day"""
+
+    @abstractmethod
+    def update(self, day: str, *arrays: np.ndarray):
+        """Add (cell, timestep) values of day (one array per input variable)"""
+
+    @abstractmethod
+    def table(self, index: pd.Index) -> pd.DataFrame:
+        """Partial of the cells in index"""
+
+
+class _Counts(_Accumulator):
+    """
+    Running counts of bins 1..nbins per cell, added a few timesteps
+    (columns) at a time. Bins below 1 (e.g. NaNs) are not counted.
+    """
+
+    def __init__(self, n: int, nbins: int):
+        self.C = np.zeros((n, nbins), dtype=np.uint32)
 
+    def add(self, B: np.ndarray):
+        """Add (cell, timestep) bins"""
+        for b in B.T:
+            rows = np.flatnonzero(b > 0)
+            self.C[rows, b[rows] - 1] += 1
 
-def seatemps(month: int, years: list[int], label: str, datadir: Path):
-    invar = "sea_surface_temperature"
-    df = pq.read_table(datadir / f"extracted_{invar}_{years[0]}-{month}.pq")
-    index = df.index.copy()
 
-    maxs = []
-    mins = []
+def _partial_file(datadir: Path, name: str, year: int, month: int) -> Path:
+    return datadir / f"partial_{name}_{year}_{month}.pq"
+
+
+def _iter_partials(
+    name: str,
+    month: int,
+    years: list[int],
+    datadir: Path,
+    chunksize: int,
+    lat_band: float,
+    nproc: int,
+) -> Iterator[list[pd.DataFrame]]:
+    """
+    Read partials of each year, latitude band by latitude band.
+    Partials which do not exist yet are computed and written,
+    so each year is only processed once.
+    """
+    files = []
     for year in years:
-        print(f"Year {invar} {year}-{month}...")
-        df = pq.read_table(datadir / f"extracted_{invar}_{year}-{month}.pq")
-        assert df.index.equals(index)
-
-        days = set(d.split("-")[0] for d in df.columns)
-        for day in days:
-            cols = [d for d in df.columns if d.split("-")[0] == day]
-            mins.append(df[cols].min(axis=1).to_numpy())
-            maxs.append(df[cols].max(axis=1).to_numpy())
-
-    mins_arr = np.stack(mins, axis=1)
-    maxs_arr = np.stack(maxs, axis=1)
-    df = pd.DataFrame(
+        file = _partial_file(datadir=datadir, name=name, year=year, month=month)
+        if not file.is_file():
+            write_partial(
+                name=name,
+                month=month,
+                year=year,
+                datadir=datadir,
+                chunksize=chunksize,
+                lat_band=lat_band,
+                nproc=nproc,
+            )
+        files.append(file)
+    index = pq.read_index(files[0])
+    for lat_range in _lat_ranges(index=index, files=files, lat_band=lat_band):
+        yield [pq.read_table(d, lat_range=lat_range) for d in files]
+
+
+def _merge_partials(dfs: Iterable[pd.DataFrame]) -> pd.DataFrame:
+    """Merge partials of multiple years by adding up their counts and sums"""
+    dfs = iter(dfs)
+    first = next(dfs, None)
+    assert first is not None, "no years"
+    is_count = np.issubdtype(first.dtypes.iloc[0], np.integer)
+    total = first.to_numpy(dtype=np.uint32 if is_count else np.float64, copy=True)
+    for df in dfs:
+        assert np.array_equal(df.index, first.index), "cells differ between years"
+        assert all(df.columns == first.columns), "columns differ between years"
+        total += df.to_numpy()
+    return pd.DataFrame(total, index=first.index, columns=first.columns)
+
+
+def _sums(moments: _Moments, name: str) -> dict[str, np.ndarray]:
+    """Mergeable count, sum and sum of squares of moments"""
+    return {
+        f"{name}_count": moments.count.astype(np.float64),
+        f"{name}_sum": moments.mean * moments.count,
+        f"{name}_sumsq": moments.m2 + moments.mean**2 * moments.count,
+    }
+
+
+def _mean_std(df: pd.DataFrame, name: str) -> tuple[np.ndarray, np.ndarray]:
+    """Mean and (population) std from merged count, sum and sum of squares"""
+    count = df[f"{name}_count"].to_numpy()
+    mean = df[f"{name}_sum"].to_numpy() / count
+    var = df[f"{name}_sumsq"].to_numpy() / count - mean**2
+    return mean, np.sqrt(np.maximum(var, 0.0))
+
+
+class _Daily(_Accumulator):
+    """
+    Running moments of a daily aggregate per cell. Values are added in
+    time order, in blocks of one or more timesteps of the same day
+    (all columns of a day, or message by message while decoding).
+    Moments are updated whenever a day is complete.
+    """
+
+    names: tuple[str, ...] = ()
+
+    def __init__(self, n: int):
+        self.moments = {d: _Moments(n) for d in self.names}
+        self._day: str | None = None
+        self._running: list[np.ndarray] = []
+
+    @abstractmethod
+    def _reduce(self, values: np.ndarray) -> list[np.ndarray]:
+        """Reduce (cell, timestep) values to one array per name"""
+
+    @abstractmethod
+    def _combine(self, running: list, reduced: list) -> list[np.ndarray]:
+        """Combine reduced values with the running ones of the same day"""
+
+    def _flush(self):
+        for name, x in zip(self.names, self._running):
+            self.moments[name].update(x)
+        self._day, self._running = None, []
+
+    def update(self, day: str, *arrays: np.ndarray):
+        (values,) = arrays
+        reduced = self._reduce(values)
+        if day == self._day:
+            self._running = self._combine(self._running, reduced)
+        else:
+            self._flush()
+            self._day, self._running = day, reduced
+
+    def table(self, index: pd.Index) -> pd.DataFrame:
+        """Count, sum and sum of squares of each moment"""
+        self._flush()
+        cols = {}
+        for name, moments in self.moments.items():
+            cols.update(_sums(moments, name=name))
+        return pd.DataFrame(cols, index=index)
+
+
+class _DailyExtremes(_Daily):
+    """Running moments of daily highs and lows (NaNs are ignored)"""
+
+    names = ("high", "low")
+
+    def _reduce(self, values: np.ndarray) -> list[np.ndarray]:
+        return [np.fmax.reduce(values, axis=1), np.fmin.reduce(values, axis=1)]
+
+    def _combine(self, running: list, reduced: list) -> list[np.ndarray]:
+        return [np.fmax(running[0], reduced[0]), np.fmin(running[1], reduced[1])]
+
+
+class _DailySums(_Daily):
+    """Running moments of daily sums in mm of precipitation in m (NaNs are 0)"""
+
+    names = ("daily",)
+
+    def _reduce(self, values: np.ndarray) -> list[np.ndarray]:
+        return [np.nansum(values, axis=1) * 1000]  # m to mm
+
+    def _combine(self, running: list, reduced: list) -> list[np.ndarray]:
+        return [running[0] + reduced[0]]
+
+
+def _iter_days(columns: Iterable[str]) -> Iterator[tuple[str, list[int]]]:
+    """Positions of columns ("{day}-{i}") of each day in order of appearance"""
+    days: dict[str, list[int]] = {}
+    for ci, col in enumerate(columns):
+        days.setdefault(col.split("-")[0], []).append(ci)
+    yield from days.items()
+
+
+def _daily(acc: _Daily, df: pd.DataFrame) -> pd.DataFrame:
+    values = df.to_numpy()
+    for day, cols in _iter_days(df.columns):
+        acc.update(day, values[:, cols])
+    return acc.table(df.index)
+
+
+def _daily_extremes(
+    invar: str, month: int, year: int, datadir: Path, lat_range: LatRange = None
+) -> pd.DataFrame:
+    """Partial moments of daily highs and lows of a year"""
+    df = _read_month(
+        datadir=datadir, variable=invar, year=year, month=month, lat_range=lat_range
+    )
+    return _daily(_DailyExtremes(len(df)), df=df)
+
+
+def _extremes_table(df: pd.DataFrame) -> pd.DataFrame:
+    high_mean, high_std = _mean_std(df, name="high")
+    low_mean, low_std = _mean_std(df, name="low")
+    return pd.DataFrame(
         {
-            "high_mean": np.mean(maxs_arr, axis=1) - 273.15,
-            "high_std": np.std(maxs_arr, axis=1),
-            "low_mean": np.mean(mins_arr, axis=1) - 273.15,
-            "low_std": np.std(mins_arr, axis=1),
+            "high_mean": high_mean - 273.15,
+            "high_std": high_std,
+            "low_mean": low_mean - 273.15,
+            "low_std": low_std,
         },
         index=df.index,
     )
-    pq.write_table(df=df, file=datadir / f"aggregated_seatemp_{label}_{month}.pq")
 
 
-def waves(month: int, years: list[int], label: str, datadir: Path):
+def _daily_sums(
+    month: int, year: int, datadir: Path, lat_range: LatRange = None
+) -> pd.DataFrame:
+    """Partial moments of daily precipitation sums of a year"""
+    invar = "total_precipitation"
+    df = _read_month(
+        datadir=datadir, variable=invar, year=year, month=month, lat_range=lat_range
+    )
+    return _daily(_DailySums(len(df)), df=df)
+
+
+_WAVE_COLUMNS = [str(d["i"]) for d in WAVES]
+
+
+def _count_waves(
+    month: int, year: int, datadir: Path, lat_range: LatRange = None
+) -> pd.DataFrame:
+    """Partial wave height counts of a year"""
     invar = "significant_height_of_combined_wind_waves_and_swell"
-    max_i = max(d["i"] for d in WAVES)
-    df = pq.read_table(datadir / f"extracted_{invar}_{years[0]}-{month}.pq")
-    index = df.index.copy()
+    df = _read_month(
+        datadir=datadir, variable=invar, year=year, month=month, lat_range=lat_range
+    )
+    counts = _count_bins(_bin(df.to_numpy(), by=WAVES), nbins=len(_WAVE_COLUMNS))
+    return pd.DataFrame(counts, index=df.index, columns=_WAVE_COLUMNS)
 
-    bins = []
-    for year in years:
-        print(f"Year {invar} {year}-{month}...")
-        df = pq.read_table(datadir / f"extracted_{invar}_{year}-{month}.pq")
-        assert df.index.equals(index)
-        bins.append(_bin(df.to_numpy(), by=WAVES))
-
-    counts = np.apply_along_axis(
-        lambda d: np.bincount(d[d >= 0], minlength=max_i + 1),
-        axis=1,
-        arr=np.concatenate(bins, axis=1),
+
+def _uv_columns(vels: list[dict]) -> list[str]:
+    dir_idxs = [d["i"] for d in DIRECTIONS[:-1]]  # last one (17) is helper
+    vel_idxs = [d["i"] for d in vels]
+    return [f"{d}|{v}" for d, v in product(dir_idxs, vel_idxs)]
+
+
+def _uv_bins(u: np.ndarray, v: np.ndarray, vels: list[dict], is_wind: bool):
+    D = _bin_dirs(direction(u=u, v=v, is_wind=is_wind))
+    V = _bin(velocity(u=u, v=v), by=vels)
+    return _joint_bins(D, V, nvels=len(vels))
+
+
+def _count_uv_rows(
+    arrays: dict[str, np.ndarray], rows: slice, vels: list[dict], is_wind: bool
+):
+    """Count rows of shared u/v into their rows of shared counts C"""
+    u, v, C = arrays["u"][rows], arrays["v"][rows], arrays["C"]
+    B = _uv_bins(u=u, v=v, vels=vels, is_wind=is_wind)
+    C[rows] = _count_bins(B, nbins=C.shape[1])
+
+
+def _count_uv_shared(
+    chunks: Iterator[tuple[pd.Index, np.ndarray, np.ndarray]],
+    index: pd.Index,
+    ncolumns: int,
+    vels: list[dict],
+    is_wind: bool,
+    workers: shm.Workers,
+    chunksize: int,
+) -> np.ndarray:
+    """
+    Count like _count_uv with worker processes. Chunks of u/v are copied
+    into shared memory while reading, then each process counts slices
+    of cells and writes them into the shared counts in place.
+    """
+    with shm.SharedArrays() as arrays:
+        C = arrays.zeros("C", shape=(len(index), ncolumns), dtype=np.uint32)
+        offset = 0
+        for chunk_index, u, v in chunks:
+            if offset == 0:
+                shape = (len(index), u.shape[1])
+                arrays.empty("u", shape=shape, dtype=u.dtype)
+                arrays.empty("v", shape=shape, dtype=v.dtype)
+            n = len(chunk_index)
+            assert np.array_equal(index[offset : offset + n], chunk_index)
+            arrays["u"][offset : offset + n] = u
+            arrays["v"][offset : offset + n] = v
+            offset += n
+        assert offset == len(index)
+
+        arrays.map_rows(
+            partial(_count_uv_rows, vels=vels, is_wind=is_wind),
+            nrows=len(index),
+            workers=workers,
+            chunksize=chunksize,
+        )
+        return C.copy()
+
+
+def _count_uv(
+    uvar: str,
+    vvar: str,
+    vels: list[dict],
+    is_wind: bool,
+    month: int,
+    year: int,
+    datadir: Path,
+    chunksize: int,
+    lat_range: LatRange = None,
+    workers: shm.Workers | None = None,
+) -> pd.DataFrame:
+    """
+    Count direction x velocity bins of all cells of a year.
+    The u/v files are read once in chunks of cells,
+    so only one chunk is held in memory at a time.
+    With workers all chunks are put in shared memory
+    and counted by the worker processes instead.
+    """
+    index = _read_index(
+        datadir=datadir, variable=uvar, year=year, month=month, lat_range=lat_range
+    )
+    columns = _uv_columns(vels)
+    chunks = _iter_uv(
+        datadir=datadir,
+        uvar=uvar,
+        vvar=vvar,
+        year=year,
+        month=month,
+        chunksize=chunksize,
+        lat_range=lat_range,
+    )
+    if workers is not None:
+        C = _count_uv_shared(
+            chunks,
+            index=index,
+            ncolumns=len(columns),
+            vels=vels,
+            is_wind=is_wind,
+            workers=workers,
+            chunksize=chunksize,
+        )
+        return pd.DataFrame(C, index=index, columns=columns)
+
+    C = np.zeros((len(index), len(columns)), dtype=np.uint32)
+    offset = 0
+    for chunk_index, u, v in chunks:
+        n = len(chunk_index)
+        assert np.array_equal(index[offset : offset + n], chunk_index)
+        B = _uv_bins(u=u, v=v, vels=vels, is_wind=is_wind)
+        C[offset : offset + n] += _count_bins(B, nbins=len(columns))
+        offset += n
+    assert offset == len(index)
+
+    return pd.DataFrame(C, index=index, columns=columns)
+
+
+def _compute_partial(
+    name: str,
+    month: int,
+    year: int,
+    datadir: Path,
+    chunksize: int,
+    lat_range: LatRange = None,
+    workers: shm.Workers | None = None,
+) -> pd.DataFrame:
+    """
+    Compute partial of a year for variable name (see VARMAP),
+    u/v counts with worker processes if there are workers
+    """
+    if name in ("temp", "seatemp"):
+        return _daily_extremes(
+            invar=VARMAP[name][0],
+            month=month,
+            year=year,
+            datadir=datadir,
+            lat_range=lat_range,
+        )
+    if name == "rain":
+        return _daily_sums(month=month, year=year, datadir=datadir, lat_range=lat_range)
+    if name == "wave":
+        return _count_waves(
+            month=month, year=year, datadir=datadir, lat_range=lat_range
+        )
+    uvar, vvar = VARMAP[name]
+    return _count_uv(
+        uvar=uvar,
+        vvar=vvar,
+        vels=WIND_VELS if name == "wind" else CURRENT_VELS,
+        is_wind=name == "wind",
+        month=month,
+        year=year,
+        datadir=datadir,
+        chunksize=chunksize,
+        lat_range=lat_range,
+        workers=workers,
     )
 
-    df = pd.DataFrame(counts, index=index)
-    df.drop(columns=0, inplace=True)
-    pq.write_table(df=df, file=datadir / f"aggregated_wave_{label}_{month}.pq")
 
+def write_partial(
+    name: str,
+    month: int,
+    year: int,
+    datadir: Path,
+    chunksize=CHUNKSIZE,
+    lat_band=LAT_BAND,
+    nproc=1,
+) -> int:
+    """
+    Compute and write partial of a year for variable name (see VARMAP).
+    Latitude bands of lat_band degrees are computed and written one
+    after another, so only one band is held in memory at a time.
+    Wind and current bands are counted by nproc processes sharing memory,
+    which are started once for all bands.
+    Returns number of cells written.
+    """
+    invars = VARMAP[name]
+    print(f"Year {'/'.join(invars)} {year}-{month}...")
+    index = _read_index(datadir=datadir, variable=invars[0], year=year, month=month)
+    files = _input_files(name=name, year=year, month=month, datadir=datadir)
+    file = _partial_file(datadir=datadir, name=name, year=year, month=month)
+    is_uv = name in ("wind", "current")
+    workers = shm.Workers(nproc=nproc) if nproc > 1 and is_uv else None
+    with workers or nullcontext():
+        dfs = (
+            _compute_partial(
+                name=name,
+                month=month,
+                year=year,
+                datadir=datadir,
+                chunksize=chunksize,
+                lat_range=d,
+                workers=workers,
+            )
+            for d in _lat_ranges(index=index, files=files, lat_band=lat_band)
+        )
+        return pq.write_tables(dfs, file=file, float_dtype=np.float64)
+
+
+class _WaveCounts(_Counts):
+    def __init__(self, n: int):
+        super().__init__(n, nbins=len(_WAVE_COLUMNS))
+
+    def update(self, day: str, *arrays: np.ndarray):
+        (values,) = arrays
+        self.add(_bin(values, by=WAVES))
+
+    def table(self, index: pd.Index) -> pd.DataFrame:
+        return pd.DataFrame(self.C, index=index, columns=_WAVE_COLUMNS)
+
+
+class _UVCounts(_Counts):
+    def __init__(self, n: int, vels: list[dict], is_wind: bool):
+        self.columns = _uv_columns(vels)
+        self.vels = vels
+        self.is_wind = is_wind
+        super().__init__(n, nbins=len(self.columns))
+
+    def update(self, day: str, *arrays: np.ndarray):
+        u, v = arrays
+        self.add(_uv_bins(u=u, v=v, vels=self.vels, is_wind=self.is_wind))
+
+    def table(self, index: pd.Index) -> pd.DataFrame:
+        return pd.DataFrame(self.C, index=index, columns=self.columns)
+
+
+def _accumulator(name: str, n: int) -> _Accumulator:
+    """Running partial of n cells for variable name (see VARMAP)"""
+    if name in ("temp", "seatemp"):
+        return _DailyExtremes(n)
+    if name == "rain":
+        return _DailySums(n)
+    if name == "wave":
+        return _WaveCounts(n)
+    vels = WIND_VELS if name == "wind" else CURRENT_VELS
+    return _UVCounts(n, vels=vels, is_wind=name == "wind")
+
+
+def _stream_era5(name: str, month: int, year: int, inputdir: Path) -> pd.DataFrame:
+    """
+    Partial of a year decoded message by message from raw ERA5 files.
+    Messages of u and v are decoded side by side.
+    """
+    streams = [
+        era5.iter_messages(variable=d, inputdir=inputdir, year=year, month=month)
+        for d in VARMAP[name]
+    ]
+    steps = zip(*streams, strict=True)
+    first = next(steps, None)
+    assert first is not None, f"no messages of {year}-{month}"
+    cells = first[0][1]
+    acc = _accumulator(name, n=len(cells))
+    for msgs in chain([first], steps):
+        day, cells_i, _ = msgs[0]
+        assert all(d[0] == day for d in msgs), "messages out of step"
+        assert np.array_equal(cells, cells_i), "cells changed between messages"
+        acc.update(str(day), *(d[2][:, None] for d in msgs))
+    return acc.table(pd.Index(cells, name=pq.INDEX))
+
+
+def _stream_oras5(
+    name: str, month: int, year: int, inputdir: Path, **kwargs
+) -> pd.DataFrame:
+    """Partial of a year from values extracted from raw ORAS5 archives"""
+    u, v = (
+        oras5.read_month(
+            variable=d, year=year, month=month, inputdir=inputdir, **kwargs
+        )
+        for d in VARMAP[name]
+    )
+    assert u.index.equals(v.index)
+    acc = _accumulator(name, n=len(u))
+    acc.update(str(month), u.to_numpy(), v.to_numpy())
+    return acc.table(u.index)
+
+
+def write_streamed_partial(
+    name: str,
+    month: int,
+    year: int,
+    inputdir: Path,
+    datadir: Path,
+    lat_band=LAT_BAND,
+    **oras5_kwargs,
+) -> int:
+    """
+    Decode raw files of variable name (see VARMAP) straight into its partial
+    of a year, without writing and reading extracted values. Only the
+    running aggregates of the cells are held in memory (for ORAS5 the
+    values of a month, they are monthly). oras5_kwargs are passed on to ORAS5
+    extraction (resolution and ranges). Returns number of cells written.
+    """
+    invars = VARMAP[name]
+    print(f"Year {'/'.join(invars)} {year}-{month} from raw files...")
+    if invars[0] in oras5.VARS:
+        df = _stream_oras5(
+            name=name, month=month, year=year, inputdir=inputdir, **oras5_kwargs
+        )
+    else:
+        df = _stream_era5(name=name, month=month, year=year, inputdir=inputdir)
+    file = _partial_file(datadir=datadir, name=name, year=year, month=month)
+    dfs = pq.split_lat_bands(df, bands=grid.lat_bands(lat_band))
+    return pq.write_tables(dfs, file=file, float_dtype=np.float64)
+
+
+def _aggregate(
+    name: str,
+    month: int,
+    years: list[int],
+    datadir: Path,
+    chunksize=CHUNKSIZE,
+    lat_band=LAT_BAND,
+    nproc=1,
+) -> Iterator[pd.DataFrame]:
+    """Merge partials of years latitude band by latitude band"""
+    partials = _iter_partials(
+        name=name,
+        month=month,
+        years=years,
+        datadir=datadir,
+        chunksize=chunksize,
+        lat_band=lat_band,
+        nproc=nproc,
+    )
+    for dfs in partials:
+        yield _merge_partials(dfs)
 
-def winds(month: int, years: list[int], label: str, datadir: Path):
-    uvar = "10m_u_component_of_wind"
-    vvar = "10m_v_component_of_wind"
-    dir_idxs = [d["i"] for d in DIRECTIONS[:-1]]  # last one (17) is helper
-    vel_idxs = [d["i"] for d in WIND_VELS]
-    dir_vel_idxs = list(product(dir_idxs, vel_idxs))
 
-    df = pq.read_table(datadir / f"extracted_{uvar}_{years[0]}-{month}.pq")
-    index = df.index.copy()
-    del df
+def _rain_table(df: pd.DataFrame) -> pd.DataFrame:
+    mean, std = _mean_std(df, name="daily")
 
-    C = np.zeros((len(index), len(dir_vel_idxs)), dtype=int)
-    for year in years:
-        print(f"Year wind components {year}-{month}...")
-        ufile = datadir / f"extracted_{uvar}_{year}-{month}.pq"
-        vfile = datadir / f"extracted_{vvar}_{year}-{month}.pq"
+    # the sums were only of every 3rd hour
+    return pd.DataFrame({"daily_mean": mean * 3, "daily_std": std}, index=df.index)
 
-        df = _get_dirs(ufile=ufile, vfile=vfile, is_wind=True)
-        assert index.equals(df.index)
-        D = _bin(df.to_numpy(), by=DIRECTIONS)
-        D[D == 17] = 1  # 17 was helper
-        del df
 
-        df = _get_velos(ufile=ufile, vfile=vfile)
-        assert index.equals(df.index)
-        V = _bin(df.to_numpy(), by=WIND_VELS)
-        del df
+def temps(month: int, years: list[int], label: str, datadir: Path) -> int:
+    dfs = _aggregate(name="temp", month=month, years=years, datadir=datadir)
+    file = datadir / f"aggregated_temp_{label}_{month}.pq"
+    return pq.write_tables((_extremes_table(d) for d in dfs), file=file)
 
-        for ci, (dr, vl) in enumerate(dir_vel_idxs):
-            C[:, ci] += np.sum((D == dr) & (V == vl), axis=1)
 
-    df = pd.DataFrame(C, index=index, columns=[f"{d}|{v}" for d, v in dir_vel_idxs])
-    pq.write_table(df=df, file=datadir / f"aggregated_wind_{label}_{month}.pq")
-    del df, C
+def rains(month: int, years: list[int], label: str, datadir: Path) -> int:
+    dfs = _aggregate(name="rain", month=month, years=years, datadir=datadir)
+    file = datadir / f"aggregated_rain_{label}_{month}.pq"
+    return pq.write_tables((_rain_table(d) for d in dfs), file=file)
 
 
-def currents(month: int, years: list[int], label: str, datadir: Path):
-    uvar = "rotated_zonal_velocity"
-    vvar = "rotated_meridional_velocity"
-    dir_idxs = [d["i"] for d in DIRECTIONS[:-1]]  # last one (17) is helper
-    vel_idxs = [d["i"] for d in CURRENT_VELS]
-    dir_vel_idxs = list(product(dir_idxs, vel_idxs))
+def seatemps(month: int, years: list[int], label: str, datadir: Path) -> int:
+    dfs = _aggregate(name="seatemp", month=month, years=years, datadir=datadir)
+    file = datadir / f"aggregated_seatemp_{label}_{month}.pq"
+    return pq.write_tables((_extremes_table(d) for d in dfs), file=file)
 
-    df = pq.read_table(datadir / f"extracted_{uvar}_{years[0]}-{month}.pq")
-    index = df.index.copy()
-    del df
 
-    C = np.zeros((len(index), len(dir_vel_idxs)), dtype=int)
-    for year in years:
-        print(f"Year current components {year}-{month}...")
-        ufile = datadir / f"extracted_{uvar}_{year}-{month}.pq"
-        vfile = datadir / f"extracted_{vvar}_{year}-{month}.pq"
-
-        df = _get_dirs(ufile=ufile, vfile=vfile, is_wind=False)
-        assert index.equals(df.index)
-        D = _bin(df.to_numpy(), by=DIRECTIONS)
-        D[D == 17] = 1  # 17 was helper
-        del df
-
-        df = _get_velos(ufile=ufile, vfile=vfile)
-        assert index.equals(df.index)
-        V = _bin(df.to_numpy(), by=CURRENT_VELS)
-        del df
-
-        for ci, (dr, vl) in enumerate(dir_vel_idxs):
-            C[:, ci] += np.sum((D == dr) & (V == vl), axis=1)
-
-    df = pd.DataFrame(C, index=index, columns=[f"{d}|{v}" for d, v in dir_vel_idxs])
-    pq.write_table(df=df, file=datadir / f"aggregated_current_{label}_{month}.pq")
-    del df, C
+def waves(month: int, years: list[int], label: str, datadir: Path) -> int:
+    dfs = _aggregate(name="wave", month=month, years=years, datadir=datadir)
+    return pq.write_tables(dfs, file=datadir / f"aggregated_wave_{label}_{month}.pq")
+
+
+def winds(
+    month: int,
+    years: list[int],
+    label: str,
+    datadir: Path,
+    chunksize=CHUNKSIZE,
+    nproc=1,
+) -> int:
+    dfs = _aggregate(
+        name="wind",
+        month=month,
+        years=years,
+        datadir=datadir,
+        chunksize=chunksize,
+        nproc=nproc,
+    )
+    return pq.write_tables(dfs, file=datadir / f"aggregated_wind_{label}_{month}.pq")
+
+
+def currents(
+    month: int,
+    years: list[int],
+    label: str,
+    datadir: Path,
+    chunksize=CHUNKSIZE,
+    nproc=1,
+) -> int:
+    dfs = _aggregate(
+        name="current",
+        month=month,
+        years=years,
+        datadir=datadir,
+        chunksize=chunksize,
+        nproc=nproc,
+    )
+    file = datadir / f"aggregated_current_{label}_{month}.pq"
+    return pq.write_tables(dfs, file=file)
+
+
+def _input_files(
+    name: str, year: int, month: int, datadir: Path, store="parquet"
+) -> list[Path]:
+    """
+    Extracted files read for variable name (see VARMAP), cubes
+    if they exist or will be extracted (store cube)
+    """
+    files: list[Path] = []
+    for invar in VARMAP[name]:
+        if store == "cube" or cube.exists(datadir=datadir, variable=invar, year=year):
+            files.extend(cube.files(datadir=datadir, variable=invar, year=year))
+        else:
+            files.append(datadir / f"extracted_{invar}_{year}-{month}.pq")
+    return files
+
+
+# bins which partials depend on
+_BINS = {
+    "wind": {"directions": DIRECTIONS, "vels": WIND_VELS},
+    "current": {"directions": DIRECTIONS, "vels": CURRENT_VELS},
+    "wave": {"waves": WAVES},
+}
+
+
+def _raw_files(name: str, year: int, month: int, inputdir: Path) -> list[Path]:
+    """Raw files decoded for variable name (see VARMAP)"""
+    module = oras5 if VARMAP[name][0] in oras5.VARS else era5
+    return [
+        module.raw_file(inputdir=inputdir, variable=d, year=year, month=month)
+        for d in VARMAP[name]
+    ]
+
+
+def _partial_target(cnfg: Config, name: str, year: int, month: int) -> Target:
+    """Partial of a year from extracted values, or raw files with store stream"""
+    datadir = cnfg.outputdir
+    output = _partial_file(datadir, name=name, year=year, month=month)
+    if cnfg.store != "stream":
+        return Target(
+            name=f"partial/{name}/{year}/{month}",
+            fun=partial(
+                write_partial,
+                name=name,
+                month=month,
+                year=year,
+                datadir=datadir,
+                chunksize=cnfg.chunksize,
+                nproc=cnfg.partial_nproc,
+            ),
+            inputs=_input_files(
+                name=name, year=year, month=month, datadir=datadir, store=cnfg.store
+            ),
+            outputs=[output],
+            params=_BINS.get(name, {}),
+        )
+
+    oras5_kwargs = {}
+    if VARMAP[name][0] in oras5.VARS:
+        oras5_kwargs = {
+            "resolution": cnfg.resolution,
+            "lat_range": cnfg.lat_range,
+            "lon_range": cnfg.lon_range,
+        }
+    return Target(
+        name=f"partial/{name}/{year}/{month}",
+        fun=partial(
+            write_streamed_partial,
+            name=name,
+            month=month,
+            year=year,
+            inputdir=cnfg.inputdir,
+            datadir=datadir,
+            **oras5_kwargs,
+        ),
+        inputs=_raw_files(name=name, year=year, month=month, inputdir=cnfg.inputdir),
+        outputs=[output],
+        params={"store": cnfg.store, **_BINS.get(name, {}), **oras5_kwargs},
+    )
+
+
+def targets(cnfg: Config) -> list[Target]:
+    """Build targets of per-year partials and aggregated time ranges"""
+    funmap: dict[str, Callable[..., int]] = {
+        "wind": partial(winds, chunksize=cnfg.chunksize, nproc=cnfg.partial_nproc),
+        "temp": temps,
+        "seatemp": seatemps,
+        "wave": waves,
+        "rain": rains,
+        "current": partial(
+            currents, chunksize=cnfg.chunksize, nproc=cnfg.partial_nproc
+        ),
+    }
+    datadir = cnfg.outputdir
+    all_years = sorted(set(d for v in cnfg.time_ranges.values() for d in v))
+    out = []
+    for name, month in product(cnfg.variables, cnfg.months):
+        for year in all_years:
+            out.append(_partial_target(cnfg=cnfg, name=name, year=year, month=month))
+        for label, years in cnfg.time_ranges.items():
+            out.append(
+                Target(
+                    name=f"aggregated/{name}/{label}/{month}",
+                    fun=partial(
+                        funmap[name],
+                        month=month,
+                        years=years,
+                        label=label,
+                        datadir=datadir,
+                    ),
+                    inputs=[
+                        _partial_file(datadir, name=name, year=d, month=month)
+                        for d in years
+                    ],
+                    outputs=[datadir / f"aggregated_{name}_{label}_{month}.pq"],
+                    params={"years": years},
+                )
+            )
+    return out
@@ -0,0 +1,203 @@
+"""
+Build graph of pipeline stages
+
+Each target knows its input and output files, the config it depends on
+and the function which builds it (raw -> extracted -> partial -> aggregated
+-> tiles). A target is stale if an output is missing or was changed,
+or if the fingerprint of its inputs and config differs from the one stored
+when it was last built. Inputs are fingerprinted by mtime and size
+(or by content hash). Only stale targets are built. Targets wait for
+targets which build their inputs, all others are built in parallel.
+
+Fingerprints are stored in {outputdir}/.build/{target name}.json
+"""
+
+from typing import Callable, Iterable
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import json
+import hashlib
+from .profiling import Profiler
+
+BUILDDIR = ".build"
+
+
+class Target:
+    """
+    Build outputs from inputs with fun (which must be picklable
+    for building in parallel). Config in params is part of the fingerprint.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        fun: Callable[[], object],
+        inputs: Iterable[Path],
+        outputs: Iterable[Path],
+        params: dict | None = None,
+    ):
+        self.name = name
+        self.fun = fun
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = params or {}
+
+
+def _file_stamp(file: Path, hashing: bool) -> list:
+    if not file.is_file():
+        return [str(file), None]
+    if hashing:
+        digest = hashlib.blake2b(digest_size=16)
+        with open(file, "rb") as fh:
+            while chunk := fh.read(2**24):
+                digest.update(chunk)
+        return [str(file), digest.hexdigest()]
+    stat = file.stat()
+    return [str(file), stat.st_size, stat.st_mtime_ns]
+
+
+def _fingerprint(target: Target, hashing: bool) -> dict:
+    inputs = [_file_stamp(d, hashing=hashing) for d in target.inputs]
+    params = json.dumps(target.params, sort_keys=True, default=str)
+    key = json.dumps([inputs, params]).encode()
+    return {
+        "inputs": hashlib.blake2b(key, digest_size=16).hexdigest(),
+        "outputs": [_file_stamp(d, hashing=hashing) for d in target.outputs],
+    }
+
+
+def _stampfile(builddir: Path, target: Target) -> Path:
+    return builddir / f"{target.name.replace('/', '_')}.json"
+
+
+def _is_stale(target: Target, builddir: Path, hashing: bool) -> bool:
+    file = _stampfile(builddir=builddir, target=target)
+    if not file.is_file() or any(not d.is_file() for d in target.outputs):
+        return True
+    with open(file, encoding="utf-8") as fh:
+        stamp = json.load(fh)
+    return stamp != _fingerprint(target=target, hashing=hashing)
+
+
+def _stamp(target: Target, builddir: Path, hashing: bool):
+    """Store fingerprint of built target (written last, like cube sidecars)"""
+    file = _stampfile(builddir=builddir, target=target)
+    tmpfile = file.with_suffix(".tmp")
+    with open(tmpfile, "w", encoding="utf-8") as fh:
+        json.dump(_fingerprint(target=target, hashing=hashing), fh)
+    tmpfile.rename(file)
+
+
+def dependencies(targets: list[Target]) -> dict[str, set[str]]:
+    """Names of targets building inputs of each target"""
+    producers = {d: t.name for t in targets for d in t.outputs}
+    return {
+        t.name: {producers[d] for d in t.inputs if d in producers} - {t.name}
+        for t in targets
+    }
+
+
+def build_target(target: Target, builddir: Path, force=False, hashing=False) -> bool:
+    """
+    Build target if it is stale (or force) and store its fingerprint.
+    Returns whether it was built, raises if building failed.
+    """
+    builddir.mkdir(parents=True, exist_ok=True)
+    if not force and not _is_stale(target=target, builddir=builddir, hashing=hashing):
+        return False
+    target.fun()
+    _stamp(target=target, builddir=builddir, hashing=hashing)
+    return True
+
+
+def _waves(targets: list[Target]) -> list[list[Target]]:
+    """Group targets in waves, each only depends on targets of earlier waves"""
+    deps = dependencies(targets)
+    waves: list[list[Target]] = []
+    done: set[str] = set()
+    todo = list(targets)
+    while len(todo) > 0:
+        wave = [d for d in todo if deps[d.name] <= done]
+        assert len(wave) > 0, "targets depend on each other"
+        waves.append(wave)
+        done.update(d.name for d in wave)
+        todo = [d for d in todo if d.name not in done]
+    return waves
+
+
+def _done(
+    target: Target,
+    err: BaseException | None,
+    result: object,
+    builddir: Path,
+    hashing: bool,
+    failed: list[str],
+    profiler: Profiler | None,
+):
+    if err is not None:
+        print(f"Building {target.name} failed: {err}")
+        failed.append(target.name)
+        return
+    _stamp(target=target, builddir=builddir, hashing=hashing)
+    if profiler is not None:
+        assert isinstance(result, dict), "profiled functions return measurements"
+        profiler.add(
+            name=target.name,
+            inputs=target.inputs,
+            outputs=target.outputs,
+            result=result,
+        )
+
+
+def run(
+    targets: list[Target],
+    builddir: Path,
+    nproc: int = 1,
+    force=False,
+    hashing=False,
+    profiler: Profiler | None = None,
+) -> list[str]:
+    """
+    Build stale targets, independent ones with nproc processes.
+    A failed target is reported and targets depending on it are skipped.
+    Built targets are measured by profiler if given.
+    Returns names of failed or skipped targets.
+    """
+    builddir.mkdir(parents=True, exist_ok=True)
+    producers = {d: t.name for t in targets for d in t.outputs}
+    failed: list[str] = []
+    kwargs = {
+        "builddir": builddir,
+        "hashing": hashing,
+        "failed": failed,
+        "profiler": profiler,
+    }
+    for wave in _waves(targets):
+        todo = []
+        for target in wave:
+            if any(producers.get(d) in failed for d in target.inputs):
+                print(f"Skipping {target.name} (inputs failed)")
+                failed.append(target.name)
+            elif force or _is_stale(target=target, builddir=builddir, hashing=hashing):
+                todo.append(target)
+        print(f"Building {len(todo):,} of {len(wave):,} targets (others up to date)")
+        funs = [d.fun if profiler is None else profiler.wrap(d.fun) for d in todo]
+
+        if nproc <= 1:
+            for target, fun in zip(todo, funs):
+                print(f"Building {target.name}...")
+                try:
+                    result = fun()
+                except Exception as err:  # pylint: disable=broad-except
+                    _done(target=target, err=err, result=None, **kwargs)
+                    continue
+                _done(target=target, err=None, result=result, **kwargs)
+            continue
+
+        with ProcessPoolExecutor(max_workers=nproc) as executor:
+            futures = [(d, executor.submit(f)) for d, f in zip(todo, funs)]
+            for target, future in futures:
+                exc = future.exception()
+                result = None if exc is not None else future.result()
+                _done(target=target, err=exc, result=result, **kwargs)
+    return failed
@@ -75,6 +75,19 @@ WAVES: list[dict] = [
 ]
 
 
+# cells per chunk (parquet row group) when processing files in chunks
+CHUNKSIZE = 100_000
+
+# degrees of latitude bands, files are written and aggregated band by band
+LAT_BAND = 10
+
+# stores for extracted values
+# parquet: one file per variable, year and month
+# cube: one dense memory-mapped array per variable and year (see cube.py)
+# stream: none, raw files are decoded straight into partials
+STORES = ("parquet", "cube", "stream")
+
+
 # variables
 # internal name -> dataset variable names
 VARMAP = {
@@ -105,9 +118,16 @@ class Config:
         outputdir: Path,
         nproc: int,
         is_test: bool,
+        partial_nproc=1,
         lat_range=(-70, 70),
         lon_range=(-180, 180),
         resolution=0.25,
+        chunksize=CHUNKSIZE,
+        store="parquet",
+        force=False,
+        hashing=False,
+        profile: Path | None = None,
+        profile_stacks=0,
     ):
         if is_test:
             years = years[:1]
@@ -120,11 +140,18 @@ class Config:
         self.years = years
         self.months = months
         self.nproc = nproc
+        self.partial_nproc = partial_nproc
         self.inputdir = inputdir
         self.outputdir = outputdir
         self.lat_range = lat_range
         self.lon_range = lon_range
         self.resolution = resolution
+        self.chunksize = chunksize
+        self.store = store
+        self.force = force
+        self.hashing = hashing
+        self.profile = profile
+        self.profile_stacks = profile_stacks
 
         self.time_ranges = {f"{max(years)}": [max(years)]}
         if len(years) > 1:
@@ -134,6 +161,10 @@ class Config:
         assert min(lon_range) >= -180 and max(lon_range) <= 180
         assert min(lat_range) >= -70 and max(lat_range) <= 70
         assert resolution >= 0.25
+        assert chunksize > 0
+        assert partial_nproc > 0
+        assert store in STORES
+        assert profile_stacks >= 0
 
     @classmethod
     def pop_from_kwargs(cls, kwargs: dict) -> "Config":
@@ -144,5 +175,12 @@ class Config:
             inputdir=Path(kwargs.pop("inputdir")),
             outputdir=Path(kwargs.pop("outputdir")),
             nproc=kwargs.pop("nproc"),
+            partial_nproc=kwargs.pop("partial_nproc"),
             is_test=kwargs.pop("test"),
+            chunksize=kwargs.pop("chunksize"),
+            store=kwargs.pop("store"),
+            force=kwargs.pop("force"),
+            hashing=kwargs.pop("hash"),
+            profile=None if (d := kwargs.pop("profile")) is None else Path(d),
+            profile_stacks=kwargs.pop("profile_stacks"),
         )
@@ -0,0 +1,103 @@
+"""
+Dense store for extracted values
+
+All months of a variable and year are stored as one dense (cell, timestep)
+float32 array. It is written in column-major order, so each month is a
+contiguous block on disk and is appended month by month during extraction.
+Reading memory-maps the array. Slices of months and cells are views,
+without copying or parsing. Processes reading the same cube share its pages
+through the OS cache.
+
+    extracted_{variable}_{year}.f32        values
+    extracted_{variable}_{year}.cells.npy  cell ids (rows)
+    extracted_{variable}_{year}.json       shape, columns, month slices
+
+The sidecar is written last, a cube without it is incomplete.
+"""
+
+from typing import Iterable
+from pathlib import Path
+import json
+import numpy as np
+import pandas as pd
+
+DTYPE = "float32"
+
+
+def files(datadir: Path, variable: str, year: int) -> tuple[Path, Path, Path]:
+    """Values, cells and sidecar file of cube"""
+    base = f"extracted_{variable}_{year}"
+    return (
+        datadir / f"{base}.f32",
+        datadir / f"{base}.cells.npy",
+        datadir / f"{base}.json",
+    )
+
+
+def exists(datadir: Path, variable: str, year: int) -> bool:
+    """Whether a complete cube exists for variable and year"""
+    return files(datadir=datadir, variable=variable, year=year)[2].is_file()
+
+
+def write(
+    outputdir: Path,
+    variable: str,
+    year: int,
+    months: Iterable[tuple[int, pd.DataFrame]],
+):
+    """
+    Write cube from month-wise DataFrames (cell index, one column per timestep).
+    Months are consumed one by one, so only one month is held in memory.
+    """
+    valsfile, cellsfile, metafile = files(
+        datadir=outputdir, variable=variable, year=year
+    )
+    metafile.unlink(missing_ok=True)
+
+    cells = np.empty(0, dtype=np.int32)
+    columns: list[str] = []
+    month_slices: dict[str, list[int]] = {}
+    with open(valsfile, "wb") as fh:
+        for mi, (month, df) in enumerate(months):
+            if mi == 0:
+                cells = df.index.to_numpy().astype(np.int32)
+                np.save(cellsfile, cells)
+            assert np.array_equal(df.index, cells), "cells differ between months"
+            fh.write(df.to_numpy(dtype=DTYPE).tobytes(order="F"))
+            month_slices[str(month)] = [len(columns), len(columns) + df.shape[1]]
+            columns.extend(str(d) for d in df.columns)
+
+    meta = {
+        "dtype": DTYPE,
+        "shape": [len(cells), len(columns)],
+        "columns": columns,
+        "months": month_slices,
+    }
+    tmpfile = metafile.with_suffix(".tmp")
+    with open(tmpfile, "w", encoding="utf-8") as fh:
+        json.dump(meta, fh)
+    tmpfile.rename(metafile)
+
+
+def read_cells(datadir: Path, variable: str, year: int) -> np.ndarray:
+    """Read cell ids (rows) of cube"""
+    _, cellsfile, _ = files(datadir=datadir, variable=variable, year=year)
+    return np.load(cellsfile, mmap_mode="r")
+
+
+def read_month(
+    datadir: Path, variable: str, year: int, month: int
+) -> tuple[np.ndarray, list[str], np.ndarray]:
+    """
+    Get cell ids, column names and memory-mapped (cell, timestep)
+    values of a month of cube. Nothing is copied.
+    """
+    valsfile, _, metafile = files(datadir=datadir, variable=variable, year=year)
+    with open(metafile, encoding="utf-8") as fh:
+        meta = json.load(fh)
+    start, stop = meta["months"][str(month)]
+    values = np.memmap(
+        valsfile, dtype=meta["dtype"], mode="r", shape=tuple(meta["shape"]), order="F"
+    )
+    cells = read_cells(datadir=datadir, variable=variable, year=year)
+    return cells, meta["columns"][start:stop], values[:, start:stop]
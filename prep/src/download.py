@@ -0,0 +1,109 @@
+"""
+Concurrent, resumable downloads from the Climate Data Store
+
+Downloads are split into parts of one variable, year and month each
+(raw_{variable}_{year}-{month}.grib or .tar.gz), and nthreads parts are
+requested at a time. Each part is retrieved into a temporary file, which
+is renamed once complete. Completed parts are recorded in a journal
+(download.log, file name and size per line), so a rerun skips them.
+A failed part is retried with backoff, and reported if it still fails
+while the others continue. Extraction reads the monthly parts directly.
+
+The client is created by client_factory for each part (cdsapi.Client
+by default), anything with retrieve(name, request, target) works.
+"""
+
+from typing import Callable, Protocol
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+import threading
+import cdsapi
+from .util import retry
+
+JOURNAL = "download.log"
+
+
+class Client(Protocol):
+    def retrieve(self, name: str, request: dict, target: str | None = None): ...
+
+
+class Part:
+    """Request of dataset written to file"""
+
+    def __init__(self, dataset: str, request: dict, file: Path):
+        self.dataset = dataset
+        self.request = request
+        self.file = file
+
+
+class _Journal:
+    """Append-only log of completed parts, flushed as parts complete"""
+
+    def __init__(self, file: Path):
+        self.sizes: dict[str, int] = {}
+        if file.is_file():
+            with open(file, encoding="utf-8") as fh:
+                for line in fh:
+                    parts = line.split()
+                    if len(parts) == 2:  # last line can be incomplete
+                        self.sizes[parts[0]] = int(parts[1])
+        self._fh = open(file, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def is_done(self, file: Path) -> bool:
+        size = self.sizes.get(file.name)
+        return size is not None and file.is_file() and file.stat().st_size == size
+
+    def add(self, file: Path):
+        with self._lock:
+            self._fh.write(f"{file.name} {file.stat().st_size}\n")
+            self._fh.flush()
+
+    def close(self):
+        self._fh.close()
+
+
+def _retrieve(part: Part, client_factory: Callable[[], Client]):
+    tmpfile = part.file.with_name(f"{part.file.name}.tmp")
+    client = client_factory()
+    client.retrieve(part.dataset, part.request, str(tmpfile))
+    tmpfile.rename(part.file)
+
+
+def run(
+    parts: list[Part],
+    outputdir: Path,
+    nthreads=4,
+    client_factory: Callable[[], Client] = cdsapi.Client,
+    retries=2,
+    backoff=30.0,
+) -> list[Path]:
+    """
+    Download parts not completed yet, nthreads at a time.
+    Returns files of parts which failed.
+    """
+    journal = _Journal(outputdir / JOURNAL)
+    todo = [d for d in parts if not journal.is_done(d.file)]
+    print(f"Downloading {len(todo):,} of {len(parts):,} parts (others completed)")
+
+    def download(part: Part) -> Path | None:
+        print(f"Downloading {part.file.name}...")
+        try:
+            retry(
+                partial(_retrieve, part=part, client_factory=client_factory),
+                retries=retries,
+                backoff=backoff,
+            )
+        except Exception as err:  # pylint: disable=broad-except
+            print(f"Downloading {part.file.name} failed: {err}")
+            return part.file
+        journal.add(part.file)
+        return None
+
+    try:
+        with ThreadPoolExecutor(max_workers=nthreads) as executor:
+            failed = [d for d in executor.map(download, todo) if d is not None]
+    finally:
+        journal.close()
+    return failed
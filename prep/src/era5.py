@@ -1,11 +1,18 @@
 """Functions for ERA5 reanalysis"""
 
+from typing import Iterator
 from pathlib import Path
+from functools import partial
+from itertools import product
+import numpy as np
 import pandas as pd
-import cdsapi
 import pupygrib
 from . import pq
-from .config import Config
+from . import download
+from . import cube
+from . import grid
+from .build import Target
+from .config import Config, CHUNKSIZE, LAT_BAND
 
 VARS = [
     "10m_u_component_of_wind",
@@ -17,40 +24,43 @@ VARS = [
 ]
 
 
-def _download_dataset(
+def raw_file(inputdir: Path, variable: str, year: int, month: int) -> Path:
+    """Downloaded part of month, or file of whole year downloaded before"""
+    part = inputdir / f"raw_{variable}_{year}-{month}.grib"
+    return part if part.is_file() else inputdir / f"raw_{variable}_{year}.grib"
+
+
+def _download_part(
     outputdir: Path,
     variable: str,
     year: int,
-    months: list[int],
+    month: int,
     lat_range: tuple[int, int],
     lon_range: tuple[int, int],
-):
-    outfile = outputdir / f"raw_{variable}_{year}.grib"
+) -> download.Part:
     sparse_times = [0, 3, 6, 9, 12, 15, 18, 21]
     days = list(range(1, 32))
-    client = cdsapi.Client()
-    client.retrieve(
-        "reanalysis-era5-single-levels",
-        {
+    return download.Part(
+        dataset="reanalysis-era5-single-levels",
+        request={
             "product_type": ["reanalysis"],
             "variable": [variable],
             "year": [str(year)],
-            "month": [f"{d:02d}" for d in months],
+            "month": [f"{month:02d}"],
             "day": [f"{d:02d}" for d in days],
             "time": [f"{d:02d}:00" for d in sparse_times],
             "data_format": "grib",
             "area": [max(lat_range), min(lon_range), min(lat_range), max(lon_range)],
         },
-        str(outfile),
+        file=outputdir / f"raw_{variable}_{year}-{month}.grib",
     )
 
 
-def _extract_and_write_values(
-    month: int, variable: str, inputdir: Path, outputdir: Path, year: int
-):
+def _extract_values(
+    month: int, variable: str, inputdir: Path, year: int
+) -> pd.DataFrame:
     print(f"Processing {variable} {year}-{month}...")
-    infile = inputdir / f"raw_{variable}_{year}.grib"
-    outfile = outputdir / f"extracted_{variable}_{year}-{month}.pq"
+    infile = raw_file(inputdir=inputdir, variable=variable, year=year, month=month)
     dfs = []
     with open(infile, "rb") as fh:
         for mi, msg in enumerate(pupygrib.read(fh)):
@@ -62,46 +72,150 @@ def _extract_and_write_values(
             values = msg.get_values()
             assert lats.shape == values.shape == lons.shape
 
-            df = pd.DataFrame(
-                {
-                    "lat": lats.flatten(),
-                    "lon": lons.flatten(),
-                    f"{time.day}-{mi}": values.flatten(),
-                }
-            )
+            cells = grid.cell_ids(lons=lons.flatten(), lats=lats.flatten())
+            assert (cells >= 0).all(), "coordinates outside of grid"
+            df = pd.DataFrame({"cell": cells, f"{time.day}-{mi}": values.flatten()})
             # dataset already has fixed 0.25° resolution
-            # each combination should only contain one row
-            dfs.append(df.groupby(["lon", "lat"]).mean())
+            # each cell should only contain one row
+            dfs.append(df.groupby("cell").mean())
 
-    df = pd.concat(dfs, axis=1)  # wide with NaNs
-    pq.write_table(df=df, file=outfile)
+    return pd.concat(dfs, axis=1)  # wide with NaNs
 
 
-def download(cnfg: Config):
-    variables = [d for d in cnfg.download_variables if d in VARS]
-    for year in cnfg.years:
-        for variable in variables:
-            print(f"Downloading {variable} {year}...")
-            _download_dataset(
-                outputdir=cnfg.outputdir,
-                variable=variable,
-                year=year,
-                months=cnfg.months,
-                lat_range=cnfg.lat_range,
-                lon_range=cnfg.lon_range,
+def _mean_by_cell(
+    cells: np.ndarray, values: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """Sorted unique cells and mean of their values (ignoring NaNs)"""
+    uniq, inverse = np.unique(cells, return_inverse=True)
+    valid = ~np.isnan(values)
+    sums = np.bincount(inverse[valid], weights=values[valid], minlength=len(uniq))
+    counts = np.bincount(inverse[valid], minlength=len(uniq))
+    means = np.full(len(uniq), np.nan)
+    np.divide(sums, counts, out=means, where=counts > 0)
+    return uniq, means
+
+
+def iter_messages(
+    variable: str, inputdir: Path, year: int, month: int
+) -> Iterator[tuple[int, np.ndarray, np.ndarray]]:
+    """
+    Decode raw file message by message and yield day, sorted cells
+    and values of each message of a month, without collecting them.
+    Values are float32 like extracted files, NaN where masked.
+    """
+    infile = raw_file(inputdir=inputdir, variable=variable, year=year, month=month)
+    with open(infile, "rb") as fh:
+        for msg in pupygrib.read(fh):
+            time = msg.get_time()
+            if time.year != year or time.month != month:
+                continue
+
+            lons, lats = msg.get_coordinates()
+            values: np.ndarray = np.ma.filled(
+                np.ma.asarray(msg.get_values(), float), np.nan
             )
+            assert lats.shape == values.shape == lons.shape
+
+            cells = grid.cell_ids(lons=lons.flatten(), lats=lats.flatten())
+            assert (cells >= 0).all(), "coordinates outside of grid"
+            cells, values = _mean_by_cell(cells=cells, values=values.flatten())
+            yield time.day, cells, values.astype(np.float32)
+
 
+def _extract_and_write_values(
+    month: int,
+    variable: str,
+    inputdir: Path,
+    outputdir: Path,
+    year: int,
+    chunksize=CHUNKSIZE,
+) -> int:
+    outfile = outputdir / f"extracted_{variable}_{year}-{month}.pq"
+    df = _extract_values(month=month, variable=variable, inputdir=inputdir, year=year)
+    bands = grid.lat_bands(LAT_BAND)
+    pq.write_table(df=df, file=outfile, row_group_size=chunksize, bands=bands)
+    return len(df)
 
-def extract(cnfg: Config):
+
+def download_parts(cnfg: Config) -> list[download.Part]:
+    """Parts to download, one per variable, year and month"""
     variables = [d for d in cnfg.download_variables if d in VARS]
-    for year in cnfg.years:
-        for variable in variables:
-            print(f"Extracting {variable} {year}...")
-            for month in cnfg.months:
-                _extract_and_write_values(
-                    month=month,
-                    inputdir=cnfg.inputdir,
-                    outputdir=cnfg.outputdir,
-                    year=year,
-                    variable=variable,
+    return [
+        _download_part(
+            outputdir=cnfg.outputdir,
+            variable=variable,
+            year=year,
+            month=month,
+            lat_range=cnfg.lat_range,
+            lon_range=cnfg.lon_range,
+        )
+        for year, variable, month in product(cnfg.years, variables, cnfg.months)
+    ]
+
+
+def _extract_and_write_cube(
+    variable: str, year: int, months: list[int], inputdir: Path, outputdir: Path
+) -> int:
+    dfs = (
+        (d, _extract_values(month=d, variable=variable, inputdir=inputdir, year=year))
+        for d in months
+    )
+    cube.write(outputdir=outputdir, variable=variable, year=year, months=dfs)
+    return len(cube.read_cells(datadir=outputdir, variable=variable, year=year))
+
+
+def targets(cnfg: Config) -> list[Target]:
+    """Build targets extracting values from raw files"""
+    variables = [d for d in cnfg.download_variables if d in VARS]
+    params = {"store": cnfg.store, "chunksize": cnfg.chunksize}
+    out: list[Target] = []
+    if cnfg.store == "stream":
+        return out  # raw files are aggregated directly
+
+    for year, variable in product(cnfg.years, variables):
+        raws = {
+            d: raw_file(inputdir=cnfg.inputdir, variable=variable, year=year, month=d)
+            for d in cnfg.months
+        }
+        if cnfg.store == "cube":
+            out.append(
+                Target(
+                    name=f"extract/{variable}/{year}",
+                    fun=partial(
+                        _extract_and_write_cube,
+                        variable=variable,
+                        year=year,
+                        months=cnfg.months,
+                        inputdir=cnfg.inputdir,
+                        outputdir=cnfg.outputdir,
+                    ),
+                    inputs=sorted(set(raws.values())),
+                    outputs=cube.files(
+                        datadir=cnfg.outputdir, variable=variable, year=year
+                    ),
+                    params={**params, "months": cnfg.months},
                 )
+            )
+            continue
+
+        for month in cnfg.months:
+            out.append(
+                Target(
+                    name=f"extract/{variable}/{year}/{month}",
+                    fun=partial(
+                        _extract_and_write_values,
+                        month=month,
+                        variable=variable,
+                        inputdir=cnfg.inputdir,
+                        outputdir=cnfg.outputdir,
+                        year=year,
+                        chunksize=cnfg.chunksize,
+                    ),
+                    inputs=[raws[month]],
+                    outputs=[
+                        cnfg.outputdir / f"extracted_{variable}_{year}-{month}.pq"
+                    ],
+                    params=params,
+                )
+            )
+    return out
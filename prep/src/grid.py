@@ -0,0 +1,59 @@
+"""
+Canonical 0.25° lon-lat grid
+
+Every grid point has an integer cell id, so tables of different sources
+can be aligned and looked up by array offsets instead of float lon/lat.
+Cell ids run along longitudes first, then latitudes.
+"""
+
+import numpy as np
+
+RES = 0.25
+
+# grid indexes (coordinate / RES) of first and last grid point
+LON_Q = (-720, 720)  # -180° to 180°
+LAT_Q = (-280, 280)  # -70° to 70°
+
+NLONS = LON_Q[1] - LON_Q[0] + 1
+NLATS = LAT_Q[1] - LAT_Q[0] + 1
+NCELLS = NLONS * NLATS
+
+
+def cell_ids(lons: np.ndarray, lats: np.ndarray) -> np.ndarray:
+    """
+    Get cell ids of coordinates (snapped to the nearest grid point).
+    Coordinates outside of the grid get -1.
+    """
+    lon_q = np.rint(np.asarray(lons) / RES).astype(np.int32)
+    lat_q = np.rint(np.asarray(lats) / RES).astype(np.int32)
+    return grid_cell_ids(lon_q=lon_q, lat_q=lat_q)
+
+
+def grid_cell_ids(lon_q: np.ndarray, lat_q: np.ndarray) -> np.ndarray:
+    """Get cell ids of grid indexes (coordinate / RES), -1 outside of the grid"""
+    lon_i = np.asarray(lon_q, dtype=np.int32) - LON_Q[0]
+    lat_i = np.asarray(lat_q, dtype=np.int32) - LAT_Q[0]
+    inside = (lon_i >= 0) & (lon_i < NLONS) & (lat_i >= 0) & (lat_i < NLATS)
+    return np.where(inside, lat_i * NLONS + lon_i, -1).astype(np.int32)
+
+
+def grid_indexes(cells: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Get lon and lat grid indexes (coordinate / RES) of cell ids"""
+    lat_i, lon_i = np.divmod(np.asarray(cells, dtype=np.int32), NLONS)
+    return (lon_i + LON_Q[0]).astype(np.int16), (lat_i + LAT_Q[0]).astype(np.int16)
+
+
+def coords(cells: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Get lon and lat in degrees of cell ids"""
+    lon_q, lat_q = grid_indexes(cells)
+    return lon_q * RES, lat_q * RES
+
+
+def lat_bands(degrees: float) -> list[tuple[int, int]]:
+    """
+    Split grid into latitude bands of this many degrees.
+    Bands are half open ranges of lat grid indexes, south to north.
+    """
+    step = max(round(degrees / RES), 1)
+    starts = range(LAT_Q[0], LAT_Q[1] + 1, step)
+    return [(d, min(d + step, LAT_Q[1] + 1)) for d in starts]
@@ -0,0 +1,36 @@
+"""
+Manifest of uploaded tiles
+
+For each label and month a manifest maps the key of each uploaded tile
+to the content hash and size of its record. It is stored next to the
+tiles. Uploads skip records that did not change since the last upload,
+and checks read the manifests instead of listing all objects.
+
+    {version}/{label}/{month}/manifest.json
+"""
+
+import json
+import hashlib
+from . import s3
+
+
+def key(version: str, label: str, month: int) -> str:
+    return f"{version}/{label}/{month}/manifest.json"
+
+
+def entry(body: bytes) -> list:
+    """Manifest entry (content hash, size) of record"""
+    return [hashlib.blake2b(body, digest_size=16).hexdigest(), len(body)]
+
+
+def read(version: str, label: str, month: int) -> dict[str, list]:
+    """Read manifest of label and month, empty if there is none"""
+    body = s3.get_bytes(key=key(version=version, label=label, month=month))
+    if body is None:
+        return {}
+    return json.loads(body)
+
+
+def write(version: str, label: str, month: int, entries: dict[str, list]):
+    body = json.dumps(entries, sort_keys=True).encode()
+    s3.put_bytes(key=key(version=version, label=label, month=month), body=body)
@@ -1,70 +1,148 @@
 """Functions for ORAS5 reanalysis"""
 
+from typing import Iterator
 from pathlib import Path
+from functools import partial
+from itertools import product
 import numpy as np
 import pandas as pd
-import cdsapi
 from netCDF4 import Dataset  # pylint: disable=no-name-in-module
 from . import pq
-from .util import get_tar_members, extract_tar_member
-from .config import Config
+from . import download
+from . import cube
+from . import grid
+from .build import Target
+from .util import iter_archive_members
+from .config import Config, CHUNKSIZE, LAT_BAND
 
 # available in ORAS5
 VARS = ["rotated_zonal_velocity", "rotated_meridional_velocity"]
 
 
+def _snap(
+    coords: np.ndarray, interval: tuple[float, float], res: float
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Snap coordinates to the nearest target in interval with steps of res.
+    Bins are half open [target - res/2; target + res/2).
+    Returns snapped coordinates and mask of coordinates inside any bin.
+    """
+    steps = np.floor((coords - interval[0]) / res + 0.5)
+    nsteps = round((interval[1] - interval[0]) / res)
+    inside = (steps >= 0) & (steps <= nsteps)
+    return interval[0] + steps * res, inside
+
+
 def _digitize(df: pd.DataFrame, var: str, interval: tuple[float, float], res: float):
-    for target in np.arange(interval[0], interval[1] + res, res):
-        mask = (df[var] >= target - res / 2) & (df[var] < target + res / 2)
-        df.loc[mask, var] = target
+    coords = df[var].to_numpy()
+    snapped, inside = _snap(coords=coords, interval=interval, res=res)
+    df[var] = np.where(inside, snapped, coords)
+
+
+def _regrid(
+    lons: np.ndarray,
+    lats: np.ndarray,
+    values: np.ndarray,
+    lon_range: tuple[int, int],
+    lat_range: tuple[int, int],
+    res: float,
+) -> pd.DataFrame:
+    """
+    Snap points to grid and average their values (n points, k layers) per cell
+    with a scatter-add over cell ids. Like groupby-mean NaNs are ignored and
+    cells with only NaNs get NaN. Points outside lon/lat range are dropped.
+    """
+    lons, lon_inside = _snap(coords=lons, interval=lon_range, res=res)
+    lats, lat_inside = _snap(coords=lats, interval=lat_range, res=res)
+    mask = lon_inside & lat_inside
+    cells = grid.cell_ids(lons=lons[mask], lats=lats[mask])
+    assert (cells >= 0).all(), "coordinates outside of grid"
+    values = values[mask]
+
+    present = np.bincount(cells, minlength=grid.NCELLS) > 0
+    means = {}
+    for layer_i in range(values.shape[1]):
+        vals = values[:, layer_i]
+        ok = ~np.isnan(vals)
+        sums = np.bincount(cells[ok], weights=vals[ok], minlength=grid.NCELLS)
+        counts = np.bincount(cells[ok], minlength=grid.NCELLS)
+        sums, counts = sums[present], counts[present]
+        means[f"l{layer_i}"] = np.divide(
+            sums, counts, out=np.full(len(sums), np.nan), where=counts > 0
+        )
+    index = pd.Index(np.flatnonzero(present).astype(np.int32), name=pq.INDEX)
+    return pd.DataFrame(means, index=index)
 
 
-def _download_dataset(outputdir: Path, variable: str, year: int, months: list[int]):
-    outfile = outputdir / f"raw_{variable}_{year}.tar.gz"
-    client = cdsapi.Client()
-    client.retrieve(
-        "reanalysis-oras5",
-        {
+def raw_file(inputdir: Path, variable: str, year: int, month: int) -> Path:
+    """Downloaded part of month, or archive of whole year downloaded before"""
+    part = inputdir / f"raw_{variable}_{year}-{month}.tar.gz"
+    return part if part.is_file() else inputdir / f"raw_{variable}_{year}.tar.gz"
+
+
+def _download_part(
+    outputdir: Path, variable: str, year: int, month: int
+) -> download.Part:
+    return download.Part(
+        dataset="reanalysis-oras5",
+        request={
             "product_type": ["operational"],
             # "format": "tgz",  # not available anymore?
             "vertical_resolution": "all_levels",
             "variable": [variable],
             "year": [str(year)],
-            "month": [f"{d:02d}" for d in months],
+            "month": [f"{month:02d}"],
         },
-        str(outfile),
+        file=outputdir / f"raw_{variable}_{year}-{month}.tar.gz",
     )
 
 
-def _get_members_by_month(
+def _member_month(member: str, year: int) -> int | None:
+    """Get month of a NetCDF archive member, None if not a NetCDF file"""
+    if not member.endswith(".nc"):
+        return None
+    timestr = member.split("control_monthly_highres_3D_")[1].split("_")[0]
+    assert year == int(timestr[:4]), member
+    return int(timestr[4:])
+
+
+def _is_member_of(member: str, year: int, months: set[int]) -> bool:
+    return _member_month(member, year=year) in months
+
+
+def _iter_members_by_month(
     inputdir: Path, variable: str, year: int, req_months: list[int]
-) -> dict[int, str]:
-    archive = inputdir / f"raw_{variable}_{year}.tar.gz"
-    out = {}
+) -> Iterator[tuple[int, bytes]]:
+    """
+    Read each archive (monthly part or whole year) once
+    and yield content of each requested month's member
+    """
+    archives: dict[Path, set[int]] = {}
+    for month in req_months:
+        archive = raw_file(inputdir=inputdir, variable=variable, year=year, month=month)
+        archives.setdefault(archive, set()).add(month)
+
     extng_months = set()
-    for member in get_tar_members(archive):
-        if member.endswith(".nc"):
-            timestr = member.split("control_monthly_highres_3D_")[1].split("_")[0]
-            assert year == int(timestr[:4]), member
-            month = int(timestr[4:])
-            if month in req_months:
-                extng_months.add(month)
-                out[month] = member
+    for archive, months in archives.items():
+        for member, content in iter_archive_members(
+            archive=archive, select=partial(_is_member_of, year=year, months=months)
+        ):
+            member_month = _member_month(member, year=year)
+            assert member_month is not None
+            extng_months.add(member_month)
+            yield member_month, content
     assert extng_months == set(req_months), extng_months
-    return out
 
 
 def _rm_mask(masked: np.ma.MaskedArray, fill=np.nan) -> np.ndarray:
     return np.where(masked.mask, fill, masked.data).astype(masked.dtype)
 
 
-def _extract_and_write_values(
+def _extract_values(
     month: int,
-    member: str,
+    content: bytes,
     variable: str,
     year: int,
-    inputdir: Path,
-    outputdir: Path,
     resolution: float,
     lon_range: tuple[int, int],
     lat_range: tuple[int, int],
@@ -73,14 +151,9 @@ def _extract_and_write_values(
     lon_name="nav_lon",
     depth_name="deptht",
     velo_names=("vozocrte", "vomecrtn"),
-):
+) -> pd.DataFrame:
     print(f"Processing {variable} {year}-{month}...")
-    infile = inputdir / f"raw_{variable}_{year}.tar.gz"
-    outfile = outputdir / f"extracted_{variable}_{year}-{month}.pq"
-    tmpfile = outputdir / f"{variable}_{year}_{month}.nc"
-    extract_tar_member(archive=infile, name=member, outfile=tmpfile)
-
-    ds = Dataset(tmpfile, "r", format="NETCDF4")
+    ds = Dataset(f"{variable}_{year}_{month}.nc", "r", memory=content)
     varnames = set(ds.variables.keys())
     assert {lat_name, lon_name, depth_name} <= varnames, varnames
     intersect = list(set(velo_names) & varnames)
@@ -90,64 +163,155 @@ def _extract_and_write_values(
     depths = _rm_mask(ds.variables[depth_name][:])  # (75,) depth in m
     lats = _rm_mask(ds.variables[lat_name][:])  # (1021, 1442) lat in degrees
     lons = _rm_mask(ds.variables[lon_name][:])  # (1021, 1442) lon in degrees
-    vals = _rm_mask(ds.variables[velo_name][:])  # (1, 74, 1021, 1442) in m/s
-    vals = vals[0, depths < max_depth]
 
-    dfdict = {
-        "lat": lats.flatten().tolist(),
-        "lon": lons.flatten().tolist(),
-    }
-    for layer_i in range(vals.shape[0]):
-        dfdict[f"l{layer_i}"] = vals[layer_i].flatten().tolist()
+    # only read bounding window of rows/columns and depth levels needed
+    # from velocities (1, 75, 1021, 1442) in m/s
+    lat_mask = (lats >= min(lat_range)) & (lats <= max(lat_range))
+    lon_mask = (lons >= min(lon_range)) & (lons <= max(lon_range))
+    inside = lat_mask & lon_mask
+    rows = np.flatnonzero(inside.any(axis=1))
+    cols = np.flatnonzero(inside.any(axis=0))
+    levels = np.flatnonzero(depths < max_depth)
+    assert len(rows) > 0 and len(cols) > 0 and len(levels) > 0, "nothing to extract"
+    ys = slice(rows[0], rows[-1] + 1)
+    xs = slice(cols[0], cols[-1] + 1)
+    zs = slice(levels[0], levels[-1] + 1)
+    vals = _rm_mask(ds.variables[velo_name][0, zs, ys, xs])
+    vals = vals[depths[zs] < max_depth]
+    ds.close()
 
-    # resolution is undefined, can have duplicated lon-lat rows
+    # resolution is undefined, can have multiple points per cell
     # after normalizing grid to 0.25° resolution
-    df = pd.DataFrame(dfdict)
-    lat_mask = (df["lat"] >= min(lat_range)) & (df["lat"] <= max(lat_range))
-    lon_mask = (df["lon"] >= min(lon_range)) & (df["lon"] <= max(lon_range))
-    df = df.loc[lat_mask & lon_mask]
-    _digitize(df=df, var="lon", interval=lon_range, res=resolution)
-    _digitize(df=df, var="lat", interval=lat_range, res=resolution)
-    df = df.groupby(["lon", "lat"]).mean()
-    df.sort_index(inplace=True)
-    pq.write_table(df=df, file=outfile)
-    tmpfile.unlink(missing_ok=True)
-
-
-def download(cnfg: Config):
+    mask = inside[ys, xs].flatten()
+    df = _regrid(
+        lons=lons[ys, xs].flatten()[mask],
+        lats=lats[ys, xs].flatten()[mask],
+        values=vals.reshape(vals.shape[0], -1).T[mask],
+        lon_range=lon_range,
+        lat_range=lat_range,
+        res=resolution,
+    )
+    return df
+
+
+def _extract_and_write_values(
+    month: int,
+    outputdir: Path,
+    variable: str,
+    year: int,
+    chunksize=CHUNKSIZE,
+    **kwargs,
+) -> int:
+    outfile = outputdir / f"extracted_{variable}_{year}-{month}.pq"
+    df = _extract_values(month=month, variable=variable, year=year, **kwargs)
+    bands = grid.lat_bands(LAT_BAND)
+    pq.write_table(df=df, file=outfile, row_group_size=chunksize, bands=bands)
+    return len(df)
+
+
+def read_month(
+    variable: str, year: int, month: int, inputdir: Path, **kwargs
+) -> pd.DataFrame:
+    """
+    Extract values of a month from its archive member without writing them
+    (kwargs are passed on to extraction, e.g. resolution and ranges)
+    """
+    members = _iter_members_by_month(
+        inputdir=inputdir, variable=variable, year=year, req_months=[month]
+    )
+    ((_, content),) = members
+    return _extract_values(
+        month=month, content=content, variable=variable, year=year, **kwargs
+    )
+
+
+def download_parts(cnfg: Config) -> list[download.Part]:
+    """Parts to download, one per variable, year and month"""
     variables = [d for d in cnfg.download_variables if d in VARS]
-    for year in cnfg.years:
-        for variable in variables:
-            print(f"Downloading {variable} {year}...")
-            _download_dataset(
-                outputdir=cnfg.outputdir,
-                variable=variable,
-                year=year,
-                months=cnfg.months,
-            )
+    return [
+        _download_part(
+            outputdir=cnfg.outputdir, variable=variable, year=year, month=month
+        )
+        for year, variable, month in product(cnfg.years, variables, cnfg.months)
+    ]
+
+
+def _extract_and_write_year(
+    variable: str,
+    year: int,
+    months: list[int],
+    inputdir: Path,
+    outputdir: Path,
+    store: str,
+    chunksize: int,
+    **kwargs,
+) -> int:
+    """Extract all months of a year reading its archive once, returns cells"""
+    print(f"Extracting {variable} {year}...")
+    members = _iter_members_by_month(
+        inputdir=inputdir, variable=variable, year=year, req_months=months
+    )
+    kwargs = {"year": year, "variable": variable, **kwargs}
 
+    if store == "cube":
+        dfs = ((d, _extract_values(month=d, content=c, **kwargs)) for d, c in members)
+        cube.write(outputdir=outputdir, variable=variable, year=year, months=dfs)
+        return len(cube.read_cells(datadir=outputdir, variable=variable, year=year))
 
-def extract(cnfg: Config):
+    nrows = 0
+    for month, content in members:
+        nrows += _extract_and_write_values(
+            month=month,
+            content=content,
+            outputdir=outputdir,
+            chunksize=chunksize,
+            **kwargs,
+        )
+    return nrows
+
+
+def targets(cnfg: Config) -> list[Target]:
+    """Build targets extracting values from raw archives"""
     variables = [d for d in cnfg.download_variables if d in VARS]
-    for year in cnfg.years:
-        for variable in variables:
-            print(f"Extracting {variable} {year}...")
-            member_map = _get_members_by_month(
-                inputdir=cnfg.inputdir,
-                variable=variable,
-                year=year,
-                req_months=cnfg.months,
+    out: list[Target] = []
+    if cnfg.store == "stream":
+        return out  # raw archives are aggregated directly
+    for year, variable in product(cnfg.years, variables):
+        if cnfg.store == "cube":
+            outputs = list(
+                cube.files(datadir=cnfg.outputdir, variable=variable, year=year)
             )
-
-            for month, member in member_map.items():
-                _extract_and_write_values(
-                    month=month,
-                    member=member,
+        else:
+            outputs = [
+                cnfg.outputdir / f"extracted_{variable}_{year}-{d}.pq"
+                for d in cnfg.months
+            ]
+        raws = {
+            raw_file(inputdir=cnfg.inputdir, variable=variable, year=year, month=d)
+            for d in cnfg.months
+        }
+        params = {
+            "months": cnfg.months,
+            "store": cnfg.store,
+            "chunksize": cnfg.chunksize,
+            "resolution": cnfg.resolution,
+            "lat_range": cnfg.lat_range,
+            "lon_range": cnfg.lon_range,
+        }
+        out.append(
+            Target(
+                name=f"extract/{variable}/{year}",
+                fun=partial(
+                    _extract_and_write_year,
+                    variable=variable,
+                    year=year,
                     inputdir=cnfg.inputdir,
                     outputdir=cnfg.outputdir,
-                    year=year,
-                    variable=variable,
-                    resolution=cnfg.resolution,
-                    lat_range=cnfg.lat_range,
-                    lon_range=cnfg.lon_range,
-                )
+                    **params,
+                ),
+                inputs=sorted(raws),
+                outputs=outputs,
+                params=params,
+            )
+        )
+    return out
@@ -1,18 +1,226 @@
+from typing import Iterable, Iterator
 from pathlib import Path
+import numpy as np
 import pandas as pd
 import pyarrow as pa
+import pyarrow.dataset as pa_ds
 from pyarrow import parquet
+from . import grid
 
+# tables are indexed by grid cell id, which is stored
+# as int16 lon/lat grid indexes (coordinate / grid.RES)
+INDEX = "cell"
+COORDS = ["lon", "lat"]
+_SCHEMA_KEY = b"prevwinds"
+_SCHEMA_VERSION = b"1"
 
-# TODO: downcast floats and ints to reduce size of files
-#       also when reading table, will help with keeping memory low
-def write_table(df: pd.DataFrame, file: str | Path):
-    """Write DataFrame to parquet file"""
-    parquet.write_table(pa.Table.from_pandas(df), file)
 
+def _count_type(arr: np.ndarray) -> np.dtype:
+    if arr.size == 0 or arr.max() < 2**16:
+        return np.dtype(np.uint16)
+    if arr.max() < 2**32:
+        return np.dtype(np.uint32)
+    return np.dtype(np.uint64)
 
-def read_table(file: str | Path) -> pd.DataFrame:
-    """Read DataFrame from parquet file"""
-    df = parquet.read_table(file).to_pandas()
-    df.columns = [str(d) for d in df.columns]  # forgot why I need this
-    return df
+
+def _to_arrow(df: pd.DataFrame, float_dtype=np.float32) -> pa.Table:
+    """
+    Convert DataFrame with cell index to compact arrow table:
+    values to float32 (or float_dtype), counts to uint16/uint32,
+    cells to int16 grid indexes.
+    """
+    assert df.index.name == INDEX, df.index.name
+    cols = {}
+    cols["lon"], cols["lat"] = grid.grid_indexes(df.index.to_numpy())
+
+    values = df.to_numpy()
+    if np.issubdtype(values.dtype, np.integer):
+        assert values.size == 0 or values.min() >= 0, "counts must be positive"
+        values = values.astype(_count_type(values))
+    else:
+        values = values.astype(float_dtype)
+    for ci, col in enumerate(df.columns):
+        cols[str(col)] = values[:, ci]
+
+    table = pa.table(cols)
+    return table.replace_schema_metadata({_SCHEMA_KEY: _SCHEMA_VERSION})
+
+
+def _to_pandas(table: pa.Table) -> pd.DataFrame:
+    """Convert arrow table to DataFrame with cell index keeping compact dtypes"""
+    metadata = table.schema.metadata or {}
+    if _SCHEMA_KEY not in metadata:
+        # written before compact schema, lon/lat index is in pandas metadata
+        df = table.to_pandas()
+        df.columns = [str(d) for d in df.columns]  # forgot why I need this
+        lons = df.index.get_level_values("lon").to_numpy()
+        lats = df.index.get_level_values("lat").to_numpy()
+        df.index = pd.Index(grid.cell_ids(lons=lons, lats=lats), name=INDEX)
+        return df
+
+    cells = grid.grid_cell_ids(
+        lon_q=table.column("lon").to_numpy(), lat_q=table.column("lat").to_numpy()
+    )
+    index = pd.Index(cells, name=INDEX)
+    values = table.drop_columns(COORDS)
+    return pd.DataFrame(
+        {d: values.column(d).to_numpy() for d in values.column_names}, index=index
+    )
+
+
+def _encodings(table: pa.Table) -> dict:
+    """Per column encoding and compression for parquet writer"""
+    dictionary = []
+    byte_stream_split = {}
+    compression = {}
+    for field in table.schema:
+        compression[field.name] = "zstd"
+        if pa.types.is_floating(field.type):
+            # floats barely repeat, byte stream split makes them compress better
+            byte_stream_split[field.name] = "BYTE_STREAM_SPLIT"
+        else:
+            # grid indexes and counts repeat a lot
+            dictionary.append(field.name)
+    return {
+        "use_dictionary": dictionary,
+        "column_encoding": byte_stream_split,
+        "compression": compression,
+    }
+
+
+def _lat_filter(lat_range: tuple[int, int]) -> pa_ds.Expression:
+    return (pa_ds.field("lat") >= lat_range[0]) & (pa_ds.field("lat") < lat_range[1])
+
+
+def _in_lat_range(df: pd.DataFrame, lat_range: tuple[int, int]) -> pd.DataFrame:
+    _, lat_q = grid.grid_indexes(df.index.to_numpy())
+    return df[(lat_q >= lat_range[0]) & (lat_q < lat_range[1])]
+
+
+def split_lat_bands(
+    df: pd.DataFrame, bands: list[tuple[int, int]]
+) -> list[pd.DataFrame]:
+    """Split DataFrame with cell index into latitude bands (skipping empty ones)"""
+    dfs = [_in_lat_range(df, lat_range=d) for d in bands]
+    return [d for d in dfs if len(d) > 0] or [df]
+
+
+def write_tables(
+    dfs: Iterable[pd.DataFrame],
+    file: str | Path,
+    row_group_size: int | None = None,
+    float_dtype=np.float32,
+) -> int:
+    """
+    Write DataFrames one after another to the same parquet file, each in its
+    own row groups (optionally of at most this size). Only one DataFrame
+    is held in memory at a time. Types of the first DataFrame are used for
+    all (e.g. counts), a value which does not fit raises.
+    Returns number of rows written.
+    """
+    writer = None
+    nrows = 0
+    try:
+        for df in dfs:
+            table = _to_arrow(df, float_dtype=float_dtype)
+            if writer is None:
+                writer = parquet.ParquetWriter(file, table.schema, **_encodings(table))
+            else:
+                table = table.cast(writer.schema)
+            writer.write_table(table, row_group_size=row_group_size)
+            nrows += len(df)
+    finally:
+        if writer is not None:
+            writer.close()
+    assert writer is not None, "nothing to write"
+    return nrows
+
+
+def write_table(
+    df: pd.DataFrame,
+    file: str | Path,
+    row_group_size: int | None = None,
+    float_dtype=np.float32,
+    bands: list[tuple[int, int]] | None = None,
+):
+    """
+    Write DataFrame to parquet file (optionally in row groups of this size).
+    Floats are stored as float32 unless float_dtype is given.
+    With bands (latitude grid index ranges, see grid.lat_bands) row groups
+    are split at band borders, so bands can be read without reading others.
+    """
+    dfs = [df] if bands is None else split_lat_bands(df, bands=bands)
+    write_tables(dfs, file=file, row_group_size=row_group_size, float_dtype=float_dtype)
+
+
+def read_table(
+    file: str | Path, lat_range: tuple[int, int] | None = None
+) -> pd.DataFrame:
+    """
+    Read DataFrame from parquet file, optionally only rows with
+    latitude grid indexes in lat_range (half open). Only row groups
+    which can contain such rows are read.
+    """
+    if lat_range is None:
+        return _to_pandas(parquet.read_table(file))
+    fh = parquet.ParquetFile(file)
+    if _SCHEMA_KEY not in (fh.schema_arrow.metadata or {}):
+        return _in_lat_range(_to_pandas(fh.read()), lat_range=lat_range)
+    return _to_pandas(parquet.read_table(file, filters=_lat_filter(lat_range)))
+
+
+def in_bands(file: str | Path, bands: list[tuple[int, int]]) -> bool:
+    """
+    Whether each row group of file only has rows of one latitude band
+    (according to row group statistics), so bands can be read separately
+    without reading row groups several times
+    """
+    fh = parquet.ParquetFile(file)
+    if _SCHEMA_KEY not in (fh.schema_arrow.metadata or {}):
+        return False
+    col = fh.schema_arrow.get_field_index("lat")
+    starts = [d[0] for d in bands]
+    for rgi in range(fh.num_row_groups):
+        stats = fh.metadata.row_group(rgi).column(col).statistics
+        if stats is None or not stats.has_min_max:
+            return False
+        first = np.searchsorted(starts, stats.min, side="right")
+        if first != np.searchsorted(starts, stats.max, side="right"):
+            return False
+    return True
+
+
+def read_index(file: str | Path) -> pd.Index:
+    """Read only the DataFrame index from parquet file"""
+    table = parquet.read_table(file, columns=COORDS)
+    if _SCHEMA_KEY not in (table.schema.metadata or {}):
+        table = parquet.read_pandas(file, columns=[])
+    return _to_pandas(table).index
+
+
+def iter_tables(
+    file: str | Path, chunksize: int, lat_range: tuple[int, int] | None = None
+) -> Iterator[pd.DataFrame]:
+    """
+    Read DataFrame from parquet file in chunks of up to chunksize rows,
+    optionally only rows with latitude grid indexes in lat_range (like read_table)
+    """
+    fh = parquet.ParquetFile(file)
+    metadata = fh.schema_arrow.metadata
+    if lat_range is not None and _SCHEMA_KEY not in (metadata or {}):
+        for df in iter_tables(file, chunksize=chunksize):
+            yield _in_lat_range(df, lat_range=lat_range)
+        return
+
+    if lat_range is None:
+        batches = fh.iter_batches(batch_size=chunksize)
+    else:
+        dataset = pa_ds.dataset(file, format="parquet")
+        batches = dataset.to_batches(
+            filter=_lat_filter(lat_range), batch_size=chunksize
+        )
+    for batch in batches:
+        if batch.num_rows == 0:
+            continue
+        table = pa.Table.from_batches([batch]).replace_schema_metadata(metadata)
+        yield _to_pandas(table)
@@ -0,0 +1,185 @@
+"""
+Profiling of build targets
+
+Each built target is a job. While a job runs, its process records
+wall time, CPU time (including child processes), peak RSS, and bytes
+read and written (all I/O of the process, from /proc on Linux). Jobs
+can return how many rows they processed. Sizes of input and output
+files are added afterwards. Peak RSS is reset before each job on Linux,
+so jobs sharing a worker process are measured separately.
+
+Optionally a sampling thread records the stacks of all threads every
+few milliseconds. Stacks of the slowest jobs are written as collapsed
+stacks (one "frame;frame;frame count" per line, for flamegraph tools).
+"""
+
+from typing import Callable
+from collections import Counter
+from functools import partial
+from pathlib import Path
+import csv
+import json
+import resource
+import sys
+import threading
+import time
+
+FIELDS = [
+    "name",
+    "stage",
+    "wall_s",
+    "cpu_s",
+    "peak_rss_bytes",
+    "read_bytes",
+    "write_bytes",
+    "input_bytes",
+    "output_bytes",
+    "rows",
+]
+
+
+def _reset_peak_rss():
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="utf-8") as fh:
+            fh.write("5")
+    except OSError:
+        pass
+
+
+def _peak_rss() -> int:
+    try:
+        with open("/proc/self/status", encoding="utf-8") as fh:
+            for line in fh:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def _io() -> tuple[int, int] | None:
+    """Bytes read and written by this process so far"""
+    try:
+        with open("/proc/self/io", encoding="utf-8") as fh:
+            counters = dict(d.split(": ") for d in fh.read().splitlines())
+    except OSError:
+        return None
+    return int(counters["rchar"]), int(counters["wchar"])
+
+
+def _cpu() -> float:
+    usages = [resource.getrusage(resource.RUSAGE_SELF)]
+    usages.append(resource.getrusage(resource.RUSAGE_CHILDREN))
+    return sum(d.ru_utime + d.ru_stime for d in usages)
+
+
+class _Sampler(threading.Thread):
+    """Count collapsed stacks of all other threads every interval seconds"""
+
+    def __init__(self, interval: float):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._halt = threading.Event()
+
+    def run(self):
+        while not self._halt.wait(self.interval):
+            names = {d.ident: d.name for d in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == self.ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{Path(code.co_filename).stem}.{code.co_name}")
+                    frame = frame.f_back
+                stack.append(names.get(ident, "thread"))
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._halt.set()
+        self.join()
+
+
+def measure(fun: Callable[[], object], interval: float | None = None) -> dict:
+    """
+    Run fun and measure it in the process running it.
+    With interval stacks are sampled every interval seconds.
+    """
+    sampler = None if interval is None else _Sampler(interval=interval)
+    _reset_peak_rss()
+    io0, cpu0, t0 = _io(), _cpu(), time.perf_counter()
+    if sampler is not None:
+        sampler.start()
+    try:
+        rows = fun()
+    finally:
+        if sampler is not None:
+            sampler.stop()
+    wall, cpu, io1 = time.perf_counter() - t0, _cpu() - cpu0, _io()
+    return {
+        "wall_s": round(wall, 3),
+        "cpu_s": round(cpu, 3),
+        "peak_rss_bytes": _peak_rss(),
+        "read_bytes": None if io0 is None or io1 is None else io1[0] - io0[0],
+        "write_bytes": None if io0 is None or io1 is None else io1[1] - io0[1],
+        "rows": rows if isinstance(rows, int) else None,
+        "stacks": None if sampler is None else dict(sampler.stacks),
+    }
+
+
+def _nbytes(files: list[Path]) -> int:
+    return sum(d.stat().st_size for d in files if d.is_file())
+
+
+class Profiler:
+    """
+    Collect measurements of jobs and write them to file
+    (CSV if it ends with .csv, otherwise JSON). Stacks of the nstacks
+    slowest jobs are sampled every interval seconds and written next to it.
+    """
+
+    def __init__(self, file: Path, nstacks=0, interval=0.01):
+        self.file = file
+        self.nstacks = nstacks
+        self.interval = interval
+        self.records: list[dict] = []
+
+    def wrap(self, fun: Callable[[], object]) -> Callable[[], dict]:
+        """Function measuring fun when called (picklable if fun is)"""
+        interval = self.interval if self.nstacks > 0 else None
+        return partial(measure, fun=fun, interval=interval)
+
+    def add(self, name: str, inputs: list[Path], outputs: list[Path], result: dict):
+        """Add measurement of job name"""
+        record = {
+            "name": name,
+            "stage": name.split("/")[0],
+            "input_bytes": _nbytes(inputs),
+            "output_bytes": _nbytes(outputs),
+            **result,
+        }
+        self.records.append(record)
+
+    def write(self):
+        """Write measurements (slowest first) and stacks of the slowest jobs"""
+        records = sorted(self.records, key=lambda d: -d["wall_s"])
+        self.file.parent.mkdir(parents=True, exist_ok=True)
+        if self.file.suffix == ".csv":
+            with open(self.file, "w", newline="", encoding="utf-8") as fh:
+                writer = csv.DictWriter(fh, fieldnames=FIELDS, extrasaction="ignore")
+                writer.writeheader()
+                writer.writerows(records)
+        else:
+            with open(self.file, "w", encoding="utf-8") as fh:
+                json.dump([{k: d[k] for k in FIELDS} for d in records], fh, indent=1)
+
+        stacksdir = self.file.parent / f"{self.file.stem}_stacks"
+        for record in records[: self.nstacks]:
+            stacksdir.mkdir(exist_ok=True)
+            stacksfile = stacksdir / f"{record['name'].replace('/', '_')}.txt"
+            with open(stacksfile, "w", encoding="utf-8") as fh:
+                for stack, count in sorted(record["stacks"].items()):
+                    fh.write(f"{stack} {count}\n")
+        print(f"Profile of {len(records):,} jobs written to {self.file}")
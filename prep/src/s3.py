@@ -17,10 +17,22 @@ def get_obj(key: str) -> Any:
     return pickle.loads(res["Body"].read())
 
 
+def get_bytes(key: str) -> bytes | None:
+    """Get body of object, None if there is no such key"""
+    try:
+        res = _CLIENT.get_object(Bucket=_CONTENT_BUCKET_NAME, Key=key)
+    except _CLIENT.exceptions.NoSuchKey:
+        return None
+    assert res["ResponseMetadata"]["HTTPStatusCode"] == 200
+    return res["Body"].read()
+
+
 def put_obj(key: str, obj: Any):
-    res = _CLIENT.put_object(
-        Bucket=_CONTENT_BUCKET_NAME, Key=key, Body=pickle.dumps(obj)
-    )
+    put_bytes(key=key, body=pickle.dumps(obj))
+
+
+def put_bytes(key: str, body: bytes):
+    res = _CLIENT.put_object(Bucket=_CONTENT_BUCKET_NAME, Key=key, Body=body)
     assert res["ResponseMetadata"]["HTTPStatusCode"] == 200
 
 
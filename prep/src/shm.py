@@ -0,0 +1,134 @@
+"""
+Shared memory arrays for processing slices of cells in several processes
+
+Large inputs (e.g. u/v of all cells and timesteps of a month) and outputs
+(e.g. count matrices) are put into multiprocessing.shared_memory blocks.
+Workers are a pool of processes which is started once and can be reused
+for many sets of arrays (e.g. one per latitude band). Each task processes
+a slice of rows (cells) and writes its slice of the outputs in place.
+Only block names and slice bounds are sent to workers, arrays are never
+pickled. Workers keep blocks attached until a task with other blocks comes.
+
+    with Workers(nproc=4) as workers:
+        for u in bands:
+            with SharedArrays() as arrays:
+                arrays.put("u", u)
+                arrays.zeros("C", shape=(len(u), 10), dtype=np.uint32)
+                arrays.map_rows(fun, nrows=len(u), workers=workers, chunksize=10_000)
+                C = arrays["C"].copy()
+
+fun(arrays, rows) gets a dict of all arrays and a slice of rows,
+it must be picklable (e.g. a module level function or partial of one).
+"""
+
+from typing import Callable
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+import math
+import numpy as np
+
+# blocks attached in a worker process by block name
+_BLOCKS: dict[str, SharedMemory] = {}
+
+Spec = tuple[str, tuple[int, ...], str]  # block name, shape, dtype
+
+
+def _attach(specs: dict[str, Spec]) -> dict[str, np.ndarray]:
+    """Attach blocks of specs (once), close blocks of earlier arrays"""
+    names = {d[0] for d in specs.values()}
+    for name in [d for d in _BLOCKS if d not in names]:
+        _BLOCKS.pop(name).close()
+    arrays = {}
+    for key, (name, shape, dtype) in specs.items():
+        if name not in _BLOCKS:
+            _BLOCKS[name] = SharedMemory(name=name)
+        arrays[key] = np.ndarray(shape, dtype=dtype, buffer=_BLOCKS[name].buf)
+    return arrays
+
+
+def _run(
+    fun: Callable[[dict[str, np.ndarray], slice], object],
+    specs: dict[str, Spec],
+    start: int,
+    stop: int,
+):
+    fun(_attach(specs), slice(start, stop))
+
+
+class Workers:
+    """Pool of nproc worker processes, shut down when leaving the context"""
+
+    def __init__(self, nproc: int):
+        self.nproc = nproc
+        self.executor = ProcessPoolExecutor(max_workers=nproc)
+
+    def __enter__(self) -> "Workers":
+        return self
+
+    def __exit__(self, *_):
+        self.executor.shutdown()
+
+
+class SharedArrays:
+    """Named arrays in shared memory blocks, freed when leaving the context"""
+
+    def __init__(self):
+        self._blocks: dict[str, SharedMemory] = {}
+        self._arrays: dict[str, np.ndarray] = {}
+
+    def __enter__(self) -> "SharedArrays":
+        return self
+
+    def __exit__(self, *_):
+        self._arrays.clear()  # views must be gone before closing
+        for block in self._blocks.values():
+            block.close()
+            block.unlink()
+        self._blocks.clear()
+
+    def __getitem__(self, key: str) -> np.ndarray:
+        return self._arrays[key]
+
+    def empty(self, key: str, shape: tuple[int, ...], dtype) -> np.ndarray:
+        """Uninitialized shared array"""
+        dtype = np.dtype(dtype)
+        nbytes = max(math.prod(shape) * dtype.itemsize, 1)
+        block = SharedMemory(create=True, size=nbytes)
+        self._blocks[key] = block
+        self._arrays[key] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        return self._arrays[key]
+
+    def zeros(self, key: str, shape: tuple[int, ...], dtype) -> np.ndarray:
+        """Shared array of zeros (e.g. for counts)"""
+        arr = self.empty(key, shape=shape, dtype=dtype)
+        arr.fill(0)
+        return arr
+
+    def put(self, key: str, values: np.ndarray) -> np.ndarray:
+        """Copy values into a shared array"""
+        arr = self.empty(key, shape=values.shape, dtype=values.dtype)
+        arr[...] = values
+        return arr
+
+    def map_rows(
+        self,
+        fun: Callable[[dict[str, np.ndarray], slice], object],
+        nrows: int,
+        workers: Workers,
+        chunksize: int,
+    ):
+        """
+        Call fun(arrays, rows) for slices of at most chunksize rows
+        in worker processes (at least one slice per process)
+        """
+        specs = {
+            k: (d.name, self._arrays[k].shape, self._arrays[k].dtype.str)
+            for k, d in self._blocks.items()
+        }
+        step = max(min(chunksize, math.ceil(nrows / workers.nproc)), 1)
+        futures = [
+            workers.executor.submit(_run, fun, specs, d, min(d + step, nrows))
+            for d in range(0, nrows, step)
+        ]
+        for future in futures:
+            future.result()
@@ -0,0 +1,74 @@
+"""
+Compressed encoding of tile records
+
+Records of neighbouring tiles share their structure (positions, table keys,
+similar counts), so they compress well with a zstd dictionary trained on
+a sample of them. One dictionary is trained per version (data prefix)
+with upload.train_dictionary and shipped with the backend as
+
+    backend/src/src/dicts/{version}.zdict
+
+Records are pickled and compressed with the dictionary of their version.
+Without a dictionary they are plain pickles. Readers tell both apart
+by the zstd magic number, so uncompressed versions stay readable.
+
+zstandard is only needed for compressed records.
+"""
+
+from pathlib import Path
+import pickle
+
+try:
+    import zstandard
+except ImportError:  # records can only be plain pickles
+    zstandard = None  # type: ignore
+
+MAGIC = b"\x28\xb5\x2f\xfd"  # start of zstd frames, pickles start with 0x80
+
+LEVEL = 10
+DICT_SIZE = 64 * 1024
+
+
+def _require_zstandard():
+    if zstandard is None:
+        raise RuntimeError("Compressed tile records need zstandard (pip install)")
+
+
+def dictionary_file(dictdir: Path, version: str) -> Path:
+    return dictdir / f"{version}.zdict"
+
+
+def train(bodies: list[bytes], size=DICT_SIZE) -> bytes:
+    """Train dictionary on pickled records (a few thousand are enough)"""
+    _require_zstandard()
+    samples: list[bytes | bytearray | memoryview] = list(bodies)
+    return zstandard.train_dictionary(size, samples, level=LEVEL).as_bytes()
+
+
+def compressor(dictionary: bytes, level=LEVEL):
+    """Compressor with dictionary (one per process or thread)"""
+    _require_zstandard()
+    dict_data = zstandard.ZstdCompressionDict(dictionary)
+    return zstandard.ZstdCompressor(level=level, dict_data=dict_data)
+
+
+def decompressor(dictionary: bytes):
+    """Decompressor with dictionary (one per process or thread)"""
+    _require_zstandard()
+    dict_data = zstandard.ZstdCompressionDict(dictionary)
+    return zstandard.ZstdDecompressor(dict_data=dict_data)
+
+
+def encode(record: dict, cctx=None) -> bytes:
+    """Pickle record, compressed if there is a compressor"""
+    body = pickle.dumps(record)
+    return body if cctx is None else cctx.compress(body)
+
+
+def decode(body: bytes, dctx=None) -> dict:
+    """Unpickle record, decompressed first if it is compressed"""
+    if body[:4] == MAGIC:
+        if dctx is None:
+            raise ValueError("Record is compressed, but there is no dictionary")
+        body = dctx.decompress(body)
+    return pickle.loads(body)
@@ -1,10 +1,21 @@
-from typing import Iterable
+from typing import Callable, Iterable, Iterator
+import time
+import queue
+import threading
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from itertools import product
+import numpy as np
 import pandas as pd
 from . import pq
 from . import s3
+from . import grid
+from . import manifest
+from . import tilecodec
+from .build import Target
+from .util import retry
 
 
 def _world_grid(lon_range: tuple[int, int], lat_range: tuple[int, int]) -> Iterable:
@@ -18,129 +29,348 @@ def _qrtr_mile_grid() -> Iterable:
     return product(parts, parts)
 
 
-def _add_if_exists(data: dict, key: str, df: pd.DataFrame, pos: tuple[float, float]):
-    if pos in df.index:
-        data[key] = df.loc[pos].to_dict()  # type: ignore
+_TILE_SIZE = round(1 / grid.RES)  # grid cells per tile and axis
 
 
-def _add_if_no_nan(data: dict, key: str, df: pd.DataFrame, pos: tuple[float, float]):
-    if pos in df.index:
-        row = df.loc[pos]  # type: ignore
-        if not row.isna().any():
-            data[key] = row.to_dict()
+def _tile_corners(lons: np.ndarray, lats: np.ndarray) -> np.ndarray:
+    """Cell ids of lower left corners of tiles (lon, lat in whole degrees)"""
+    return grid.grid_cell_ids(lon_q=lons * _TILE_SIZE, lat_q=lats * _TILE_SIZE)
 
 
-def _add_if_not_zero(data: dict, key: str, df: pd.DataFrame, pos: tuple[float, float]):
-    if pos in df.index:
-        row = df.loc[pos]  # type: ignore
-        if row.sum() > 0:
-            data[key] = row.to_dict()
+class _Tiles:
+    """
+    Aggregated table with rows sorted by tile once, so the rows of
+    a tile are one contiguous block. Only rows where keep is true are used.
+    """
 
+    def __init__(self, df: pd.DataFrame, keep: np.ndarray | None = None):
+        if keep is None:
+            keep = np.ones(len(df), dtype=bool)
+        cells = df.index.to_numpy()[keep]
+        lon_q, lat_q = grid.grid_indexes(cells)
+        corners = _tile_corners(lons=lon_q // _TILE_SIZE, lats=lat_q // _TILE_SIZE)
+        order = np.argsort(corners, kind="stable")
+        self.columns = list(df.columns)
+        self.corners = corners[order]
+        self.values = df.to_numpy()[keep][order]
+        self.lons, self.lats = grid.coords(cells[order])
 
-def _load_dfs(datadir: Path, label: str, month: int) -> tuple[pd.DataFrame, ...]:
-    df_rain = pq.read_table(file=datadir / f"aggregated_rain_{label}_{month}.pq")
-    df_temp = pq.read_table(file=datadir / f"aggregated_temp_{label}_{month}.pq")
-    df_wind = pq.read_table(file=datadir / f"aggregated_wind_{label}_{month}.pq")
-    df_wave = pq.read_table(file=datadir / f"aggregated_wave_{label}_{month}.pq")
-    df_seatemp = pq.read_table(file=datadir / f"aggregated_seatemp_{label}_{month}.pq")
-    df_current = pq.read_table(file=datadir / f"aggregated_current_{label}_{month}.pq")
+    def blocks(self, corners: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Get start and stop rows of tiles with these corners"""
+        starts = np.searchsorted(self.corners, corners, side="left")
+        stops = np.searchsorted(self.corners, corners, side="right")
+        return starts, stops
+
+
+def _camel(name: str) -> str:
+    first, *rest = name.split("_")
+    return first + "".join(d.title() for d in rest)
+
+
+def _table_files(datadir: Path, label: str, month: int, prefix: str) -> list[Path]:
+    """Aggregated tables (or per-year partials with prefix partial)"""
+    names = ("rain", "temp", "wind", "wave", "seatemp", "current")
+    return [datadir / f"{prefix}_{d}_{label}_{month}.pq" for d in names]
+
+
+def _load_dfs(
+    datadir: Path, label: str, month: int, prefix="aggregated"
+) -> tuple[pd.DataFrame, ...]:
+    files = _table_files(datadir=datadir, label=label, month=month, prefix=prefix)
+    dfs = [pq.read_table(file=d) for d in files]
+    df_rain, df_temp, df_wind, df_wave, df_seatemp, df_current = dfs
 
     df_wind.columns = [tuple(d.split("|")) for d in df_wind.columns]  # type: ignore
     df_current.columns = [tuple(d.split("|")) for d in df_current.columns]  # type: ignore
-    df_temp.rename(
-        columns={
-            "high_mean": "highMean",
-            "high_std": "highStd",
-            "low_mean": "lowMean",
-            "low_std": "lowStd",
-        },
-        inplace=True,
-    )
-    df_seatemp.rename(
-        columns={
-            "high_mean": "highMean",
-            "high_std": "highStd",
-            "low_mean": "lowMean",
-            "low_std": "lowStd",
-        },
-        inplace=True,
-    )
-    df_rain.rename(
-        columns={"daily_mean": "dailyMean", "daily_std": "dailyStd"},
-        inplace=True,
-    )
+    df_temp.rename(columns=_camel, inplace=True)  # e.g. highMean
+    df_seatemp.rename(columns=_camel, inplace=True)
+    df_rain.rename(columns=_camel, inplace=True)  # e.g. dailyMean
     return df_rain, df_temp, df_wind, df_wave, df_seatemp, df_current
 
 
-def _put_record(
-    lon: int,
-    lat: int,
-    version: str,
-    label: str,
-    month: int,
-    df_rain: pd.DataFrame,
-    df_temp: pd.DataFrame,
-    df_wind: pd.DataFrame,
-    df_seatemp: pd.DataFrame,
-    df_wave: pd.DataFrame,
-    df_current: pd.DataFrame,
+def _load_tables(
+    datadir: Path, label: str, month: int, prefix="aggregated"
+) -> dict[str, _Tiles]:
+    """Load aggregated tables sorted by tile, skipping rows without data"""
+    df_rain, df_temp, df_wind, df_wave, df_seatemp, df_current = _load_dfs(
+        datadir=datadir, label=label, month=month, prefix=prefix
+    )
+    return {
+        "rains": _Tiles(df_rain),
+        "temps": _Tiles(df_temp),
+        "winds": _Tiles(df_wind),
+        "seatemps": _Tiles(df_seatemp, keep=~np.isnan(df_seatemp.to_numpy()).any(1)),
+        "waves": _Tiles(df_wave, keep=df_wave.to_numpy().sum(1) > 0),
+        "currents": _Tiles(df_current, keep=df_current.to_numpy().sum(1) > 0),
+    }
+
+
+def _build_records(
+    tables: dict[str, _Tiles], tiles: list[tuple[int, int]]
+) -> Iterator[dict]:
+    """
+    Build records of tiles (lon, lat) from contiguous blocks of tables.
+    A record maps each position of its tile to the data of each table.
+    """
+    lons, lats = np.array(tiles, dtype=np.int32).reshape(-1, 2).T
+    corners = _tile_corners(lons=lons, lats=lats)
+    blocks = {k: d.blocks(corners) for k, d in tables.items()}
+    for ti, (lon, lat) in enumerate(tiles):
+        record: dict = {
+            (lon + lng_add, lat + lat_add): {} for lat_add, lng_add in _qrtr_mile_grid()
+        }
+        for name, table in tables.items():
+            starts, stops = blocks[name]
+            block = slice(starts[ti], stops[ti])
+            rows = zip(
+                table.lons[block].tolist(),
+                table.lats[block].tolist(),
+                table.values[block].tolist(),
+            )
+            for pos_lon, pos_lat, row in rows:
+                record[(pos_lon, pos_lat)][name] = dict(zip(table.columns, row))
+        yield record
+
+
+def _tile_key(version: str, label: str, month: int, lon: int, lat: int) -> str:
+    return f"{version}/{label}/{month}/{lat:d}/{lon:d}/data.pkl"
+
+
+def _key_label(label: str, prefix: str) -> str:
+    """Aggregated tiles are stored by label, partials below their prefix"""
+    return label if prefix == "aggregated" else f"{prefix}/{label}"
+
+
+# tables of the month and compressor in each encoder process
+_ENCODER_TABLES: dict[str, _Tiles] = {}
+_ENCODER_CCTX: dict = {}
+
+
+def _init_encoder(
+    datadir: Path, label: str, month: int, prefix: str, dictionary: bytes | None
 ):
-    key = f"{version}/{label}/{month}/{lat:d}/{lon:d}/data.pkl"
-    record = {}
-    for lat_add, lng_add in _qrtr_mile_grid():
-        pos = (lon + lng_add, lat + lat_add)
-        data: dict = {}
-        _add_if_exists(data=data, key="rains", df=df_rain, pos=pos)
-        _add_if_exists(data=data, key="temps", df=df_temp, pos=pos)
-        _add_if_exists(data=data, key="winds", df=df_wind, pos=pos)
-        _add_if_no_nan(data=data, key="seatemps", df=df_seatemp, pos=pos)
-        _add_if_not_zero(data=data, key="waves", df=df_wave, pos=pos)
-        _add_if_not_zero(data=data, key="currents", df=df_current, pos=pos)
-        record[pos] = data
-    s3.put_obj(key=key, obj=record)
+    tables = _load_tables(datadir=datadir, label=label, month=month, prefix=prefix)
+    _ENCODER_TABLES.update(tables)
+    if dictionary is not None:
+        _ENCODER_CCTX["cctx"] = tilecodec.compressor(dictionary)
+
+
+def _encode_tiles(tiles: list[tuple[int, int]]) -> list[tuple[list, bytes]]:
+    """
+    Build and encode records of tiles with manifest entries (in encoder process),
+    compressed if there is a dictionary
+    """
+    cctx = _ENCODER_CCTX.get("cctx")
+    records = _build_records(_ENCODER_TABLES, tiles=tiles)
+    bodies = [tilecodec.encode(d, cctx=cctx) for d in records]
+    return [(manifest.entry(d), d) for d in bodies]
+
+
+class _Progress:
+    """Upload counters shared by uploader threads, printed every few seconds"""
+
+    def __init__(self, total: int, every: float = 10.0):
+        self.total = total
+        self.tiles = 0
+        self.unchanged = 0
+        self.nbytes = 0
+        self._every = every
+        self._t0 = time.perf_counter()
+        self._last = self._t0
+        self._lock = threading.Lock()
+
+    def add(self, nbytes: int, queue_depth: int):
+        with self._lock:
+            self.tiles += 1
+            self.nbytes += nbytes
+            now = time.perf_counter()
+            if now - self._last >= self._every:
+                self._last = now
+                print(self.report(queue_depth=queue_depth))
+
+    def skip(self):
+        with self._lock:
+            self.unchanged += 1
+
+    def report(self, queue_depth: int) -> str:
+        secs = max(time.perf_counter() - self._t0, 1e-9)
+        return (
+            f"{self.tiles:,}/{self.total:,} tiles"
+            f" ({self.unchanged:,} unchanged) in {secs:.0f}s"
+            f" ({self.tiles / secs:,.0f} tiles/s, {self.nbytes / secs / 1e6:.1f} MB/s,"
+            f" queue {queue_depth:,})"
+        )
+
+
+def _journal_file(datadir: Path, version: str, label: str, month: int) -> Path:
+    logname = f"{version}_{label}_{month}".replace("/", "_")
+    return datadir / f"upload_{logname}.log"
+
+
+class _Journal:
+    """
+    Local append-only log of completed keys with their manifest entries.
+    Lines are flushed as keys complete, so an interrupted upload can resume.
+    """
+
+    def __init__(self, file: Path, resume: bool):
+        self.entries: dict[str, list] = {}
+        if resume and file.is_file():
+            with open(file, encoding="utf-8") as fh:
+                for line in fh:
+                    parts = line.split()
+                    if len(parts) == 3:  # last line can be incomplete
+                        self.entries[parts[0]] = [parts[1], int(parts[2])]
+        self._fh = open(file, "a" if resume else "w", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def add(self, key: str, entry: list):
+        with self._lock:
+            self._fh.write(f"{key} {entry[0]} {entry[1]}\n")
+            self._fh.flush()
+
+    def close(self):
+        self._fh.close()
 
 
 def all_data(
     month: int,
     label: str,
+    nprocs: int,
     nthreads: int,
     version: str,
     datadir: Path,
     lon_range: tuple[int, int],
     lat_range: tuple[int, int],
     only_keys: list[str] | None = None,
-):
-    print(f"Processing {label} {month}...")
-    df_rain, df_temp, df_wind, df_wave, df_seatemp, df_current = _load_dfs(
-        datadir=datadir, label=label, month=month
+    chunksize=256,
+    queuesize=1024,
+    retries=5,
+    backoff=1.0,
+    resume=False,
+    prefix="aggregated",
+    dictionary: Path | None = None,
+) -> int:
+    """
+    Upload records of all tiles of a month.
+    Encoder processes build and encode records in chunks of tiles
+    (compressed with the zstd dictionary file if there is one),
+    uploader threads put them to S3. They are connected by a queue
+    of at most queuesize records, a full queue pauses encoding.
+    Records which are unchanged according to the manifest are skipped.
+    Completed keys are logged in a journal in datadir. With resume keys
+    of the journal are skipped. Failed PUTs are retried with backoff.
+    With prefix partial, per-year partials of year label are uploaded.
+    Returns number of tiles processed.
+    """
+    print(f"Processing {prefix} {label} {month}...")
+    dict_data = None if dictionary is None else dictionary.read_bytes()
+    initargs = (datadir, label, month, prefix, dict_data)
+    label = _key_label(label=label, prefix=prefix)
+    journalfile = _journal_file(
+        datadir=datadir, version=version, label=label, month=month
+    )
+    journal = _Journal(file=journalfile, resume=resume)
+    tiles = []
+    for lon, lat in _world_grid(lat_range=lat_range, lon_range=lon_range):
+        key = _tile_key(version=version, label=label, month=month, lon=lon, lat=lat)
+        if only_keys is not None and key not in only_keys:
+            continue
+        if key in journal.entries:
+            continue
+        tiles.append((lon, lat))
+    chunks = [tiles[i : i + chunksize] for i in range(0, len(tiles), chunksize)]
+    if len(journal.entries) > 0:
+        print(f"Resuming after {len(journal.entries):,} completed tiles")
+
+    remote = retry(
+        partial(manifest.read, version=version, label=label, month=month),
+        retries=retries,
+        backoff=backoff,
     )
+    entries = {**remote, **journal.entries}
+    encoded: queue.Queue = queue.Queue(maxsize=queuesize)
+    progress = _Progress(total=len(tiles))
+    failed: list[str] = []
+
+    def upload():
+        while (item := encoded.get()) is not None:
+            key, entry, body = item
+            try:
+                retry(
+                    partial(s3.put_bytes, key=key, body=body),
+                    retries=retries,
+                    backoff=backoff,
+                )
+            except Exception as err:  # pylint: disable=broad-except
+                print(f"Uploading {key} failed: {err}")
+                failed.append(key)
+                entries.pop(key, None)
+                continue
+            entries[key] = entry
+            journal.add(key=key, entry=entry)
+            progress.add(nbytes=len(body), queue_depth=encoded.qsize())
 
-    positions = _world_grid(lat_range=lat_range, lon_range=lon_range)
-    with ThreadPoolExecutor(max_workers=nthreads) as executor:
-        results = []
-        for lon, lat in positions:
-            key = f"{version}/{label}/{month}/{lat:d}/{lon:d}/data.pkl"
-            if only_keys is not None and key not in only_keys:
+    def enqueue(chunk: list[tuple[int, int]], results: list[tuple[list, bytes]]):
+        for (lon, lat), (entry, body) in zip(chunk, results, strict=True):
+            key = _tile_key(version=version, label=label, month=month, lon=lon, lat=lat)
+            if remote.get(key) == entry:
+                journal.add(key=key, entry=entry)
+                progress.skip()
                 continue
-            res = executor.submit(
-                _put_record,
-                lon=lon,
-                lat=lat,
-                label=label,
-                version=version,
-                month=month,
-                df_rain=df_rain,
-                df_temp=df_temp,
-                df_wind=df_wind,
-                df_seatemp=df_seatemp,
-                df_wave=df_wave,
-                df_current=df_current,
+            encoded.put((key, entry, body))
+
+    threads = [threading.Thread(target=upload) for _ in range(nthreads)]
+    for thread in threads:
+        thread.start()
+    try:
+        with ProcessPoolExecutor(
+            max_workers=nprocs,
+            initializer=_init_encoder,
+            initargs=initargs,
+        ) as executor:
+            pending: deque = deque()
+            for chunk in chunks:
+                pending.append((chunk, executor.submit(_encode_tiles, chunk)))
+                if len(pending) > 2 * nprocs:
+                    chunk, future = pending.popleft()
+                    enqueue(chunk=chunk, results=future.result())
+            for chunk, future in pending:
+                enqueue(chunk=chunk, results=future.result())
+    finally:
+        for _ in threads:
+            encoded.put(None)
+        for thread in threads:
+            thread.join()
+        journal.close()
+        # a failing manifest must not hide why the upload failed
+        manifest_error = None
+        try:
+            retry(
+                partial(
+                    manifest.write,
+                    version=version,
+                    label=label,
+                    month=month,
+                    entries=entries,
+                ),
+                retries=retries,
+                backoff=backoff,
             )
-            results.append(res)
+        except Exception as err:  # pylint: disable=broad-except
+            print(f"Writing manifest of {label} {month} failed: {err}")
+            manifest_error = err
 
-    failed = [p for p, r in zip(positions, results) if not r]
+    print(progress.report(queue_depth=encoded.qsize()))
     if len(failed) > 0:
-        print(f"Uploading these positions failed: {','.join(failed)}")
+        print(
+            f"Uploading {len(failed):,} keys failed after {retries} retries."
+            f" They are:\n\n{' '.join(sorted(failed))}"
+        )
+        raise RuntimeError(f"Uploading {len(failed):,} keys failed") from manifest_error
+    if manifest_error is not None:
+        raise manifest_error
+    return progress.tiles + progress.unchanged
 
 
 def check(
@@ -149,13 +379,18 @@ def check(
     months: list[int],
     lon_range: tuple[int, int],
     lat_range: tuple[int, int],
+    prefix="aggregated",
 ):
-    lons_lats = _world_grid(lon_range=lon_range, lat_range=lat_range)
+    """Check uploaded tiles against manifests of labels and months"""
+    labels = [_key_label(label=d, prefix=prefix) for d in labels]
+    lons_lats = list(_world_grid(lon_range=lon_range, lat_range=lat_range))
     req_keys = set(
-        f"{version}/{y}/{m}/{lat}/{lon}/data.pkl"
+        _tile_key(version=version, label=y, month=m, lon=lon, lat=lat)
         for y, m, (lon, lat) in product(labels, months, lons_lats)
     )
-    act_keys = set(s3.ls_obj_keys(prefix=version))
+    act_keys: set[str] = set()
+    for label, month in product(labels, months):
+        act_keys.update(manifest.read(version=version, label=label, month=month))
 
     msg_keys = req_keys - act_keys
     msg_keys_str = " ".join([f"'{d}'" for d in msg_keys])
@@ -163,3 +398,88 @@ def check(
     wrng_keys = act_keys - req_keys
     wrng_keys_str = " ".join([f"'{d}'" for d in wrng_keys])
     print(f"\n{len(wrng_keys):,} objects are wrong. They are:\n\n{wrng_keys_str}")
+
+
+def targets(
+    version: str,
+    labels: list[str],
+    months: list[int],
+    datadir: Path,
+    prefix="aggregated",
+    **kwargs,
+) -> list[Target]:
+    """
+    Build targets uploading all tiles of each label and month (see all_data).
+    Their output is the local journal of the upload.
+    A dictionary is an input, so tiles are encoded again if it changed.
+    """
+    dictionary = kwargs.get("dictionary")
+    out = []
+    for label, month in product(labels, months):
+        key_label = _key_label(label=label, prefix=prefix)
+        inputs = _table_files(datadir=datadir, label=label, month=month, prefix=prefix)
+        if dictionary is not None:
+            inputs.append(dictionary)
+        out.append(
+            Target(
+                name=f"upload/{version}/{key_label}/{month}",
+                fun=partial(
+                    all_data,
+                    month=month,
+                    label=label,
+                    version=version,
+                    datadir=datadir,
+                    prefix=prefix,
+                    **kwargs,
+                ),
+                inputs=inputs,
+                outputs=[
+                    _journal_file(
+                        datadir=datadir, version=version, label=key_label, month=month
+                    )
+                ],
+                params={
+                    "version": version,
+                    "lon_range": kwargs["lon_range"],
+                    "lat_range": kwargs["lat_range"],
+                },
+            )
+        )
+    return out
+
+
+def train_dictionary(
+    version: str,
+    sources: list[tuple[str, str]],
+    months: list[int],
+    datadir: Path,
+    lon_range: tuple[int, int],
+    lat_range: tuple[int, int],
+    ntiles=2000,
+    seed=42,
+) -> Path:
+    """
+    Train zstd dictionary of version on records of ntiles random tiles
+    of each source (label, prefix) and month whose tables exist.
+    Returns its file in {datadir}/dicts.
+    """
+    world = list(_world_grid(lon_range=lon_range, lat_range=lat_range))
+    rng = np.random.default_rng(seed)
+    bodies: list[bytes] = []
+    for (label, prefix), month in product(sources, months):
+        files = _table_files(datadir=datadir, label=label, month=month, prefix=prefix)
+        if not all(d.is_file() for d in files):
+            continue
+        print(f"Sampling {prefix} {label} {month}...")
+        tables = _load_tables(datadir=datadir, label=label, month=month, prefix=prefix)
+        idxs = rng.choice(len(world), size=min(ntiles, len(world)), replace=False)
+        tiles = [world[d] for d in sorted(idxs)]
+        bodies.extend(tilecodec.encode(d) for d in _build_records(tables, tiles=tiles))
+    if len(bodies) == 0:
+        raise ValueError("There are no tables to sample tiles from")
+
+    file = tilecodec.dictionary_file(dictdir=datadir / "dicts", version=version)
+    file.parent.mkdir(exist_ok=True)
+    file.write_bytes(tilecodec.train(bodies))
+    print(f"Dictionary trained on {len(bodies):,} tiles written to {file}")
+    return file
@@ -1,7 +1,9 @@
+from typing import Callable, Iterator
 from pathlib import Path
+import random
 import tarfile
+import time
 import zipfile
-import shutil
 import numpy as np
 
 
@@ -29,28 +31,36 @@ def velocity(u: np.ndarray, v: np.ndarray) -> np.ndarray:
     return np.sqrt(u**2 + v**2) * 1.94384
 
 
-def get_tar_members(archive: Path) -> list[str]:
-    """Get names of files that are members of a tar archive"""
-    try:
-        with tarfile.open(archive, "r:gz") as fh:
-            return fh.getnames()
-    except tarfile.ReadError:
-        with zipfile.ZipFile(archive, "r") as zfh:
-            return zfh.namelist()
-
-
-def extract_tar_member(archive: Path, name: str, outfile: Path):
+def iter_archive_members(
+    archive: Path, select: Callable[[str], bool]
+) -> Iterator[tuple[str, bytes]]:
     """
-    Extract single file from archive and write to outfile.
+    Read archive (tar.gz or zip) once from start to end and
+    yield name and content of each selected member in archive order.
+    Only one member's content is held in memory at a time.
     """
-    try:
-        with tarfile.open(archive, "r:gz") as inf:
-            fo = inf.extractfile(member=name)
-            if fo is None:
-                return
-            with open(outfile, "wb") as output:
-                shutil.copyfileobj(fo, output)
-    except tarfile.ReadError:
+    if zipfile.is_zipfile(archive):
         with zipfile.ZipFile(archive, "r") as zfh:
-            zfh.extract(name, outfile.parent)
-        (outfile.parent / name).rename(outfile)
+            for name in zfh.namelist():
+                if select(name):
+                    yield name, zfh.read(name)
+        return
+
+    with tarfile.open(archive, "r|gz") as fh:
+        for member in fh:
+            if member.isfile() and select(member.name):
+                fo = fh.extractfile(member)
+                assert fo is not None
+                yield member.name, fo.read()
+
+
+def retry(fun: Callable, retries: int, backoff: float, cap=60.0):
+    """Call fun, retry failures with exponential backoff and full jitter"""
+    for attempt in range(retries + 1):
+        try:
+            return fun()
+        except Exception:  # pylint: disable=broad-except
+            if attempt == retries:
+                raise
+            time.sleep(random.uniform(0, min(cap, backoff * 2**attempt)))
+    return None
@@ -0,0 +1,273 @@
+"""
+Work queue of build targets drained by workers on any number of nodes
+
+A coordinator puts the targets of extract, aggregate and upload into a
+SQLite file (on a filesystem shared by all nodes, or a local one for local
+workers). Leases rely on SQLite's file locks, so the shared filesystem must
+implement POSIX locks correctly (e.g. Lustre or GPFS mounted with locking).
+On NFS and similar filesystems locks are unreliable and two nodes can lease
+the same job, there all workers must run on the node with the file.
+Each job is a pickled target with the jobs building its inputs.
+Workers lease a job whose dependencies are done, renew the lease with
+heartbeats while building it, and mark it done or failed afterwards.
+A job whose lease expired (its worker died or hangs) is leased again,
+until it was tried max_attempts times. Jobs depending on a failed job fail.
+
+Targets are built like build.run: up to date ones are only marked done,
+built ones are fingerprinted in {outputdir}/.build. All nodes need the
+same code, and the same paths to inputdir and outputdir. Leases use the
+wall clock, so clocks of nodes must be roughly in sync (less than the lease).
+
+    jobs  name, pickled target, state (pending, leased, done, failed),
+          attempts, max_attempts, worker, lease end, error, position
+    deps  name, dependency
+"""
+
+from typing import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+import os
+import pickle
+import socket
+import sqlite3
+import threading
+import time
+from . import build
+from .build import Target
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    name TEXT PRIMARY KEY,
+    target BLOB NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    max_attempts INTEGER NOT NULL,
+    worker TEXT,
+    lease_until REAL,
+    error TEXT,
+    position INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS deps (
+    name TEXT NOT NULL,
+    dep TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS deps_name ON deps (name);
+"""
+
+
+def worker_id() -> str:
+    """Host and process id of this worker"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class WorkQueue:
+    """Jobs in SQLite file, leased for lease_s seconds at a time"""
+
+    def __init__(self, file: Path, lease_s=60.0):
+        self.file = file
+        self.lease_s = lease_s
+        file.parent.mkdir(parents=True, exist_ok=True)
+        # connection is shared with heartbeats, self._lock serializes its use
+        self._conn = sqlite3.connect(
+            file, timeout=60, isolation_level=None, check_same_thread=False
+        )
+        self._lock = threading.Lock()
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Cursor]:
+        """Locks database for writing at once, so leases do not race"""
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                yield cur
+            except BaseException:
+                cur.execute("ROLLBACK")
+                raise
+            cur.execute("COMMIT")
+
+    def put(self, targets: list[Target], max_attempts=3):
+        """
+        Add targets as pending jobs in this order (targets of earlier
+        steps first). Jobs which exist already are reset to pending.
+        """
+        deps = build.dependencies(targets)
+        with self._transaction() as cur:
+            (offset,) = cur.execute("SELECT COUNT(*) FROM jobs").fetchone()
+            for i, target in enumerate(targets):
+                cur.execute(
+                    "INSERT INTO jobs"
+                    " VALUES (?, ?, 'pending', 0, ?, NULL, NULL, NULL, ?)"
+                    " ON CONFLICT (name) DO UPDATE SET target=excluded.target,"
+                    " state='pending', attempts=0, max_attempts=excluded.max_attempts,"
+                    " worker=NULL, lease_until=NULL, error=NULL",
+                    (target.name, pickle.dumps(target), max_attempts, offset + i),
+                )
+                cur.execute("DELETE FROM deps WHERE name = ?", (target.name,))
+                cur.executemany(
+                    "INSERT INTO deps VALUES (?, ?)",
+                    [(target.name, d) for d in sorted(deps[target.name])],
+                )
+
+    def _expire(self, cur: sqlite3.Cursor, now: float):
+        """Retry jobs with expired leases, fail them after max_attempts"""
+        cur.execute(
+            "UPDATE jobs SET state = CASE WHEN attempts < max_attempts"
+            " THEN 'pending' ELSE 'failed' END,"
+            " error = 'lease expired', worker = NULL"
+            " WHERE state = 'leased' AND lease_until < ?",
+            (now,),
+        )
+
+    def _fail_dependents(self, cur: sqlite3.Cursor):
+        """Fail pending jobs depending on failed jobs (repeated down the graph)"""
+        while True:
+            cur.execute(
+                "UPDATE jobs SET state = 'failed', error = 'inputs failed'"
+                " WHERE state = 'pending' AND name IN (SELECT deps.name FROM deps"
+                " JOIN jobs AS d ON d.name = deps.dep WHERE d.state = 'failed')"
+            )
+            if cur.rowcount == 0:
+                return
+
+    def lease(self, worker: str) -> Target | None:
+        """
+        Lease the first pending job whose dependencies are done,
+        None if there is none at the moment
+        """
+        now = time.time()
+        with self._transaction() as cur:
+            self._expire(cur, now=now)
+            self._fail_dependents(cur)
+            row = cur.execute(
+                "SELECT name, target FROM jobs WHERE state = 'pending'"
+                " AND NOT EXISTS (SELECT 1 FROM deps JOIN jobs AS d"
+                " ON d.name = deps.dep WHERE deps.name = jobs.name"
+                " AND d.state != 'done') ORDER BY position LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            cur.execute(
+                "UPDATE jobs SET state = 'leased', attempts = attempts + 1,"
+                " worker = ?, lease_until = ? WHERE name = ?",
+                (worker, now + self.lease_s, row[0]),
+            )
+        return pickle.loads(row[1])
+
+    def heartbeat(self, name: str, worker: str) -> bool:
+        """Renew lease of job, False if worker lost it"""
+        with self._transaction() as cur:
+            cur.execute(
+                "UPDATE jobs SET lease_until = ?"
+                " WHERE name = ? AND worker = ? AND state = 'leased'",
+                (time.time() + self.lease_s, name, worker),
+            )
+            return cur.rowcount == 1
+
+    def finish(self, name: str, worker: str, error: str | None = None):
+        """
+        Mark leased job done, or failed with error. A failed job is
+        retried until max_attempts. Ignored if worker lost the lease.
+        """
+        with self._transaction() as cur:
+            if error is None:
+                state = "'done'"
+            else:
+                state = (
+                    "CASE WHEN attempts < max_attempts THEN 'pending' ELSE 'failed' END"
+                )
+            cur.execute(
+                f"UPDATE jobs SET state = {state}, error = ?, worker = NULL"
+                " WHERE name = ? AND worker = ? AND state = 'leased'",
+                (error, name, worker),
+            )
+
+    def counts(self) -> dict[str, int]:
+        """Number of jobs in each state"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT state, COUNT(*) FROM jobs GROUP BY state"
+            ).fetchall()
+        return {k: d for k, d in rows}
+
+    def failed(self) -> list[tuple[str, str]]:
+        """Names and errors of failed jobs"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT name, error FROM jobs WHERE state = 'failed' ORDER BY position"
+            ).fetchall()
+        return [(k, d) for k, d in rows]
+
+    def is_drained(self) -> bool:
+        """Whether no job is pending or leased anymore"""
+        counts = self.counts()
+        return counts.get("pending", 0) + counts.get("leased", 0) == 0
+
+
+def _heartbeats(
+    queue: WorkQueue, name: str, worker: str, interval: float, halt: threading.Event
+):
+    while not halt.wait(interval):
+        if not queue.heartbeat(name=name, worker=worker):
+            print(f"Lost lease of {name}")
+            return
+
+
+def work(
+    queue: WorkQueue,
+    builddir: Path,
+    worker: str | None = None,
+    force=False,
+    hashing=False,
+    poll_s=5.0,
+    max_jobs: int | None = None,
+) -> int:
+    """
+    Lease and build jobs until the queue is drained (or max_jobs were run).
+    While a job is built its lease is renewed every third of the lease.
+    Returns number of jobs run.
+    """
+    worker = worker_id() if worker is None else worker
+    njobs = 0
+    while max_jobs is None or njobs < max_jobs:
+        target = queue.lease(worker=worker)
+        if target is None:
+            if queue.is_drained():
+                break
+            time.sleep(poll_s)  # jobs are running, their dependents will follow
+            continue
+
+        print(f"Building {target.name} ({worker})...")
+        halt = threading.Event()
+        heartbeats = threading.Thread(
+            target=_heartbeats,
+            kwargs={
+                "queue": queue,
+                "name": target.name,
+                "worker": worker,
+                "interval": queue.lease_s / 3,
+                "halt": halt,
+            },
+            daemon=True,
+        )
+        heartbeats.start()
+        error = None
+        try:
+            built = build.build_target(
+                target=target, builddir=builddir, force=force, hashing=hashing
+            )
+            if not built:
+                print(f"{target.name} is up to date")
+        except Exception as err:  # pylint: disable=broad-except
+            print(f"Building {target.name} failed: {err}")
+            error = repr(err)
+        finally:
+            halt.set()
+            heartbeats.join()
+        queue.finish(name=target.name, worker=worker, error=error)
+        njobs += 1
+    return njobs
@@ -0,0 +1,229 @@
+"""
+Raw input files like the ones downloaded from the Climate Data Store
+
+Writes ERA5 GRIB (edition 1, simple packing) and ORAS5 tar.gz archives
+of NetCDF files with random values in realistic ranges per variable,
+for any region of the grid. Used as fixtures by tests and to generate
+inputs of benchmarks (see benchmarks/synthetic.py).
+"""
+
+from pathlib import Path
+import io
+import math
+import struct
+import tarfile
+import tempfile
+import numpy as np
+from netCDF4 import Dataset  # pylint: disable=no-name-in-module
+from src import grid
+
+# scale and offset of normal distributed values per variable
+VALUES = {
+    "10m_u_component_of_wind": (6.0, 0.0),
+    "10m_v_component_of_wind": (6.0, 0.0),
+    "2m_temperature": (8.0, 285.0),
+    "sea_surface_temperature": (3.0, 290.0),
+    "significant_height_of_combined_wind_waves_and_swell": (1.0, 2.0),
+    "total_precipitation": (0.0005, 0.0),
+    "rotated_zonal_velocity": (0.4, 0.0),
+    "rotated_meridional_velocity": (0.4, 0.0),
+}
+
+# ORAS5 names of velocities in NetCDF files
+ORAS5_NAMES = {
+    "rotated_zonal_velocity": "vozocrte",
+    "rotated_meridional_velocity": "vomecrtn",
+}
+
+TIMES = [0, 3, 6, 9, 12, 15, 18, 21]
+
+
+def axis(interval: tuple[float, float]) -> np.ndarray:
+    n = round((interval[1] - interval[0]) / grid.RES) + 1
+    return interval[0] + np.arange(n) * grid.RES
+
+
+def seeded_rng(seed: int, variable: str, *args: int) -> np.random.Generator:
+    return np.random.default_rng([seed, list(VALUES).index(variable), *args])
+
+
+def random_values(variable: str, shape: tuple[int, ...], rng: np.random.Generator):
+    scale, offset = VALUES[variable]
+    values = rng.normal(scale=scale, loc=offset, size=shape)
+    if variable == "total_precipitation":
+        values = np.abs(values)
+    return values
+
+
+def _grib1_int(value: int, nbytes: int) -> bytes:
+    """Sign and magnitude integer"""
+    sign = 1 << (8 * nbytes - 1) if value < 0 else 0
+    return (sign | abs(value)).to_bytes(nbytes, "big")
+
+
+def _grib1_float(value: float) -> tuple[bytes, float]:
+    """IBM float (rounded down) and the value it represents"""
+    if value == 0:
+        return bytes(4), 0.0
+    exponent = math.floor(math.log(abs(value), 16)) + 1
+    mantissa = abs(value) / 16.0**exponent * 2**24
+    mantissa = math.ceil(mantissa) if value < 0 else math.floor(mantissa)
+    if mantissa >= 2**24:
+        exponent, mantissa = exponent + 1, mantissa >> 4
+    sign = 0x80000000 if value < 0 else 0
+    word = sign | ((exponent + 64) << 24) | mantissa
+    represented = math.copysign(mantissa * 2.0**-24 * 16.0**exponent, value)
+    return struct.pack(">I", word), represented
+
+
+def grib1_message(
+    values: np.ndarray,
+    lons: np.ndarray,
+    lats: np.ndarray,
+    year: int,
+    month: int,
+    day: int,
+    hour: int,
+) -> bytes:
+    """
+    GRIB edition 1 message of a regular lon-lat grid (scanning from north-west,
+    lats x lons values) with simple packing in 16 bits
+    """
+    pds = b"".join(
+        [
+            (28).to_bytes(3, "big"),
+            bytes([128, 98, 0, 255, 0x80, 1, 1]),  # table, centre, ..., GDS present
+            (0).to_bytes(2, "big"),  # level
+            bytes([(year - 1) % 100 + 1, month, day, hour, 0, 1, 0, 0, 0]),
+            (0).to_bytes(2, "big"),  # number included in average
+            bytes([0, (year - 1) // 100 + 1, 0]),
+            _grib1_int(0, 2),  # decimal scale factor
+        ]
+    )
+    millis = [round(d * 1000) for d in (lats[0], lons[0], lats[-1], lons[-1])]
+    gds = b"".join(
+        [
+            (32).to_bytes(3, "big"),
+            bytes([0, 255, 0]),  # lat/lon grid
+            len(lons).to_bytes(2, "big"),
+            len(lats).to_bytes(2, "big"),
+            _grib1_int(millis[0], 3),
+            _grib1_int(millis[1], 3),
+            bytes([0x80]),
+            _grib1_int(millis[2], 3),
+            _grib1_int(millis[3], 3),
+            round(grid.RES * 1000).to_bytes(2, "big"),
+            round(grid.RES * 1000).to_bytes(2, "big"),
+            bytes([0]),  # scanning +i, -j
+            bytes(4),
+        ]
+    )
+    ref, ref_value = _grib1_float(float(values.min()))
+    span = max(float(values.max()) - ref_value, 1e-12)
+    scale = math.ceil(math.log2(span / (2**16 - 1)))
+    packed = np.clip(np.rint((values.flatten() - ref_value) / 2.0**scale), 0, 2**16 - 1)
+    data = packed.astype(">u2").tobytes()
+    bds = b"".join(
+        [
+            (11 + len(data) + 1).to_bytes(3, "big"),
+            bytes([8]),  # simple packing, 8 unused bits at the end
+            _grib1_int(scale, 2),
+            ref,
+            bytes([16]),
+            data,
+            bytes(1),
+        ]
+    )
+    length = 8 + len(pds) + len(gds) + len(bds) + 4
+    header = b"GRIB" + length.to_bytes(3, "big") + bytes([1])
+    return header + pds + gds + bds + b"7777"
+
+
+def raw_grib(
+    datadir: Path,
+    variable: str,
+    year: int,
+    month: int,
+    lon_range: tuple[float, float],
+    lat_range: tuple[float, float],
+    days=31,
+    seed=42,
+):
+    """Write raw ERA5 file with a message every 3 hours of a month"""
+    lons, lats = axis(lon_range), axis(lat_range)[::-1]
+    rng = seeded_rng(seed, variable, year, month)
+    with open(datadir / f"raw_{variable}_{year}.grib", "wb") as fh:
+        for day in range(1, days + 1):
+            for hour in TIMES:
+                values = random_values(variable, shape=(len(lats), len(lons)), rng=rng)
+                msg = grib1_message(
+                    values=values,
+                    lons=lons,
+                    lats=lats,
+                    year=year,
+                    month=month,
+                    day=day,
+                    hour=hour,
+                )
+                fh.write(msg)
+
+
+def _netcdf(
+    variable: str,
+    lons: np.ndarray,
+    lats: np.ndarray,
+    depths: np.ndarray,
+    rng: np.random.Generator,
+) -> bytes:
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file = Path(tmpdir) / "member.nc"
+        ds = Dataset(file, "w")
+        ds.createDimension("time_counter", 1)
+        ds.createDimension("deptht", len(depths))
+        ds.createDimension("y", lons.shape[0])
+        ds.createDimension("x", lons.shape[1])
+        ds.createVariable("deptht", "f4", ("deptht",))[:] = depths
+        ds.createVariable("nav_lon", "f4", ("y", "x"))[:] = lons
+        ds.createVariable("nav_lat", "f4", ("y", "x"))[:] = lats
+        shape = (1, len(depths), *lons.shape)
+        values = random_values(variable, shape=shape, rng=rng)
+        land = rng.uniform(size=lons.shape) < 0.3
+        values = np.ma.masked_array(values, mask=np.broadcast_to(land, shape))
+        dims = ("time_counter", "deptht", "y", "x")
+        velos = ds.createVariable(ORAS5_NAMES[variable], "f4", dims, fill_value=1e20)
+        velos[:] = values
+        ds.close()
+        return file.read_bytes()
+
+
+def raw_oras5(
+    datadir: Path,
+    variable: str,
+    year: int,
+    months: list[int],
+    lon_range: tuple[float, float],
+    lat_range: tuple[float, float],
+    seed=42,
+):
+    """
+    Write raw ORAS5 archive with a NetCDF file per month.
+    Like ORAS5 the grid is curvilinear (jittered), several points can
+    snap to the same cell.
+    """
+    rng = seeded_rng(seed, variable, year)
+    lons, lats = np.meshgrid(axis(lon_range), axis(lat_range))
+    lons = lons + rng.uniform(-0.1, 0.1, size=lons.shape)
+    lats = lats + rng.uniform(-0.1, 0.1, size=lats.shape)
+    depths = np.array([0.5, 1.6, 2.7, 3.8, 5.0, 6.4, 7.9, 9.6])
+    archive = datadir / f"raw_{variable}_{year}.tar.gz"
+    with tarfile.open(archive, "w:gz") as tar:
+        for month in months:
+            content = _netcdf(
+                variable=variable, lons=lons, lats=lats, depths=depths, rng=rng
+            )
+            name = ORAS5_NAMES[variable]
+            info = tarfile.TarInfo(
+                f"{name}_control_monthly_highres_3D_{year}{month:02d}_OPER_v0.1.nc"
+            )
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
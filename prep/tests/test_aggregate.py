@@ -1,6 +1,16 @@
+from itertools import product
 import numpy as np
-from src.aggregate import _bin
-from src.config import WAVES, WIND_VELS, CURRENT_VELS, DIRECTIONS
+import pandas as pd
+from src import pq
+from src import cube
+from src import grid
+from src import era5
+from src import oras5
+from src.aggregate import _bin, _bin_dirs, _count_joint, _count_uv, _Moments
+from src.aggregate import _read_index, _read_month, _iter_month
+from src.aggregate import temps, waves, write_partial, write_streamed_partial
+from src.config import WAVES, WIND_VELS, CURRENT_VELS, DIRECTIONS, VARMAP
+from tests import rawfiles
 
 
 def test_bin_dirs():
@@ -33,3 +43,191 @@ def test_bin_waves():
     res = _bin(np.array([l0, l1]), by=WAVES)
     assert res[0].tolist() == [1, 2, 3, 4, 5]
     assert res[1].tolist() == [6, 7, 8, 9, 10]
+
+
+def test_moments_match_numpy():
+    rng = np.random.default_rng(42)
+    samples = rng.normal(loc=280.0, scale=5.0, size=(50, 93))
+    samples[3, 10] = np.nan
+    moments = _Moments(n=50)
+    for day in range(samples.shape[1]):
+        moments.update(samples[:, day])
+    assert np.allclose(moments.mean, np.mean(samples, axis=1), equal_nan=True)
+    assert np.allclose(moments.std, np.std(samples, axis=1), equal_nan=True)
+    assert np.isnan(moments.mean[3])
+
+
+def test_bin_dirs_matches_digitize():
+    angles = np.array([[0, 11.25, 33.75, 100, 348.75, 359.9, 360, np.nan]])
+    exp = _bin(angles, by=DIRECTIONS)
+    exp[exp == 17] = 1
+    assert _bin_dirs(angles).tolist() == exp.tolist()
+
+
+def test_count_joint_matches_loop():
+    rng = np.random.default_rng(42)
+    D = rng.integers(1, 17, size=(20, 50))
+    V = rng.integers(1, 14, size=(20, 50))
+    V[0, :5] = -1
+    combis = list(product(range(1, 17), range(1, 14)))
+    exp = np.zeros((20, len(combis)), dtype=int)
+    for ci, (dr, vl) in enumerate(combis):
+        exp[:, ci] += np.sum((D == dr) & (V == vl), axis=1)
+    res = _count_joint(D, V, nvels=13)
+    assert res.tolist() == exp.tolist()
+    assert res[0].sum() == 45
+
+
+def test_count_uv_same_for_any_chunksize(tmp_path):
+    rng = np.random.default_rng(42)
+    index = pd.Index(np.arange(100, 164, dtype=np.int32), name="cell")
+    for var in ("u", "v"):
+        data = rng.normal(scale=6.0, size=(len(index), 16))
+        df = pd.DataFrame(data, index=index, columns=[f"1-{d}" for d in range(16)])
+        pq.write_table(df=df, file=tmp_path / f"extracted_{var}_2020-1.pq")
+
+    kwargs = {"uvar": "u", "vvar": "v", "vels": WIND_VELS, "is_wind": True}
+    kwargs.update({"month": 1, "year": 2020, "datadir": tmp_path})
+    df_a = _count_uv(chunksize=1000, **kwargs)
+    df_b = _count_uv(chunksize=7, **kwargs)
+    assert df_a.index.equals(index) and df_b.index.equals(index)
+    assert df_a.equals(df_b)
+    assert df_a.to_numpy().sum() == 16 * len(index)
+
+
+def test_partials_same_for_any_lat_band(tmp_path):
+    rng = np.random.default_rng(42)
+    lons, lats = np.meshgrid(np.arange(-1, 1, 0.25), np.arange(-2, 2, 0.25))
+    index = pd.Index(grid.cell_ids(lons=lons.flatten(), lats=lats.flatten()))
+    index.name = "cell"
+    for var in ("10m_u_component_of_wind", "10m_v_component_of_wind"):
+        data = rng.normal(scale=6.0, size=(len(index), 16))
+        df = pd.DataFrame(data, index=index, columns=[f"1-{d}" for d in range(16)])
+        file = tmp_path / f"extracted_{var}_2020-1.pq"
+        pq.write_table(df=df, file=file, bands=grid.lat_bands(0.5))
+
+    kwargs = {"name": "wind", "month": 1, "year": 2020, "datadir": tmp_path}
+    assert write_partial(lat_band=100, **kwargs) == len(index)
+    df_a = pq.read_table(tmp_path / "partial_wind_2020_1.pq")
+    assert write_partial(lat_band=0.5, chunksize=5, **kwargs) == len(index)
+    df_b = pq.read_table(tmp_path / "partial_wind_2020_1.pq")
+    assert df_a.index.equals(index) and df_a.equals(df_b)
+
+
+def test_partials_same_with_shared_memory_processes(tmp_path):
+    rng = np.random.default_rng(42)
+    lons, lats = np.meshgrid(np.arange(-1, 1, 0.25), np.arange(-2, 2, 0.25))
+    index = pd.Index(grid.cell_ids(lons=lons.flatten(), lats=lats.flatten()))
+    index.name = "cell"
+    for var in ("rotated_zonal_velocity", "rotated_meridional_velocity"):
+        data = rng.normal(scale=0.8, size=(len(index), 3))
+        data[:5, 0] = np.nan
+        df = pd.DataFrame(data, index=index, columns=["l0", "l1", "l2"])
+        pq.write_table(df=df, file=tmp_path / f"extracted_{var}_2020-1.pq")
+
+    kwargs = {"name": "current", "month": 1, "year": 2020, "datadir": tmp_path}
+    write_partial(**kwargs)
+    df_a = pq.read_table(tmp_path / "partial_current_2020_1.pq")
+    # several bands counted by the same worker processes
+    assert write_partial(nproc=3, chunksize=7, lat_band=1, **kwargs) == len(index)
+    df_b = pq.read_table(tmp_path / "partial_current_2020_1.pq")
+    assert df_a.equals(df_b)
+    assert (df_b.to_numpy().sum(axis=1) == 3).sum() == len(index) - 5
+
+
+def test_streamed_partials_same_as_extracted(tmp_path):
+    ranges = {"lon_range": (-1.0, 1.0), "lat_range": (-1.5, 1.0)}
+    rawdir, extdir, streamdir = tmp_path / "raw", tmp_path / "ext", tmp_path / "str"
+    for d in (rawdir, extdir, streamdir):
+        d.mkdir()
+
+    for name in ("temp", "rain", "wave", "wind"):
+        for var in VARMAP[name]:
+            rawfiles.raw_grib(
+                datadir=rawdir, variable=var, year=2020, month=1, days=2, **ranges
+            )
+            era5._extract_and_write_values(
+                month=1, variable=var, inputdir=rawdir, outputdir=extdir, year=2020
+            )
+        kwargs = {"name": name, "month": 1, "year": 2020}
+        write_partial(datadir=extdir, **kwargs)
+        n = write_streamed_partial(
+            inputdir=rawdir, datadir=streamdir, lat_band=0.5, **kwargs
+        )
+        exp = pq.read_table(extdir / f"partial_{name}_2020_1.pq")
+        res = pq.read_table(streamdir / f"partial_{name}_2020_1.pq")
+        assert n == len(exp) and res.index.equals(exp.index)
+        assert res.columns.equals(exp.columns)
+        assert np.allclose(res.to_numpy(), exp.to_numpy()), name
+
+    var = "rotated_zonal_velocity"
+    rawfiles.raw_oras5(datadir=rawdir, variable=var, year=2020, months=[1], **ranges)
+    kwargs = {"resolution": 0.25, "lon_range": (-1, 1), "lat_range": (-1, 1)}
+    oras5._extract_and_write_year(
+        variable=var,
+        year=2020,
+        months=[1],
+        inputdir=rawdir,
+        outputdir=extdir,
+        store="parquet",
+        chunksize=100,
+        **kwargs,
+    )
+    res = oras5.read_month(variable=var, year=2020, month=1, inputdir=rawdir, **kwargs)
+    exp = pq.read_table(extdir / f"extracted_{var}_2020-1.pq")
+    assert res.index.equals(exp.index)
+    assert np.allclose(res.to_numpy(), exp.to_numpy(), equal_nan=True)
+
+
+def test_read_month_from_cube_or_parquet(tmp_path):
+    index = pd.Index(np.arange(10, dtype=np.int32), name="cell")
+    df = pd.DataFrame(np.arange(30.0).reshape(10, 3), index=index)
+    df.columns = ["1-0", "1-1", "2-2"]
+    pq.write_table(df=df, file=tmp_path / "extracted_a_2020-1.pq")
+    cube.write(outputdir=tmp_path, variable="b", year=2020, months=[(1, df)])
+
+    kwargs = {"datadir": tmp_path, "year": 2020, "month": 1}
+    res_pq = _read_month(variable="a", **kwargs)
+    res_cube = _read_month(variable="b", **kwargs)
+    assert res_pq.equals(res_cube)
+    assert _read_index(variable="b", **kwargs).equals(index)
+    chunks = list(_iter_month(variable="b", chunksize=4, **kwargs))
+    assert [len(d) for d in chunks] == [4, 4, 2]
+
+
+def test_time_ranges_merge_yearly_partials(tmp_path):
+    rng = np.random.default_rng(42)
+    index = pd.Index(np.arange(20, dtype=np.int32), name="cell")
+    columns = [f"{d // 8 + 1}-{d}" for d in range(3 * 8)]  # 3 days
+    highs = []
+    for year in (2020, 2021):
+        data = rng.normal(loc=280.0, scale=5.0, size=(len(index), len(columns)))
+        df = pd.DataFrame(data, index=index, columns=columns)
+        highs.append(data.reshape(len(index), 3, 8).max(axis=2))
+        for var in (
+            "2m_temperature",
+            "significant_height_of_combined_wind_waves_and_swell",
+        ):
+            pq.write_table(df=df, file=tmp_path / f"extracted_{var}_{year}-1.pq")
+
+    temps(month=1, years=[2020, 2021], label="all", datadir=tmp_path)
+    waves(month=1, years=[2020, 2021], label="all", datadir=tmp_path)
+    assert (tmp_path / "partial_temp_2021_1.pq").is_file()
+
+    # extracted values are not needed anymore once partials exist
+    for file in tmp_path.glob("extracted_*"):
+        file.unlink()
+    temps(month=1, years=[2021], label="last", datadir=tmp_path)
+    waves(month=1, years=[2021], label="last", datadir=tmp_path)
+
+    res = pq.read_table(tmp_path / "aggregated_temp_all_1.pq")
+    exp = np.concatenate(highs, axis=1)
+    assert np.allclose(res["high_mean"], exp.mean(axis=1) - 273.15, atol=1e-4)
+    assert np.allclose(res["high_std"], exp.std(axis=1), atol=1e-4)
+    res = pq.read_table(tmp_path / "aggregated_temp_last_1.pq")
+    assert np.allclose(res["high_mean"], highs[1].mean(axis=1) - 273.15, atol=1e-4)
+
+    res_all = pq.read_table(tmp_path / "aggregated_wave_all_1.pq")
+    res_last = pq.read_table(tmp_path / "aggregated_wave_last_1.pq")
+    assert (res_all.to_numpy().sum(axis=1) == 2 * len(columns)).all()
+    assert (res_last.to_numpy().sum(axis=1) == len(columns)).all()
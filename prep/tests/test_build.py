@@ -0,0 +1,111 @@
+from functools import partial
+from pathlib import Path
+from src.build import Target, run
+from src.profiling import Profiler
+
+
+def _concat(inputs: list[Path], output: Path, suffix: str):
+    text = "".join(d.read_text() for d in inputs)
+    output.write_text(text + suffix)
+
+
+def _fail():
+    raise ValueError("broken")
+
+
+def _targets(tmp_path: Path, suffix="b", fail=False) -> list[Target]:
+    raw, mid, out = tmp_path / "raw.txt", tmp_path / "mid.txt", tmp_path / "out.txt"
+    fun = partial(_concat, inputs=[raw], output=mid, suffix=suffix)
+    # declared out of order, dependents must still wait
+    return [
+        Target(
+            name="second",
+            fun=partial(_concat, inputs=[mid], output=out, suffix="c"),
+            inputs=[mid],
+            outputs=[out],
+        ),
+        Target(
+            name="first",
+            fun=_fail if fail else fun,
+            inputs=[raw],
+            outputs=[mid],
+            params={"suffix": suffix},
+        ),
+    ]
+
+
+def test_run_builds_only_stale_targets(tmp_path: Path):
+    builddir = tmp_path / ".build"
+    raw, out = tmp_path / "raw.txt", tmp_path / "out.txt"
+    raw.write_text("a")
+
+    assert run(targets=_targets(tmp_path), builddir=builddir) == []
+    assert out.read_text() == "abc"
+    mtime = out.stat().st_mtime_ns
+
+    # up to date, in parallel too
+    assert run(targets=_targets(tmp_path), builddir=builddir, nproc=2) == []
+    assert out.stat().st_mtime_ns == mtime
+
+    # param changed
+    assert run(targets=_targets(tmp_path, suffix="B"), builddir=builddir) == []
+    assert out.read_text() == "aBc"
+
+    # input changed, with content hashes
+    raw.write_text("x")
+    assert (
+        run(targets=_targets(tmp_path, suffix="B"), builddir=builddir, hashing=True)
+        == []
+    )
+    assert out.read_text() == "xBc"
+
+    # output missing
+    out.unlink()
+    assert run(targets=_targets(tmp_path, suffix="B"), builddir=builddir, nproc=2) == []
+    assert out.read_text() == "xBc"
+
+
+def test_run_skips_dependents_of_failed_targets(tmp_path: Path):
+    builddir = tmp_path / ".build"
+    (tmp_path / "raw.txt").write_text("a")
+    failed = run(targets=_targets(tmp_path, fail=True), builddir=builddir, nproc=2)
+    assert failed == ["first", "second"]
+    assert not (tmp_path / "out.txt").exists()
+
+    # not stamped, so built once it works
+    assert run(targets=_targets(tmp_path), builddir=builddir) == []
+    assert (tmp_path / "out.txt").read_text() == "abc"
+
+
+def _count(inputs: list[Path], output: Path) -> int:
+    lines = [d.read_text() for d in inputs]
+    output.write_text("\n".join(lines))
+    return len(lines)
+
+
+def test_run_profiles_built_targets(tmp_path: Path):
+    raw, out = tmp_path / "raw.txt", tmp_path / "out.txt"
+    raw.write_text("a")
+    target = Target(
+        name="count/raw",
+        fun=partial(_count, inputs=[raw], output=out),
+        inputs=[raw],
+        outputs=[out],
+    )
+    for file in (tmp_path / "profile.json", tmp_path / "profile.csv"):
+        profiler = Profiler(file=file, nstacks=1, interval=0.001)
+        run(
+            targets=[target],
+            builddir=tmp_path / ".build",
+            force=True,
+            profiler=profiler,
+        )
+        profiler.write()
+        assert file.is_file()
+        assert (tmp_path / "profile_stacks" / "count_raw.txt").is_file()
+
+    (record,) = profiler.records
+    assert record["name"] == "count/raw" and record["stage"] == "count"
+    assert record["rows"] == 1
+    assert record["input_bytes"] == 1 and record["output_bytes"] == 1
+    assert record["wall_s"] >= 0 and record["peak_rss_bytes"] > 0
@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+from src import cube
+
+
+def _month(days: int, seed: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    index = pd.Index(np.array([3, 5, 8, 13], dtype=np.int32), name="cell")
+    columns = [f"{d}-{seed * 100 + d}" for d in range(1, days + 1)]
+    return pd.DataFrame(rng.normal(size=(4, days)), index=index, columns=columns)
+
+
+def test_write_and_read_months(tmp_path):
+    months = {1: _month(days=3, seed=1), 2: _month(days=2, seed=2)}
+    cube.write(outputdir=tmp_path, variable="a", year=2020, months=months.items())
+    assert cube.exists(datadir=tmp_path, variable="a", year=2020)
+    assert not cube.exists(datadir=tmp_path, variable="a", year=2021)
+
+    for month, df in months.items():
+        cells, columns, values = cube.read_month(
+            datadir=tmp_path, variable="a", year=2020, month=month
+        )
+        assert cells.tolist() == df.index.tolist()
+        assert columns == list(df.columns)
+        assert isinstance(values.base, np.memmap)
+        assert values.dtype == np.float32
+        assert np.allclose(values, df.to_numpy())
@@ -0,0 +1,68 @@
+from pathlib import Path
+import threading
+import time
+from src import download
+
+
+class _FakeCDS:
+    """Writes the requested month, fails months in fails as often as given"""
+
+    def __init__(self, fails: dict[str, int]):
+        self.fails = fails
+        self.requested: list[str] = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def retrieve(self, name: str, request: dict, target: str | None = None):
+        month = request["month"][0]
+        with self._lock:
+            self.requested.append(month)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.02)
+        with self._lock:
+            self.active -= 1
+            if self.fails.get(month, 0) > 0:
+                self.fails[month] -= 1
+                raise ConnectionError(f"request {month} failed")
+        assert target is not None
+        Path(target).write_text(f"{name} {month}")
+
+
+def _parts(tmp_path: Path) -> list[download.Part]:
+    return [
+        download.Part(
+            dataset="reanalysis",
+            request={"month": [f"{d:02d}"]},
+            file=tmp_path / f"raw_v_2020-{d}.grib",
+        )
+        for d in range(1, 7)
+    ]
+
+
+def _run(tmp_path: Path, cds: _FakeCDS) -> list[Path]:
+    return download.run(
+        parts=_parts(tmp_path),
+        outputdir=tmp_path,
+        nthreads=2,
+        client_factory=lambda: cds,
+        backoff=0.0,
+    )
+
+
+def test_downloads_run_concurrently_and_resume(tmp_path: Path):
+    cds = _FakeCDS(fails={"03": 1, "05": 10})
+
+    failed = _run(tmp_path, cds=cds)
+    assert failed == [tmp_path / "raw_v_2020-5.grib"]
+    assert cds.max_active == 2
+    assert cds.requested.count("03") == 2  # retried
+    assert (tmp_path / "raw_v_2020-3.grib").read_text() == "reanalysis 03"
+
+    # completed parts are skipped, incomplete ones requested again
+    cds.fails, cds.requested = {}, []
+    (tmp_path / "raw_v_2020-2.grib").write_text("trunc")
+    failed = _run(tmp_path, cds=cds)
+    assert failed == [] and sorted(cds.requested) == ["02", "05"]
+    assert list(tmp_path.glob("*.tmp")) == []
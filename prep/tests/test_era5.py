@@ -0,0 +1,27 @@
+from pathlib import Path
+import numpy as np
+from src import era5
+from src import grid
+from tests.rawfiles import grib1_message
+
+
+def test_extract_values_from_grib(tmp_path: Path):
+    lons = np.arange(-2, 2.25, 0.25)
+    lats = np.arange(3, -1.25, -0.25)
+    rng = np.random.default_rng(42)
+    values = [rng.normal(loc=280, scale=5, size=(len(lats), len(lons))) for _ in "ab"]
+    with open(tmp_path / "raw_2m_temperature_2021.grib", "wb") as fh:
+        fh.write(grib1_message(values[0], lons, lats, 2021, 1, 31, 21))
+        fh.write(grib1_message(values[1], lons, lats, 2021, 2, 1, 0))
+        fh.write(grib1_message(values[0], lons, lats, 2022, 2, 1, 0))
+
+    df = era5._extract_values(
+        month=2, variable="2m_temperature", inputdir=tmp_path, year=2021
+    )
+    assert df.columns.tolist() == ["1-1"]
+    lon_grid, lat_grid = np.meshgrid(lons, lats)
+    cells = grid.cell_ids(lons=lon_grid.flatten(), lats=lat_grid.flatten())
+    assert df.index.tolist() == sorted(cells)
+    expected = dict(zip(cells, values[1].flatten()))
+    res = df["1-1"].to_numpy()
+    assert np.allclose(res, [expected[d] for d in df.index], atol=1e-3)
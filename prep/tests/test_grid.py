@@ -0,0 +1,31 @@
+import numpy as np
+from src import grid
+
+
+def test_cell_ids_roundtrip():
+    lons = np.array([-180.0, -179.75, 0.0, 0.25, 179.75, 180.0])
+    lats = np.array([-70.0, 69.75, 0.0, -0.25, 12.5, 70.0])
+    cells = grid.cell_ids(lons=lons, lats=lats)
+    assert cells.tolist() == [
+        0,
+        559 * 1441 + 1,
+        280 * 1441 + 720,
+        279 * 1441 + 721,
+        330 * 1441 + 1439,
+        grid.NCELLS - 1,
+    ]
+    res_lons, res_lats = grid.coords(cells)
+    assert res_lons.tolist() == lons.tolist()
+    assert res_lats.tolist() == lats.tolist()
+
+
+def test_cell_ids_snap_to_grid():
+    cells = grid.cell_ids(lons=[10.1, 10.2], lats=[-5.05, -4.9])
+    lons, lats = grid.coords(cells)
+    assert lons.tolist() == [10.0, 10.25]
+    assert lats.tolist() == [-5.0, -5.0]
+
+
+def test_cell_ids_outside_grid():
+    cells = grid.cell_ids(lons=[-180.25, 180.25, 0.0, 0.0], lats=[0, 0, -70.25, 70.25])
+    assert cells.tolist() == [-1, -1, -1, -1]
@@ -1,5 +1,8 @@
+import numpy as np
 import pandas as pd
 from src import oras5
+from src import grid
+from tests import rawfiles
 
 
 def test_digitize():
@@ -11,3 +14,47 @@ def test_digitize():
     assert df.loc[3, "a"] == -175
     assert df.loc[4, "a"] == -170
     assert df.loc[5, "a"] == -170
+
+
+def test_regrid_like_digitize_and_groupby():
+    rng = np.random.default_rng(42)
+    lons = rng.uniform(-4, 4, size=2000)
+    lats = rng.uniform(-2, 2, size=2000)
+    values = rng.normal(size=(2000, 2))
+    values[:50, 0] = np.nan
+    values[rng.uniform(size=2000) < 0.1, 1] = np.nan
+
+    res = oras5._regrid(
+        lons=lons,
+        lats=lats,
+        values=values,
+        lon_range=(-4, 4),
+        lat_range=(-2, 2),
+        res=0.25,
+    )
+
+    df = pd.DataFrame(
+        {"lon": lons, "lat": lats, "l0": values[:, 0], "l1": values[:, 1]}
+    )
+    oras5._digitize(df=df, var="lon", interval=(-4, 4), res=0.25)
+    oras5._digitize(df=df, var="lat", interval=(-2, 2), res=0.25)
+    df.index = grid.cell_ids(lons=df.pop("lon"), lats=df.pop("lat"))
+    exp = df.groupby(level=0).mean()
+
+    assert res.index.tolist() == exp.index.tolist()
+    assert np.allclose(res.to_numpy(), exp.to_numpy(), equal_nan=True)
+
+
+def test_members_of_monthly_parts_or_yearly_archive(tmp_path):
+    var = "rotated_zonal_velocity"
+    ranges = {"lon_range": (-1.0, 1.0), "lat_range": (-1.0, 1.0)}
+    rawfiles.raw_oras5(datadir=tmp_path, variable=var, year=2020, months=[1], **ranges)
+    yearly = tmp_path / f"raw_{var}_2020.tar.gz"
+    yearly.rename(tmp_path / f"raw_{var}_2020-1.tar.gz")
+    rawfiles.raw_oras5(datadir=tmp_path, variable=var, year=2020, months=[2], **ranges)
+
+    kwargs = {"inputdir": tmp_path, "variable": var, "year": 2020}
+    assert oras5.raw_file(month=1, **kwargs).name == f"raw_{var}_2020-1.tar.gz"
+    assert oras5.raw_file(month=2, **kwargs) == yearly
+    members = oras5._iter_members_by_month(req_months=[2, 1], **kwargs)
+    assert sorted(d for d, _ in members) == [1, 2]
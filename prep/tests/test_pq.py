@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+from src import pq
+from src import grid
+
+
+def _index() -> pd.Index:
+    lons = np.array([-180.0, -179.75, 0.0, 179.75, 180.0])
+    lats = np.array([-70.0, -0.25, 0.0, 69.75, 70.0])
+    return pd.Index(grid.cell_ids(lons=lons, lats=lats), name="cell")
+
+
+def test_values_roundtrip_as_float32(tmp_path):
+    df = pd.DataFrame(
+        {"1-0": [280.1, 281.2, np.nan, 290.3, 270.4], "1-1": [1.0, 2, 3, 4, 5]},
+        index=_index(),
+    )
+    pq.write_table(df=df, file=tmp_path / "a.pq")
+    res = pq.read_table(tmp_path / "a.pq")
+    assert res.index.equals(df.index)
+    assert list(res.columns) == ["1-0", "1-1"]
+    assert all(d == np.float32 for d in res.dtypes)
+    assert np.allclose(res.to_numpy(), df.to_numpy(), equal_nan=True)
+
+
+def test_counts_roundtrip_as_uint(tmp_path):
+    df = pd.DataFrame({"1|1": [0, 1, 2, 3, 4], 2: [5, 6, 7, 8, 9]}, index=_index())
+    pq.write_table(df=df, file=tmp_path / "a.pq")
+    res = pq.read_table(tmp_path / "a.pq")
+    assert list(res.columns) == ["1|1", "2"]
+    assert all(d == np.uint16 for d in res.dtypes)
+    assert res.to_numpy().tolist() == df.to_numpy().tolist()
+
+    df.iloc[0, 0] = 2**16
+    pq.write_table(df=df, file=tmp_path / "b.pq")
+    res = pq.read_table(tmp_path / "b.pq")
+    assert all(d == np.uint32 for d in res.dtypes)
+    assert res.iloc[0, 0] == 2**16
+
+
+def test_read_index_and_chunks(tmp_path):
+    df = pd.DataFrame({"1-0": np.arange(5.0)}, index=_index())
+    pq.write_table(df=df, file=tmp_path / "a.pq", row_group_size=2)
+    assert pq.read_index(tmp_path / "a.pq").equals(df.index)
+    chunks = list(pq.iter_tables(tmp_path / "a.pq", chunksize=2))
+    assert [len(d) for d in chunks] == [2, 2, 1]
+    assert pd.concat(chunks).index.equals(df.index)
+    assert chunks[0]["1-0"].dtype == np.float32
+
+
+def test_read_lat_bands(tmp_path):
+    df = pd.DataFrame({"1-0": np.arange(5.0)}, index=_index())
+    bands = grid.lat_bands(10)
+    pq.write_table(df=df, file=tmp_path / "a.pq", bands=bands)
+    fh = pq.parquet.ParquetFile(tmp_path / "a.pq")
+    assert fh.num_row_groups == 5  # each cell in another band
+
+    band = (0, 281)
+    res = pq.read_table(tmp_path / "a.pq", lat_range=band)
+    assert res["1-0"].tolist() == [2.0, 3.0, 4.0]
+    chunks = list(pq.iter_tables(tmp_path / "a.pq", chunksize=2, lat_range=band))
+    assert pd.concat(chunks).equals(res)
+
+
+def test_read_lon_lat_indexed_files(tmp_path):
+    lons = [-180.0, 0.0, 180.0]
+    lats = [-70.0, 0.25, 70.0]
+    index = pd.MultiIndex.from_arrays([lons, lats], names=["lon", "lat"])
+    df = pd.DataFrame({"1-0": [1.0, 2.0, 3.0]}, index=index)
+    df.to_parquet(tmp_path / "a.pq")
+    res = pq.read_table(tmp_path / "a.pq")
+    assert res.index.name == "cell"
+    assert res.index.tolist() == grid.cell_ids(lons=lons, lats=lats).tolist()
+    assert pq.read_index(tmp_path / "a.pq").equals(res.index)
+    res = pq.read_table(tmp_path / "a.pq", lat_range=(1, 281))
+    assert res["1-0"].tolist() == [2.0, 3.0]
@@ -0,0 +1,22 @@
+import os
+import numpy as np
+from src.shm import SharedArrays, Workers
+
+
+def _square_rows(arrays: dict[str, np.ndarray], rows: slice):
+    arrays["y"][rows] = arrays["x"][rows] ** 2
+    arrays["pid"][rows] = os.getpid()
+
+
+def test_workers_process_several_sets_of_arrays():
+    pids = set()
+    with Workers(nproc=2) as workers:
+        for n in (10, 25, 3):
+            with SharedArrays() as arrays:
+                x = arrays.put("x", np.arange(n, dtype=np.float64))
+                arrays.zeros("y", shape=(n,), dtype=np.float64)
+                arrays.zeros("pid", shape=(n,), dtype=np.int64)
+                arrays.map_rows(_square_rows, nrows=n, workers=workers, chunksize=4)
+                assert np.array_equal(arrays["y"], x**2)
+                pids.update(arrays["pid"].tolist())
+    assert len(pids) <= 2 and os.getpid() not in pids
@@ -0,0 +1,272 @@
+from pathlib import Path
+import importlib.util
+import json
+import pickle
+import pytest
+import numpy as np
+import pandas as pd
+from src import aggregate
+from src import grid
+from src import pq
+from src import s3
+from src import upload
+from src import tilecodec
+from src.upload import _Tiles, _build_records, _qrtr_mile_grid
+
+
+def _table(lons: np.ndarray, lats: np.ndarray, seed: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    index = pd.Index(grid.cell_ids(lons=lons, lats=lats), name="cell")
+    values = rng.integers(0, 3, size=(len(index), 2)).astype(float)
+    values[rng.random(len(index)) < 0.2, 0] = np.nan
+    return pd.DataFrame(values, index=index, columns=["a", "b"])
+
+
+def test_build_records_like_lookups():
+    lons, lats = np.meshgrid(np.arange(-2, 2, 0.25), np.arange(-1, 1, 0.25))
+    df = _table(lons=lons.flatten(), lats=lats.flatten(), seed=1).sample(
+        frac=0.7, random_state=1
+    )
+    keep = ~df.isna().any(axis=1).to_numpy()
+    tables = {"all": _Tiles(df), "no_nan": _Tiles(df, keep=keep)}
+    tiles = [(-3, 0), (-2, -1), (0, 0), (1, -1), (5, 5)]
+    records = list(_build_records(tables, tiles=tiles))
+
+    assert len(records) == len(tiles)
+    for (lon, lat), record in zip(tiles, records):
+        exp_record = {}
+        for lat_add, lng_add in _qrtr_mile_grid():
+            pos = (lon + lng_add, lat + lat_add)
+            cell = int(grid.cell_ids(lons=pos[0], lats=pos[1]))
+            data = {}
+            if cell in df.index:
+                row = df.loc[cell]
+                data["all"] = row.to_dict()
+                if not row.isna().any():
+                    data["no_nan"] = row.to_dict()
+            exp_record[pos] = data
+        assert list(record) == list(exp_record)
+        assert str(record) == str(exp_record)
+
+
+def _write_aggregates(
+    datadir, label: str, month: int, cells: np.ndarray, prefix="aggregated"
+):
+    index = pd.Index(cells, name="cell")
+    n = len(cells)
+    columns = {
+        "rain": ["daily_mean", "daily_std"],
+        "temp": ["high_mean", "high_std", "low_mean", "low_std"],
+        "seatemp": ["high_mean", "high_std", "low_mean", "low_std"],
+        "wind": ["1|1", "1|2"],
+        "current": ["1|1", "1|2"],
+        "wave": ["1", "2"],
+    }
+    for name, cols in columns.items():
+        values = np.arange(n * len(cols)).reshape(n, len(cols))
+        if name not in ("wind", "current", "wave"):
+            values = values.astype(float)
+        df = pd.DataFrame(values, index=index, columns=cols)
+        pq.write_table(df=df, file=datadir / f"{prefix}_{name}_{label}_{month}.pq")
+
+
+def _all_data(datadir, **kwargs):
+    upload.all_data(
+        month=3,
+        label="x",
+        nprocs=2,
+        nthreads=3,
+        version="v",
+        datadir=datadir,
+        lon_range=(-1, 1),
+        lat_range=(0, 1),
+        chunksize=2,
+        queuesize=1,
+        backoff=0.0,
+        **kwargs,
+    )
+
+
+def test_all_data_uploads_changed_tiles_once_and_resumes(tmp_path, monkeypatch, capsys):
+    lons, lats = np.meshgrid(np.arange(-1, 2, 0.25), np.arange(0, 2, 0.25))
+    cells = grid.cell_ids(lons=lons.flatten(), lats=lats.flatten())
+    _write_aggregates(datadir=tmp_path, label="x", month=3, cells=cells)
+
+    bucket: dict[str, bytes] = {}
+    puts: list[str] = []
+    broken = {"v/x/3/1/0/data.pkl"}
+    flaky = {"v/x/3/0/0/data.pkl"}
+
+    def put_bytes(key: str, body: bytes):
+        if key in broken:
+            raise ConnectionError("no")
+        if key in flaky:
+            flaky.remove(key)
+            raise ConnectionError("not yet")
+        puts.append(key)
+        bucket[key] = body
+
+    monkeypatch.setattr(s3, "put_bytes", put_bytes)
+    monkeypatch.setattr(s3, "get_bytes", lambda key: bucket.get(key))
+    with pytest.raises(RuntimeError):
+        _all_data(datadir=tmp_path)
+
+    tiles = [d for d in puts if d.endswith("data.pkl")]
+    assert len(tiles) == 5
+    assert "v/x/3/1/0/data.pkl" not in bucket
+    record = pickle.loads(bucket["v/x/3/0/-1/data.pkl"])
+    assert len(record) == 16
+    assert len(record[(-0.75, 0.5)]) == 6
+    assert record[(-0.75, 0.5)]["winds"] == {("1", "1"): 50, ("1", "2"): 51}
+
+    # only the failed tile and the manifest are uploaded again
+    broken.clear()
+    puts.clear()
+    _all_data(datadir=tmp_path)
+    assert sorted(puts) == ["v/x/3/1/0/data.pkl", "v/x/3/manifest.json"]
+
+    capsys.readouterr()
+    upload.check(
+        version="v", labels=["x"], months=[3], lon_range=(-1, 1), lat_range=(0, 1)
+    )
+    assert "0 objects are missing" in capsys.readouterr().out
+
+    # resume skips all tiles of the journal
+    puts.clear()
+    del bucket["v/x/3/manifest.json"]
+    _all_data(datadir=tmp_path, resume=True)
+    assert puts == ["v/x/3/manifest.json"]
+    assert len(json.loads(bucket["v/x/3/manifest.json"])) == 6
+
+
+def test_all_data_reports_failed_keys_when_manifest_fails_too(tmp_path, monkeypatch):
+    cells = grid.cell_ids(lons=np.array([0.25]), lats=np.array([0.0]))
+    _write_aggregates(datadir=tmp_path, label="x", month=3, cells=cells)
+
+    def put_bytes(key: str, body: bytes):
+        raise ConnectionError(f"outage {key}")
+
+    monkeypatch.setattr(s3, "put_bytes", put_bytes)
+    monkeypatch.setattr(s3, "get_bytes", lambda key: None)
+    with pytest.raises(RuntimeError, match="keys failed") as excinfo:
+        _all_data(datadir=tmp_path)
+    assert "manifest.json" in str(excinfo.value.__cause__)
+
+
+def _merge_moments():
+    """merge_moments of the backend, which reads per-year tiles"""
+    file = Path(__file__).parents[2] / "backend" / "src" / "src" / "utils.py"
+    spec = importlib.util.spec_from_file_location("backend_utils", file)
+    assert spec is not None and spec.loader is not None
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.merge_moments
+
+
+def _write_partials(datadir, year: int, month: int, cells: np.ndarray) -> dict:
+    """Write partials with count, sum and sum of squares like aggregate"""
+    _write_aggregates(
+        datadir=datadir, label=str(year), month=month, cells=cells, prefix="partial"
+    )
+    rng = np.random.default_rng(year)
+    samples = {}
+    names = {"temp": ["high", "low"], "seatemp": ["high", "low"], "rain": ["daily"]}
+    for table, cols in names.items():
+        data = {}
+        for name in cols:
+            values = rng.normal(loc=290, scale=5, size=(len(cells), 10 + year % 7))
+            moments = aggregate._Moments(n=len(cells))
+            for value in values.T:
+                moments.update(value)
+            data.update(aggregate._sums(moments, name=name))
+            samples[(table, name)] = values
+        df = pd.DataFrame(data, index=pd.Index(cells, name="cell"))
+        file = datadir / f"partial_{table}_{year}_{month}.pq"
+        pq.write_table(df=df, file=file, float_dtype=np.float64)  # like aggregate
+    return samples
+
+
+def test_all_data_uploads_partials_below_prefix(tmp_path, monkeypatch):
+    cells = grid.cell_ids(lons=np.array([0.25, 1.5]), lats=np.array([0.0, 0.75]))
+    samples = [
+        _write_partials(tmp_path, year=d, month=3, cells=cells) for d in (2020, 2021)
+    ]
+    bucket: dict[str, bytes] = {}
+    monkeypatch.setattr(s3, "put_bytes", lambda key, body: bucket.update({key: body}))
+    monkeypatch.setattr(s3, "get_bytes", lambda key: bucket.get(key))
+    for year in ("2020", "2021"):
+        upload.all_data(
+            month=3,
+            label=year,
+            nprocs=1,
+            nthreads=1,
+            version="v",
+            datadir=tmp_path,
+            lon_range=(0, 1),
+            lat_range=(0, 0),
+            prefix="partial",
+        )
+    assert sorted(d for d in bucket if d.startswith("v/partial/2020/")) == [
+        "v/partial/2020/3/0/0/data.pkl",
+        "v/partial/2020/3/0/1/data.pkl",
+        "v/partial/2020/3/manifest.json",
+    ]
+    records = [
+        pickle.loads(bucket[f"v/partial/{d}/3/0/0/data.pkl"])[(0.25, 0.0)]
+        for d in ("2020", "2021")
+    ]
+    assert list(records[0]["temps"]) == [
+        "highCount",
+        "highSum",
+        "highSumsq",
+        "lowCount",
+        "lowSum",
+        "lowSumsq",
+    ]
+    assert list(records[0]["rains"]) == ["dailyCount", "dailySum", "dailySumsq"]
+
+    # the backend merges years into mean and std of all their samples
+    merge_moments = _merge_moments()
+    for key, table, name in [
+        ("temps", "temp", "high"),
+        ("seatemps", "seatemp", "low"),
+        ("rains", "rain", "daily"),
+    ]:
+        merged = merge_moments([d[key] for d in records], names=[name])
+        values = np.concatenate([d[(table, name)][0] for d in samples])
+        assert merged[f"{name}Mean"] == pytest.approx(values.mean())
+        assert merged[f"{name}Std"] == pytest.approx(values.std())
+
+
+def test_all_data_compresses_tiles_with_dictionary(tmp_path, monkeypatch):
+    lons, lats = np.meshgrid(np.arange(-1, 2, 0.25), np.arange(0, 2, 0.25))
+    cells = grid.cell_ids(lons=lons.flatten(), lats=lats.flatten())
+    _write_aggregates(datadir=tmp_path, label="x", month=3, cells=cells)
+    file = upload.train_dictionary(
+        version="v",
+        sources=[("x", "aggregated"), ("2020", "partial")],
+        months=[3],
+        datadir=tmp_path,
+        lon_range=(-20, 20),
+        lat_range=(-10, 10),
+        ntiles=500,
+    )
+    assert file == tmp_path / "dicts" / "v.zdict"
+
+    bucket: dict[str, bytes] = {}
+    monkeypatch.setattr(s3, "put_bytes", lambda key, body: bucket.update({key: body}))
+    monkeypatch.setattr(s3, "get_bytes", lambda key: bucket.get(key))
+    _all_data(datadir=tmp_path)
+    plain = dict(bucket)
+    bucket.clear()
+    _all_data(datadir=tmp_path, dictionary=file)
+
+    dctx = tilecodec.decompressor(file.read_bytes())
+    for key, body in bucket.items():
+        if key.endswith("data.pkl"):
+            assert body[:4] == tilecodec.MAGIC
+            assert len(body) < len(plain[key])
+            assert tilecodec.decode(body, dctx=dctx) == pickle.loads(plain[key])
+    assert tilecodec.decode(plain["v/x/3/0/-1/data.pkl"]) == pickle.loads(
+        plain["v/x/3/0/-1/data.pkl"]
+    )
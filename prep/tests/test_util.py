@@ -0,0 +1,30 @@
+import io
+import tarfile
+import zipfile
+from src.util import iter_archive_members
+
+FILES = {"a_202001.nc": b"jan", "readme.txt": b"hi", "a_202002.nc": b"feb"}
+
+
+def _select(name: str) -> bool:
+    return name.endswith(".nc")
+
+
+def test_iter_tar_members(tmp_path):
+    archive = tmp_path / "raw.tar.gz"
+    with tarfile.open(archive, "w:gz") as fh:
+        for name, content in FILES.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            fh.addfile(info, io.BytesIO(content))
+    res = list(iter_archive_members(archive=archive, select=_select))
+    assert res == [("a_202001.nc", b"jan"), ("a_202002.nc", b"feb")]
+
+
+def test_iter_zip_members(tmp_path):
+    archive = tmp_path / "raw.tar.gz"  # CDS sometimes sends zip files
+    with zipfile.ZipFile(archive, "w") as fh:
+        for name, content in FILES.items():
+            fh.writestr(name, content)
+    res = list(iter_archive_members(archive=archive, select=_select))
+    assert res == [("a_202001.nc", b"jan"), ("a_202002.nc", b"feb")]
@@ -0,0 +1,138 @@
+from functools import partial
+from multiprocessing import Process
+from pathlib import Path
+import time
+import main
+from src.build import Target
+from src.workqueue import WorkQueue, work
+
+
+def _concat(inputs: list[Path], output: Path):
+    time.sleep(0.05)
+    output.write_text("".join(d.read_text() for d in inputs) + output.stem)
+
+
+def _slow(log: Path, output: Path):
+    with open(log, "a", encoding="utf-8") as fh:
+        fh.write("built\n")
+    time.sleep(1.5)
+    output.write_text("slow")
+
+
+def _fail():
+    raise ValueError("broken")
+
+
+def _target(tmp_path: Path, name: str, inputs: list[str], fail=False) -> Target:
+    inputs_ = [tmp_path / f"{d}.txt" for d in inputs]
+    output = tmp_path / f"{name}.txt"
+    fun = _fail if fail else partial(_concat, inputs=inputs_, output=output)
+    return Target(name=name, fun=fun, inputs=inputs_, outputs=[output])
+
+
+def _work(file: Path, builddir: Path, worker: str):
+    queue = WorkQueue(file=file, lease_s=5)
+    work(queue=queue, builddir=builddir, worker=worker, poll_s=0.01)
+
+
+def test_workers_drain_queue_in_dependency_order(tmp_path: Path):
+    (tmp_path / "raw.txt").write_text("")
+    # extract -> partials -> aggregated, one broken partial
+    targets = [_target(tmp_path, f"e{d}", inputs=["raw"]) for d in range(4)]
+    targets += [_target(tmp_path, f"p{d}", inputs=[f"e{d}"]) for d in range(4)]
+    targets += [_target(tmp_path, "bad", inputs=["e0"], fail=True)]
+    targets += [_target(tmp_path, "agg", inputs=[f"p{d}" for d in range(4)])]
+    targets += [_target(tmp_path, "lost", inputs=["agg", "bad"])]
+    file, builddir = tmp_path / "queue.sqlite", tmp_path / ".build"
+    queue = WorkQueue(file=file)
+    queue.put(targets=targets, max_attempts=2)
+
+    procs = [Process(target=_work, args=(file, builddir, f"w{d}")) for d in range(3)]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join(timeout=60)
+        assert proc.exitcode == 0
+
+    assert (tmp_path / "agg.txt").read_text() == "e0p0e1p1e2p2e3p3agg"
+    assert queue.counts() == {"done": 9, "failed": 2}
+    assert queue.failed() == [
+        ("bad", "ValueError('broken')"),
+        ("lost", "inputs failed"),
+    ]
+
+    # queued again, up to date targets are not built again
+    mtime = (tmp_path / "agg.txt").stat().st_mtime_ns
+    queue.put(targets=targets[:8] + targets[9:10])
+    assert work(queue=queue, builddir=builddir, worker="w") == 9
+    assert (tmp_path / "agg.txt").stat().st_mtime_ns == mtime
+
+
+def test_expired_leases_are_retried(tmp_path: Path):
+    (tmp_path / "raw.txt").write_text("")
+    queue = WorkQueue(file=tmp_path / "queue.sqlite", lease_s=0.2)
+    queue.put(targets=[_target(tmp_path, "e", inputs=["raw"])], max_attempts=2)
+
+    # first worker dies after leasing
+    leased = queue.lease(worker="dead")
+    assert leased is not None and leased.name == "e"
+    assert queue.lease(worker="w") is None and not queue.is_drained()
+    time.sleep(0.3)
+    assert work(queue=queue, builddir=tmp_path / ".build", worker="w") == 1
+    assert queue.counts() == {"done": 1}
+    assert (tmp_path / "e.txt").read_text() == "e"
+
+    # a late finish of the dead worker is ignored
+    queue.finish(name="e", worker="dead", error="late")
+    assert queue.counts() == {"done": 1}
+
+
+def _work_short_lease(file: Path, builddir: Path, worker: str):
+    queue = WorkQueue(file=file, lease_s=0.6)
+    work(queue=queue, builddir=builddir, worker=worker, poll_s=0.01)
+
+
+def test_heartbeats_keep_lease_of_long_job(tmp_path: Path):
+    log, output = tmp_path / "log.txt", tmp_path / "slow.txt"
+    target = Target(
+        name="slow",
+        fun=partial(_slow, log=log, output=output),
+        inputs=[],
+        outputs=[output],
+    )
+    file = tmp_path / "queue.sqlite"
+    queue = WorkQueue(file=file, lease_s=0.6)
+    queue.put(targets=[target], max_attempts=2)
+
+    args = (file, tmp_path / ".build")
+    procs = [Process(target=_work_short_lease, args=(*args, f"w{d}")) for d in range(2)]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join(timeout=60)
+        assert proc.exitcode == 0
+
+    assert log.read_text() == "built\n"
+    assert queue.counts() == {"done": 1}
+
+
+def test_enqueue_upload_targets(tmp_path: Path):
+    file = tmp_path / "queue.sqlite"
+    for partials in ([], ["--partials"]):
+        args = ["--years", "2020", "2021", "--months", "1"]
+        args += ["--outputdir", str(tmp_path), "enqueue", "upload", "--version", "v1"]
+        main.main(vars(main._parser().parse_args(args + partials)))
+
+    # 2 timeranges and 2 per-year partials, retried uploads resume
+    queue = WorkQueue(file=file)
+    assert queue.counts() == {"pending": 4}
+    names = []
+    while (target := queue.lease(worker="w")) is not None:
+        assert isinstance(target.fun, partial) and target.fun.keywords["resume"]
+        names.append(target.name)
+    assert names == [
+        "upload/v1/2021/1",
+        "upload/v1/2020-2021/1",
+        "upload/v1/partial/2020/1",
+        "upload/v1/partial/2021/1",
+    ]